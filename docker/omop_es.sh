@@ -21,13 +21,50 @@ tolower() {
 	echo "$1" | tr '[:upper:]' '[:lower:]'
 }
 
+# Mark the start of a phase of the run, which lasts until the next phase starts.
+# The Prefect flow turns these into the duration of each phase.
+phase() {
+	echo "[PHASE] $1 $(date +%s.%N)"
+}
+
+# Restore the dependencies, unless the library already matches renv.lock
+restore_dependencies() {
+	LOCKFILE_HASH=$(sha256sum renv.lock | cut -d ' ' -f 1)
+	if [ -f "$BAKED_LOCKFILE_HASH_FILE" ] && [ "$LOCKFILE_HASH" = "$(cat $BAKED_LOCKFILE_HASH_FILE)" ]; then
+		echo "Dependencies in the image match renv.lock, skipping restore"
+	elif [ -f "$RESTORED_LOCKFILE_HASH_FILE" ] && [ "$LOCKFILE_HASH" = "$(cat $RESTORED_LOCKFILE_HASH_FILE)" ]; then
+		echo "Dependencies restored when warming up the container, skipping restore"
+	else
+		echo "Installing dependencies..."
+		# Disable pak as this invalidates where we expect the cache to be
+		Rscript -e "options(Ncpus=4, renv.config.pak.enabled=FALSE); renv::restore()"
+		echo "$LOCKFILE_HASH" >"$RESTORED_LOCKFILE_HASH_FILE"
+	fi
+}
+
+# "warm" to warm up a long-lived container that runs are dispatched into with
+# docker exec, see container_pool.py in the Prefect flows; "run" otherwise
+MODE="${1:-run}"
+
 # Define all variables
 # Git variables are coming from the '.env' file
 OMOP_ES_DIR="omop_es"
+OMOP_ES_MIRROR="/mirror/omop_es.git"
+# Hash of the renv.lock whose library was restored when building the image
+BAKED_LOCKFILE_HASH_FILE="/app/renv.lock.sha256"
+# Hash of the renv.lock whose library was restored in this container
+RESTORED_LOCKFILE_HASH_FILE="/tmp/renv.lock.sha256"
+# Commit a warm container is ready to run, written once it has warmed up
+WARM_MARKER="/tmp/omop_es.warm"
+# Snapshots of the dev mock database, mounted from the host
+MOCKDB_SOURCES="source_access/UCLH/mock_database"
+MOCKDB_SNAPSHOT_DIR="/mockdb"
+MOCKDB_SNAPSHOTS_TO_KEEP=5
 
 DEBUG=$(tolower ${DEBUG:-false})
 BATCHED=$(tolower ${BATCHED:-false})
 ZIP_OUTPUT=$(tolower ${ZIP_OUTPUT:-false})
+REBUILD_MOCKDB=$(tolower ${REBUILD_MOCKDB:-false})
 
 # The following variables are relative to the OMOP_ES directory
 MAIN_BATCHED="./main/batched.R"
@@ -35,10 +72,41 @@ MAIN_COMMAND="./main/command.R"
 
 cd $OMOP_ES_DIR
 
-# Check out the specified version
-git fetch --all --tags --quiet
-echo "Running omop_es from ref: ${OMOP_ES_VERSION}"
-git checkout "${OMOP_ES_VERSION}"
+phase checkout
+if [ -f "$WARM_MARKER" ]; then
+	# Dispatched into a warm container: start from a clean checkout of the commit it
+	# warmed up for, keeping ignored files such as the restored library
+	WARM_COMMIT=$(cat "$WARM_MARKER")
+	if [ "$(git rev-parse "${OMOP_ES_VERSION}")" != "$WARM_COMMIT" ]; then
+		echo "[ERROR] Warm container is for omop_es $WARM_COMMIT, not ${OMOP_ES_VERSION}"
+		exit 1
+	fi
+	echo "Running omop_es from ref: ${OMOP_ES_VERSION} in a warm container"
+	git checkout --force --quiet "$WARM_COMMIT"
+	git clean -d --force --quiet
+else
+	# Check out the specified version, fetching from the local mirror of omop_es
+	# mounted at the clone's origin
+	if [ -f "$OMOP_ES_MIRROR/HEAD" ]; then
+		git fetch --tags --quiet origin
+		# Commits on no branch or tag, e.g. of pull requests, are only in the mirror
+		# under refs/pinned, so fetch them by SHA
+		if ! git cat-file -e "${OMOP_ES_VERSION}^{commit}" 2>/dev/null; then
+			git fetch --quiet origin "${OMOP_ES_VERSION}"
+		fi
+	else
+		echo "[WARNING] No omop_es mirror mounted at $OMOP_ES_MIRROR, using the version from the image"
+	fi
+	echo "Running omop_es from ref: ${OMOP_ES_VERSION}"
+	git checkout "${OMOP_ES_VERSION}"
+fi
+
+if [ "$MODE" = "warm" ]; then
+	restore_dependencies
+	git rev-parse HEAD >"$WARM_MARKER"
+	echo "Container warmed up for omop_es ${OMOP_ES_VERSION}, waiting for runs"
+	exec sleep infinity
+fi
 
 # Run the batched process if specified, otherwise run the simple process
 # Variables are passed through from the environment
@@ -47,12 +115,25 @@ if [ $BATCHED = "true" ]; then
 	CMD="Rscript $MAIN_BATCHED --settings_id $SETTINGS_ID"
 	# Add on extra CLI arguments if they're filled
 	[ -n "$OUTPUT_DIRECTORY" ] && CMD="$CMD --output_directory $OUTPUT_DIRECTORY"
+	# Only extract a single partition of the batched run, if set by the Prefect flow.
+	# Fail rather than extract everything in each partition if batched.R can't
+	if [ -n "${PARTITION_BY:-}" ]; then
+		if ! grep -q "partition_by" "$MAIN_BATCHED"; then
+			echo "[ERROR] $MAIN_BATCHED of omop_es ${OMOP_ES_VERSION} doesn't support partitions"
+			exit 1
+		fi
+		CMD="$CMD --partition_by $PARTITION_BY --partition_start $PARTITION_START --partition_end $PARTITION_END"
+	fi
 else
 	CMD="Rscript $MAIN_COMMAND --settings_id $SETTINGS_ID"
 fi
 
 ## Add on extra CLI arguments if they're filled
 [ $ZIP_OUTPUT = "true" ] && CMD="$CMD --zip_output"
+# Skip the tables or batches completed by earlier attempts, recorded by the Prefect flow
+[ -s "${COMPLETED_UNITS_FILE:-}" ] && CMD="$CMD --skip_units_file $COMPLETED_UNITS_FILE"
+# Only extract the changes since the watermarks of an incremental run, set by the Prefect flow
+[ -s "${WATERMARKS_FILE:-}" ] && CMD="$CMD --watermarks_file $WATERMARKS_FILE"
 
 # If in debug mode, only print the command
 if [ "$DEBUG" = "true" ]; then
@@ -60,15 +141,78 @@ if [ "$DEBUG" = "true" ]; then
 	exit 0
 fi
 
-echo "Installing dependencies..."
-# Disable pak as this invalidates where we expect the cache to be
-Rscript -e "options(Ncpus=4, renv.config.pak.enabled=FALSE); renv::restore()"
+phase renv_restore
+# Only restore dependencies if renv.lock has changed since the image was built,
+# which is only the case when running a different version to the image's
+RESTORE_START=$(date +%s)
+restore_dependencies
+echo "[METRIC] renv_restore_seconds=$(($(date +%s) - RESTORE_START))"
 
+# Restore the mock database from a snapshot if one exists for this commit and
+# mock database sources, otherwise recreate it and snapshot the files it created
 if [ "$ENVIRONMENT" = "dev" ]; then
-	echo "Recreating mock database..."
-	Rscript source_access/UCLH/mock_database/recreate_mockdb.R
+	phase mockdb
+	MOCKDB_START=$(date +%s)
+	MOCKDB_SOURCES_HASH=$(find "$MOCKDB_SOURCES" -type f -print0 | sort -z | xargs -0 sha256sum | sha256sum | cut -c 1-16)
+	MOCKDB_SNAPSHOT="$MOCKDB_SNAPSHOT_DIR/mockdb-$(git rev-parse HEAD)-$MOCKDB_SOURCES_HASH.tar.gz"
+	# A snapshot without any files would restore nothing, and never be replaced
+	if [ -f "$MOCKDB_SNAPSHOT" ] && [ -z "$(tar -tzf "$MOCKDB_SNAPSHOT" 2>/dev/null | head -n 1)" ]; then
+		echo "[WARNING] Mock database snapshot $MOCKDB_SNAPSHOT is empty or unreadable, removing it"
+		rm -f "$MOCKDB_SNAPSHOT"
+	fi
+	if [ "$REBUILD_MOCKDB" != "true" ] && [ -f "$MOCKDB_SNAPSHOT" ]; then
+		echo "Restoring mock database from $MOCKDB_SNAPSHOT..."
+		tar -xzf "$MOCKDB_SNAPSHOT"
+		echo "[METRIC] mockdb_snapshot_hit=1"
+	else
+		echo "Recreating mock database..."
+		MOCKDB_MARKER=$(mktemp)
+		Rscript "$MOCKDB_SOURCES/recreate_mockdb.R"
+		echo "[METRIC] mockdb_snapshot_hit=0"
+		if [ -d "$MOCKDB_SNAPSHOT_DIR" ] && [ -w "$MOCKDB_SNAPSHOT_DIR" ]; then
+			MOCKDB_FILES=$(mktemp)
+			find . -path ./.git -prune -o -path ./renv -prune -o -type f -newer "$MOCKDB_MARKER" -print0 >"$MOCKDB_FILES"
+			if [ -s "$MOCKDB_FILES" ]; then
+				echo "Saving mock database snapshot to $MOCKDB_SNAPSHOT..."
+				# Write to a temporary file first, as concurrent runs may be saving the same snapshot
+				tar -czf "$MOCKDB_SNAPSHOT.$$" --null -T "$MOCKDB_FILES"
+				mv "$MOCKDB_SNAPSHOT.$$" "$MOCKDB_SNAPSHOT"
+				# Only keep the most recent snapshots
+				ls -1t "$MOCKDB_SNAPSHOT_DIR"/mockdb-*.tar.gz | tail -n +$((MOCKDB_SNAPSHOTS_TO_KEEP + 1)) | xargs -r rm -f
+			else
+				echo "[WARNING] Recreating the mock database wrote no files under $(pwd), not saving snapshot"
+			fi
+			rm -f "$MOCKDB_FILES"
+		else
+			echo "[WARNING] No mock database snapshot directory mounted at $MOCKDB_SNAPSHOT_DIR, not saving snapshot"
+		fi
+		rm -f "$MOCKDB_MARKER"
+	fi
+	echo "[METRIC] mockdb_seconds=$(($(date +%s) - MOCKDB_START))"
+fi
+
+# Profile every R process of the extraction with Rprof, if requested by the Prefect
+# flow, each into its own file in PROFILE_DIRECTORY. R only reads the project's
+# .Rprofile, which activates renv, if R_PROFILE_USER isn't set, so ours sources it.
+if [ -n "${PROFILE_DIRECTORY:-}" ]; then
+	mkdir -p "$PROFILE_DIRECTORY"
+	PROFILE_SCRIPT=$(mktemp --suffix .R)
+	cat >"$PROFILE_SCRIPT" <<-EOF
+		if (file.exists(".Rprofile")) source(".Rprofile")
+		Rprof(
+		  file.path(Sys.getenv("PROFILE_DIRECTORY"), paste0(Sys.getpid(), ".Rprof")),
+		  interval = 0.02,
+		  memory.profiling = TRUE
+		)
+		reg.finalizer(globalenv(), function(e) Rprof(NULL), onexit = TRUE)
+	EOF
+	export R_PROFILE_USER="$PROFILE_SCRIPT"
+	echo "Profiling omop_es into $PROFILE_DIRECTORY"
 fi
 
+# Includes zipping the output, if requested
+phase extract
 echo "Running omop_es for ${SETTINGS_ID}..."
 
 $CMD
+phase done
@@ -0,0 +1,112 @@
+#  Copyright (c) University College London Hospitals NHS Foundation Trust
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+################################################################################
+
+"""
+End-to-end latency of the run_omop_es flows, with the stand-in for omop_es
+doing next to no work, so what is measured is the overhead of orchestration:
+updating the mirror, pinning the version, task runs and the Prefect API.
+"""
+
+import shutil
+
+import pytest
+from prefect import flow
+
+import run_omop_es
+from metrics import MetricsCollector
+
+
+@pytest.fixture(autouse=True)
+def quiet_fake(monkeypatch):
+    monkeypatch.setenv("FAKE_LINES", "100")
+    monkeypatch.setenv("FAKE_UNITS", "4")
+
+
+def test_run_omop_es_latency(measure, prefect_test_server, fake_omop_es):
+    measure(
+        lambda: run_omop_es.run_omop_es(settings_id="bench"),
+        unit="flows",
+        rounds=3,
+    )
+
+
+def test_run_omop_es_projects_latency(measure, prefect_test_server, fake_omop_es):
+    settings_ids = [f"bench_{i}" for i in range(8)]
+    measure(
+        lambda: run_omop_es.run_omop_es_projects(
+            settings_ids=settings_ids, max_concurrency=4
+        ),
+        items=len(settings_ids),
+        unit="projects",
+        rounds=3,
+    )
+
+
+def test_run_omop_es_partitioned_latency(measure, prefect_test_server, fake_omop_es):
+    output = fake_omop_es / "bench"
+
+    def run_partitioned():
+        shutil.rmtree(output, ignore_errors=True)
+        run_omop_es.run_omop_es(
+            settings_id="bench",
+            batched=True,
+            output_directory=str(output),
+            partition_by="person_id",
+            partition_start="0",
+            partition_end="4000",
+            partitions=4,
+            max_parallel_partitions=4,
+        )
+
+    measure(run_partitioned, items=4, unit="partitions", rounds=3)
+
+
+def test_run_omop_es_docker_retries(
+    measure, prefect_test_server, fake_omop_es, monkeypatch, tmp_path
+):
+    """
+    Retry a container that fails halfway through its units twice: later attempts
+    skip the units checkpointed by earlier ones.
+    """
+    state_file = tmp_path / "attempts"
+    monkeypatch.setenv("FAKE_FAIL_ATTEMPTS", "2")
+    monkeypatch.setenv("FAKE_STATE_FILE", str(state_file))
+    run_with_fast_retries = run_omop_es.run_omop_es_docker.with_options(
+        retries=2, retry_delay_seconds=0
+    )
+
+    @flow
+    def retry_flow():
+        return run_with_fast_retries(
+            working_dir=tmp_path,
+            settings_id="bench",
+            omop_es_version="master",
+            batched=False,
+            output_directory="",
+            zip_output=False,
+        )
+
+    def run_with_retries():
+        state_file.unlink(missing_ok=True)
+        result = retry_flow()
+        metrics = MetricsCollector()
+        for line in result.stdout.splitlines():
+            metrics(line)
+        measure.extra["attempts"] = int(state_file.read_text())
+        measure.extra["units_in_last_attempt"] = int(
+            metrics.metrics["fake_units_extracted"]
+        )
+
+    measure(run_with_retries, unit="flows", rounds=3)
@@ -0,0 +1,64 @@
+#  Copyright (c) University College London Hospitals NHS Foundation Trust
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+################################################################################
+
+"""
+Compare forwarding container output to a logger one record per line (the
+`log` function) against batching it through `LogForwarder`, to a logger
+whose handler serialises every record like the Prefect API log handler.
+"""
+
+import run_subprocess
+
+N_LINES = 50_000
+# Mostly progress lines, with the odd warning in between
+LINES = [
+    f"[{'WARNING' if i % 100 == 99 else 'INFO'}] Writing rows {i * 1000} to "
+    f"{i * 1000 + 999} of table measurement\n"
+    for i in range(N_LINES)
+]
+
+
+def test_log_per_line(measure, serialising_logger):
+    encoded = [line.encode() for line in LINES]
+
+    def forward_per_line():
+        for line in encoded:
+            run_subprocess.log(line, serialising_logger)
+
+    measure(forward_per_line, items=N_LINES, unit="lines")
+    measure.extra["records"] = serialising_logger.handlers[0].records // 5
+
+
+def test_log_forwarder(measure, serialising_logger):
+    def forward_batched():
+        # Without rate limits, so both benchmarks emit every line
+        forwarder = run_subprocess.LogForwarder(serialising_logger, rate_limits={})
+        for line in LINES:
+            forwarder.forward(line)
+        forwarder.close()
+
+    measure(forward_batched, items=N_LINES, unit="lines")
+    measure.extra["records"] = serialising_logger.handlers[0].records // 5
+
+
+def test_log_forwarder_rate_limited(measure, serialising_logger):
+    def forward_rate_limited():
+        forwarder = run_subprocess.LogForwarder(serialising_logger)
+        for line in LINES:
+            forwarder.forward(line)
+        forwarder.close()
+
+    measure(forward_rate_limited, items=N_LINES, unit="lines")
+    measure.extra["records"] = serialising_logger.handlers[0].records // 5
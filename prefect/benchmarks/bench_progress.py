@@ -0,0 +1,61 @@
+#  Copyright (c) University College London Hospitals NHS Foundation Trust
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+################################################################################
+
+"""
+Cost of following the progress of a run with `ProgressTracker`, which sees every
+line of container output, compared with just forwarding the lines.
+"""
+
+import pytest
+
+import run_subprocess
+from progress import ProgressTracker
+
+N_LINES = 200_000
+
+
+def make_lines(progress_every: int) -> list[str]:
+    """Log lines with a progress line every `progress_every` lines."""
+    return [
+        f"[INFO] table_{i // 10_000:03d}: processed rows {i * 1000} to {i * 1000 + 999}"
+        if i % progress_every == 0
+        else f"[DEBUG] Running query {i} against the source database"
+        for i in range(N_LINES)
+    ]
+
+
+@pytest.mark.parametrize("progress_every", [1, 10, 1000])
+def test_progress_tracker(measure, progress_every):
+    lines = make_lines(progress_every)
+
+    def track():
+        tracker = ProgressTracker()
+        for line in lines:
+            tracker(line)
+
+    measure(track, items=N_LINES, unit="lines")
+
+
+def test_progress_tracker_baseline(measure, serialising_logger):
+    """Forwarding the same lines, for scale."""
+    lines = make_lines(10)
+
+    def forward():
+        forwarder = run_subprocess.LogForwarder(serialising_logger, rate_limits={})
+        for line in lines:
+            forwarder.forward(line)
+        forwarder.close()
+
+    measure(forward, items=N_LINES, unit="lines")
@@ -0,0 +1,123 @@
+#  Copyright (c) University College London Hospitals NHS Foundation Trust
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+################################################################################
+
+"""
+Throughput and memory use of `run_subprocess` on the output of the stand-in for
+omop_es, at mixed levels on both stdout and stderr, and of supervising many of
+them at once with `run_subprocess_async`.
+"""
+
+import asyncio
+import os
+import threading
+import sys
+import tracemalloc
+from pathlib import Path
+
+import pytest
+
+import run_subprocess
+
+FAKE_OMOP_ES = Path(__file__).parent / "fake_omop_es.py"
+N_LINES = 200_000
+N_CONCURRENT = 20
+
+
+@pytest.fixture
+def fake_env(monkeypatch, tmp_path, serialising_logger):
+    monkeypatch.setattr(
+        run_subprocess.logging, "get_run_logger", lambda: serialising_logger
+    )
+    env = os.environ.copy()
+    env.update(FAKE_EXTRACT_PATH=str(tmp_path), FAKE_LINES=str(N_LINES))
+    return env
+
+
+def run_fake(tmp_path, env, **kwargs):
+    return run_subprocess.run_subprocess(
+        tmp_path, [sys.executable, str(FAKE_OMOP_ES)], env, **kwargs
+    )
+
+
+def test_run_subprocess_throughput(measure, tmp_path, fake_env, serialising_logger):
+    measure(
+        lambda: run_fake(tmp_path, fake_env, spool_dir=tmp_path / "logs"),
+        items=N_LINES,
+        unit="lines",
+        rounds=3,
+    )
+    measure.extra["records"] = serialising_logger.handlers[0].records // 3
+
+
+@pytest.mark.parametrize("spooled", [True, False], ids=["spooled", "in_memory"])
+def test_run_subprocess_peak_memory(measure, tmp_path, fake_env, spooled):
+    """Peak memory allocated by the worker while running the container."""
+    spool_dir = tmp_path / "logs" if spooled else None
+
+    def run_traced():
+        tracemalloc.start()
+        try:
+            run_fake(tmp_path, fake_env, spool_dir=spool_dir)
+            measure.extra["peak_mib"] = round(
+                tracemalloc.get_traced_memory()[1] / 2**20, 1
+            )
+        finally:
+            tracemalloc.stop()
+
+    measure(run_traced, items=N_LINES, unit="lines", rounds=1)
+
+
+def test_run_subprocess_async_throughput(
+    measure, tmp_path, fake_env, serialising_logger
+):
+    measure(
+        lambda: asyncio.run(
+            run_subprocess.run_subprocess_async(
+                tmp_path,
+                [sys.executable, str(FAKE_OMOP_ES)],
+                fake_env,
+                spool_dir=tmp_path / "logs",
+            )
+        ),
+        items=N_LINES,
+        unit="lines",
+        rounds=3,
+    )
+
+
+def test_run_subprocess_async_concurrent(measure, tmp_path, fake_env):
+    """Many quiet, slow containers supervised from a single event loop."""
+    env = dict(fake_env, FAKE_LINES="1000", FAKE_SLEEP="2")
+
+    async def run_all():
+        runs = asyncio.gather(
+            *(
+                run_subprocess.run_subprocess_async(
+                    tmp_path,
+                    [sys.executable, str(FAKE_OMOP_ES)],
+                    dict(env, FAKE_EXTRACT_PATH=str(tmp_path / str(i))),
+                )
+                for i in range(N_CONCURRENT)
+            )
+        )
+        await asyncio.sleep(1)
+        # Threads added while supervising, e.g. by the child watcher before 3.12
+        measure.extra["threads"] = threading.active_count() - threads
+        await runs
+
+    threads = threading.active_count()
+    measure(
+        lambda: asyncio.run(run_all()), items=N_CONCURRENT, unit="containers", rounds=1
+    )
@@ -0,0 +1,212 @@
+#  Copyright (c) University College London Hospitals NHS Foundation Trust
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+################################################################################
+
+"""
+Minimal benchmark fixture, so the benchmarks run offline with plain pytest.
+
+Collect the benchmarks with `make benchmark`; a summary table of all
+measurements is printed at the end of the session.
+"""
+
+import json
+import logging
+import subprocess
+import sys
+import time
+from dataclasses import dataclass, field
+from pathlib import Path, PurePosixPath
+from typing import Any, Callable
+
+import pytest
+
+import run_omop_es
+import run_subprocess
+from container_pool import ContainerPool
+from image_index import ImageIndex
+from phases import PhaseHistory
+from progress import RowCountHistory
+from ref_cache import RefCache
+from watermarks import WatermarkStore
+
+FAKE_OMOP_ES = Path(__file__).parent / "fake_omop_es.py"
+
+_MEASUREMENTS: list["Measurement"] = []
+
+
+@dataclass
+class Measurement:
+    name: str
+    timings: list[float]
+    items: int
+    unit: str
+    extra: dict[str, Any] = field(default_factory=dict)
+
+    @property
+    def best(self) -> float:
+        return min(self.timings)
+
+    @property
+    def mean(self) -> float:
+        return sum(self.timings) / len(self.timings)
+
+    @property
+    def rate(self) -> float:
+        return self.items / self.best
+
+
+class Benchmark:
+    def __init__(self, name: str) -> None:
+        self.name = name
+        self.extra: dict[str, Any] = {}
+
+    def __call__(
+        self,
+        fn: Callable[[], Any],
+        items: int = 1,
+        unit: str = "ops",
+        rounds: int = 5,
+    ) -> Measurement:
+        """Time `rounds` calls of `fn`, which processes `items` `unit`s each."""
+        timings = []
+        for _ in range(rounds):
+            start = time.perf_counter()
+            fn()
+            timings.append(time.perf_counter() - start)
+        measurement = Measurement(self.name, timings, items, unit, self.extra)
+        _MEASUREMENTS.append(measurement)
+        return measurement
+
+
+@pytest.fixture
+def measure(request) -> Benchmark:
+    return Benchmark(request.node.name)
+
+
+class SerialisingHandler(logging.Handler):
+    """
+    Stands in for the Prefect API log handler, which serialises and ships every
+    record, so its cost is per record rather than per line.
+    """
+
+    def __init__(self) -> None:
+        super().__init__()
+        self.records = 0
+
+    def emit(self, record: logging.LogRecord) -> None:
+        json.dumps(
+            {
+                "name": record.name,
+                "level": record.levelno,
+                "message": self.format(record),
+                "timestamp": record.created,
+            }
+        )
+        self.records += 1
+
+
+@pytest.fixture
+def serialising_logger():
+    logger = logging.getLogger("benchmarks")
+    logger.propagate = False
+    logger.setLevel(logging.DEBUG)
+    handler = SerialisingHandler()
+    logger.addHandler(handler)
+    yield logger
+    logger.removeHandler(handler)
+
+
+def run_fake_omop_es(working_dir, args, env=None, **kwargs):
+    """Run the stand-in for omop_es in place of `docker compose run`."""
+    return run_subprocess.run_subprocess(
+        working_dir, [sys.executable, str(FAKE_OMOP_ES)], env, **kwargs
+    )
+
+
+@pytest.fixture
+def fake_omop_es(monkeypatch, tmp_path) -> Path:
+    """
+    Point the run_omop_es flows at a local omop_es repository and the stand-in
+    for the omop_es container, with all their state in a temporary directory, so
+    they run without GitHub or docker. The image is taken to exist already, as
+    it does for every run of a version but the first.
+
+    Returns:
+        The extract volume, which has the same path on the host and in the stand-in
+    """
+    repo = tmp_path / "omop_es"
+    (repo / "main").mkdir(parents=True)
+    # Partitioned runs check that batched.R takes the partition arguments
+    (repo / "main" / "batched.R").write_text('make_option("--partition_by")\n')
+    for args in [
+        ["init", "--quiet", "--initial-branch", "master"],
+        ["add", "main"],
+        ["-c", "user.name=bench", "-c", "user.email=bench@localhost", "commit"]
+        + ["--quiet", "--message", "Initial commit"],
+    ]:
+        subprocess.run(["git", *args], cwd=repo, check=True)
+
+    extract = tmp_path / "extract"
+    monkeypatch.setattr(run_omop_es, "omop_es_url", lambda: str(repo))
+    monkeypatch.setattr(
+        run_omop_es, "omop_es_mirror_path", lambda: tmp_path / "omop_es.git"
+    )
+    monkeypatch.setattr(
+        run_omop_es, "mockdb_snapshot_path", lambda: tmp_path / "mockdb"
+    )
+    monkeypatch.setattr(run_omop_es, "REF_CACHE", RefCache(tmp_path / "refs.json"))
+    monkeypatch.setattr(
+        run_omop_es, "IMAGE_INDEX", ImageIndex(tmp_path / "images.json")
+    )
+    monkeypatch.setattr(
+        run_omop_es, "PHASE_HISTORY", PhaseHistory(tmp_path / "phases.json")
+    )
+    monkeypatch.setattr(run_omop_es, "image_exists", lambda image: True)
+    monkeypatch.setattr(run_omop_es, "LOGS_PATH", tmp_path / "logs")
+    monkeypatch.setattr(run_omop_es, "EXTRACT_PATH", extract)
+    monkeypatch.setattr(run_omop_es, "CONTAINER_EXTRACT_PATH", PurePosixPath(extract))
+    monkeypatch.setattr(run_omop_es, "CHECKPOINTS_PATH", extract / ".checkpoints")
+    monkeypatch.setattr(run_omop_es, "WATERMARKS_PATH", extract / ".watermarks")
+    monkeypatch.setattr(run_omop_es, "PROFILES_PATH", extract / ".profiles")
+    monkeypatch.setattr(
+        run_omop_es, "WATERMARKS", WatermarkStore(tmp_path / "watermarks.json")
+    )
+    monkeypatch.setattr(run_omop_es, "run_subprocess", run_fake_omop_es)
+    monkeypatch.setattr(run_omop_es, "TELEMETRY_INTERVAL", 0)
+    monkeypatch.setattr(
+        run_omop_es, "ROW_COUNTS", RowCountHistory(tmp_path / "rows.json")
+    )
+    # No source systems, so no global concurrency limits
+    monkeypatch.setattr(run_omop_es, "OMOP_ES_ENV_FILE", tmp_path / "omop_es.env")
+    monkeypatch.setattr(
+        run_omop_es, "WARM_POOL", ContainerPool(tmp_path / "pool.json", size=0)
+    )
+    monkeypatch.setenv("FAKE_EXTRACT_PATH", str(extract))
+    return extract
+
+
+def pytest_terminal_summary(terminalreporter) -> None:
+    if not _MEASUREMENTS:
+        return
+    terminalreporter.section("benchmarks")
+    width = max(len(m.name) for m in _MEASUREMENTS)
+    terminalreporter.write_line(
+        f"{'name':<{width}}  {'best (s)':>10}  {'mean (s)':>10}  {'rate':>16}  extra"
+    )
+    for m in _MEASUREMENTS:
+        extra = ", ".join(f"{key}={value}" for key, value in m.extra.items())
+        terminalreporter.write_line(
+            f"{m.name:<{width}}  {m.best:>10.4f}  {m.mean:>10.4f}  "
+            f"{m.rate:>10.0f} {m.unit}/s  {extra}"
+        )
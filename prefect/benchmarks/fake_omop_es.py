@@ -0,0 +1,110 @@
+#  Copyright (c) University College London Hospitals NHS Foundation Trust
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+################################################################################
+
+"""
+Lightweight stand-in for the omop_es container, so the Prefect flows can be
+benchmarked without docker, R or a database.
+
+It reads the same environment variables as `docker/omop_es.sh` (SETTINGS_ID,
+OUTPUT_DIRECTORY and COMPLETED_UNITS_FILE) and is configured with:
+
+    FAKE_UNITS: Number of units (tables) to extract, each written to a CSV file
+        and reported with a `[CHECKPOINT]` line (default 4)
+    FAKE_ROWS: Number of rows in each CSV file (default 100)
+    FAKE_LINES: Number of log lines to print, spread over the units, at mixed
+        levels on both stdout and stderr (default 1000)
+    FAKE_SLEEP: Seconds to sleep before exiting (default 0)
+    FAKE_EXIT_CODE: Exit code of failing attempts, or of every attempt if
+        FAKE_FAIL_ATTEMPTS isn't set (default 0)
+    FAKE_FAIL_ATTEMPTS: Number of attempts that fail halfway through the units,
+        before attempts succeed; attempts are counted in FAKE_STATE_FILE
+    FAKE_EXTRACT_PATH: Where to write the output if OUTPUT_DIRECTORY is not set,
+        in a directory named after SETTINGS_ID (default /app/extract)
+"""
+
+import os
+import sys
+import time
+from pathlib import Path
+
+# Mostly progress lines, as omop_es prints
+LEVELS = ["INFO"] * 6 + ["DEBUG"] * 2 + ["WARNING", ""]
+
+
+def lines(unit: str, count: int, offset: int):
+    for i in range(offset, offset + count):
+        level = LEVELS[i % len(LEVELS)]
+        prefix = f"[{level}] " if level else ""
+        yield i, f"{prefix}{unit}: processed rows {i * 1000} to {i * 1000 + 999}\n"
+
+
+def attempt_number() -> int:
+    state_file = os.environ.get("FAKE_STATE_FILE")
+    if not state_file:
+        return 1
+    path = Path(state_file)
+    attempt = int(path.read_text()) + 1 if path.exists() else 1
+    path.write_text(str(attempt))
+    return attempt
+
+
+def main() -> int:
+    settings_id = os.environ.get("SETTINGS_ID", "fake")
+    units = [f"table_{i:03d}" for i in range(int(os.environ.get("FAKE_UNITS", 4)))]
+    rows = int(os.environ.get("FAKE_ROWS", 100))
+    lines_per_unit = int(os.environ.get("FAKE_LINES", 1000)) // max(len(units), 1)
+    exit_code = int(os.environ.get("FAKE_EXIT_CODE", 0))
+    fail_attempts = os.environ.get("FAKE_FAIL_ATTEMPTS")
+    output = Path(
+        os.environ.get("OUTPUT_DIRECTORY")
+        or Path(os.environ.get("FAKE_EXTRACT_PATH", "/app/extract")) / settings_id
+    )
+
+    failing = exit_code != 0
+    if fail_attempts is not None:
+        failing = attempt_number() <= int(fail_attempts)
+        exit_code = exit_code or 1
+
+    completed = set()
+    completed_units_file = os.environ.get("COMPLETED_UNITS_FILE")
+    if completed_units_file and os.path.exists(completed_units_file):
+        completed = set(Path(completed_units_file).read_text().split())
+
+    print(f"[PHASE] extract {time.time()}")
+    output.mkdir(parents=True, exist_ok=True)
+    extracted = 0
+    for n, unit in enumerate(units):
+        if failing and n == len(units) // 2:
+            sys.stderr.write(f"[ERROR] Failed extracting {unit}\n")
+            return exit_code
+        if unit in completed:
+            print(f"[INFO] Skipping completed unit {unit}")
+            continue
+        for i, line in lines(unit, lines_per_unit, n * lines_per_unit):
+            (sys.stderr if i % 10 == 9 else sys.stdout).write(line)
+        with open(output / f"{unit}.csv", "w") as f:
+            f.write("id,value\n")
+            f.writelines(f"{i},{i * 2}\n" for i in range(rows))
+        extracted += 1
+        print(f"[CHECKPOINT] {unit}", flush=True)
+
+    print(f"[METRIC] fake_units_extracted={extracted}")
+    time.sleep(float(os.environ.get("FAKE_SLEEP", 0)))
+    print(f"[PHASE] done {time.time()}")
+    return exit_code if failing else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
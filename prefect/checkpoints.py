@@ -0,0 +1,130 @@
+#  Copyright (c) University College London Hospitals NHS Foundation Trust
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+################################################################################
+
+import json
+import re
+import time
+from pathlib import Path
+from typing import Any, Iterable, Optional
+
+from json_store import JsonStore
+
+CHECKPOINT_PATTERN = re.compile(r"\[CHECKPOINT\]\s+(\S+)")
+
+
+class CheckpointManifest:
+    """
+    Record of the units, i.e. tables or batches, completed by an omop_es
+    extraction, so that a retry or a re-run can skip them. The container reports
+    each unit it completes by printing a line `[CHECKPOINT] <unit>`; pass the
+    manifest to `run_subprocess` as a line handler to record them.
+
+    Args:
+        path: Path of the JSON manifest, its parent directories are created if needed
+    """
+
+    def __init__(self, path: Path) -> None:
+        self.path = path
+        self.store = JsonStore(path)
+
+    @property
+    def units_path(self) -> Path:
+        """Path of the plain text list of completed units, for the container."""
+        return self.path.with_suffix(".units")
+
+    def read(self) -> dict[str, Any]:
+        return self.store.read()
+
+    def units(self) -> list[str]:
+        return self.read().get("units", [])
+
+    def start(self, details: dict[str, Any], units: Iterable[str] = ()) -> None:
+        """
+        Start an attempt of the extraction described by `details`, adding any
+        `units` carried over from an earlier run.
+        """
+        with self.store.update() as data:
+            data.update(details)
+            data["complete"] = False
+            data["started_at"] = time.time()
+            data.pop("checkpointed_at", None)
+            recorded = data.setdefault("units", [])
+            recorded.extend(unit for unit in units if unit not in recorded)
+
+    def record(self, unit: str) -> None:
+        with self.store.update() as data:
+            recorded = data.setdefault("units", [])
+            if unit not in recorded:
+                recorded.append(unit)
+            data["checkpointed_at"] = time.time()
+
+    def completed_window(self) -> Optional[tuple[float, float]]:
+        """
+        When the current attempt started and when it last completed a unit, or
+        None if it hasn't completed one yet. Output last written in between
+        belongs to completed units, and won't be written again by this attempt.
+        """
+        # Updates are moved into place, so the manifest can be read without
+        # taking its lock, which would recreate the lock file of a removed one
+        try:
+            with open(self.path) as f:
+                data = json.load(f)
+        except FileNotFoundError:
+            return None
+        if "started_at" not in data or "checkpointed_at" not in data:
+            return None
+        return data["started_at"], data["checkpointed_at"]
+
+    def remove(self) -> None:
+        """
+        Remove the manifest and its files, once the extraction has completed or
+        another manifest has taken over its units.
+        """
+        for path in (self.path, self.units_path, self.store.lock_path):
+            path.unlink(missing_ok=True)
+
+    def write_units(self) -> Path:
+        """Write the completed units, one per line, to `units_path`."""
+        units = self.units()
+        self.units_path.write_text("".join(f"{unit}\n" for unit in units))
+        return self.units_path
+
+    def __call__(self, line: str) -> None:
+        if not line.startswith("[CHECKPOINT]"):
+            return
+        match = CHECKPOINT_PATTERN.match(line)
+        if match:
+            self.record(match.group(1))
+
+
+def find_resumable(
+    directory: Path, details: dict[str, Any]
+) -> Optional[CheckpointManifest]:
+    """
+    Find the most recently updated manifest in `directory` of an extraction that
+    didn't complete and matches all of `details`. Manifests of completed
+    extractions are removed, older versions of this module marked them complete.
+    """
+    manifests = sorted(
+        directory.glob("*.json"), key=lambda path: path.stat().st_mtime, reverse=True
+    )
+    for path in manifests:
+        manifest = CheckpointManifest(path)
+        data = manifest.read()
+        if data.get("complete", True):
+            continue
+        if all(data.get(key) == value for key, value in details.items()):
+            return manifest
+    return None
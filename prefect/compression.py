@@ -0,0 +1,201 @@
+#  Copyright (c) University College London Hospitals NHS Foundation Trust
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+################################################################################
+
+import gzip
+import hashlib
+import json
+import os
+import shutil
+import subprocess
+import threading
+import zipfile
+from concurrent.futures import Future, ThreadPoolExecutor, wait
+from pathlib import Path
+from typing import Any, Optional
+
+from prefect import logging
+
+COMPRESSION_FORMATS = ("zstd", "gzip", "zip")
+# Formats that compress each file on its own, rather than into one archive
+SUFFIXES = {"zstd": ".zst", "gzip": ".gz"}
+MANIFEST_NAME = "manifest.json"
+DEFAULT_MAX_WORKERS = 4
+CHUNK_SIZE = 1024 * 1024
+
+logger = logging.get_logger()
+
+
+def sha256sum(path: Path) -> str:
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        while chunk := f.read(CHUNK_SIZE):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def compress_file(path: Path, compression: str, threads: int = 1) -> Path:
+    """
+    Compress a file with gzip or zstd, next to the original, which is kept.
+    zstd uses the `zstd` command line tool with `threads` threads.
+
+    Returns:
+        The path of the compressed file
+    """
+    destination = path.with_name(path.name + SUFFIXES[compression])
+    if compression == "gzip":
+        with open(path, "rb") as src, gzip.open(destination, "wb") as dst:
+            shutil.copyfileobj(src, dst, CHUNK_SIZE)
+    else:
+        subprocess.run(
+            ["zstd", f"-T{threads}", "--quiet", "--force", "-o", destination, path],
+            check=True,
+        )
+    return destination
+
+
+class OutputCompressor:
+    """
+    Compress the files of an output directory in parallel, while they're still
+    being written. Call `poll` as the extraction completes units, i.e. tables or
+    batches, to start compressing the files they wrote, then `finish` once the
+    output is complete, or `abort` if it never will be.
+
+    With gzip or zstd every file is compressed on its own and the originals are
+    removed once all are done; files that changed after they were compressed
+    are compressed again. With zip, the checksums are computed in parallel and
+    the archive is written next to the directory when finishing, keeping the
+    originals. Either way a manifest of the sizes and checksums of the files is
+    written to the directory.
+
+    Args:
+        directory: Output directory, hidden files in it are ignored
+        compression: One of `COMPRESSION_FORMATS`
+        max_workers: Number of files to compress at the same time
+
+    Raises:
+        ValueError: If the compression format is unknown, or zstd is not installed
+    """
+
+    def __init__(
+        self,
+        directory: Path,
+        compression: str,
+        max_workers: int = DEFAULT_MAX_WORKERS,
+    ) -> None:
+        if compression not in COMPRESSION_FORMATS:
+            raise ValueError(
+                f"Unknown compression {compression!r}, use one of {COMPRESSION_FORMATS}"
+            )
+        if compression == "zstd" and shutil.which("zstd") is None:
+            raise ValueError("zstd compression requires the zstd command line tool")
+        self.directory = directory
+        self.compression = compression
+        # Split the CPUs between the files compressed at the same time
+        self.threads = max(1, (os.cpu_count() or 1) // max_workers)
+        self._executor = ThreadPoolExecutor(max_workers=max_workers)
+        self._submitted: dict[Path, tuple[tuple[int, int], Future]] = {}
+        self._lock = threading.Lock()
+
+    def poll(self, started_at: float, completed_at: float) -> int:
+        """
+        Start compressing the files last written between `started_at`, when the
+        current attempt of the extraction started, and `completed_at`, when it
+        last completed a unit, returning how many. Files of the units still in
+        progress have changed since, and files left by an earlier attempt may
+        be written again, so those are left to `finish`.
+        """
+        started = 0
+        for path, stat in self._candidates():
+            if started_at <= stat.st_mtime < completed_at:
+                started += self._submit(path, stat)
+        return started
+
+    def finish(self) -> list[dict[str, Any]]:
+        """
+        Compress the remaining files and write the manifest.
+
+        Returns:
+            The manifest entries, one per file
+        """
+        for path, stat in self._candidates():
+            self._submit(path, stat)
+        with self._executor:
+            entries = [future.result() for _, future in self._submitted.values()]
+        entries.sort(key=lambda entry: entry["file"])
+
+        if self.compression == "zip":
+            archive = self.directory.with_name(self.directory.name + ".zip")
+            with zipfile.ZipFile(archive, "w", zipfile.ZIP_DEFLATED) as zf:
+                for entry in entries:
+                    zf.write(self.directory / entry["file"], entry["file"])
+                sizes = {info.filename: info.compress_size for info in zf.infolist()}
+            for entry in entries:
+                entry["compressed_file"] = archive.name
+                entry["compressed_size"] = sizes[entry["file"]]
+        else:
+            for entry in entries:
+                (self.directory / entry["file"]).unlink()
+
+        (self.directory / MANIFEST_NAME).write_text(
+            json.dumps({"compression": self.compression, "files": entries}, indent=2)
+        )
+        return entries
+
+    def abort(self) -> None:
+        """Stop compressing and remove the compressed files, keeping the originals."""
+        self._executor.shutdown(cancel_futures=True)
+        for path in self._submitted:
+            for suffix in SUFFIXES.values():
+                path.with_name(path.name + suffix).unlink(missing_ok=True)
+
+    def _candidates(self):
+        for path in sorted(self.directory.rglob("*")):
+            relative = path.relative_to(self.directory)
+            if any(part.startswith(".") for part in relative.parts):
+                continue
+            if path.suffix in SUFFIXES.values() or relative.name == MANIFEST_NAME:
+                continue
+            if path.is_file():
+                yield path, path.stat()
+
+    def _submit(self, path: Path, stat: os.stat_result) -> int:
+        """Compress a file unless it already has been since it last changed."""
+        version = (stat.st_size, stat.st_mtime_ns)
+        with self._lock:
+            previous = self._submitted.get(path)
+            if previous is not None and previous[0] == version:
+                return 0
+            future = self._executor.submit(
+                self._compress, path, previous[1] if previous else None
+            )
+            self._submitted[path] = (version, future)
+        return 1
+
+    def _compress(self, path: Path, previous: Optional[Future]) -> dict[str, Any]:
+        # Don't write the same compressed file twice at once. The previous
+        # compression was submitted first, so it's already running or done.
+        if previous is not None:
+            wait([previous])
+        entry: dict[str, Any] = {
+            "file": path.relative_to(self.directory).as_posix(),
+            "size": path.stat().st_size,
+            "sha256": sha256sum(path),
+        }
+        if self.compression in SUFFIXES:
+            compressed = compress_file(path, self.compression, self.threads)
+            entry["compressed_file"] = compressed.relative_to(self.directory).as_posix()
+            entry["compressed_size"] = compressed.stat().st_size
+            entry["compressed_sha256"] = sha256sum(compressed)
+        return entry
@@ -0,0 +1,323 @@
+#  Copyright (c) University College London Hospitals NHS Foundation Trust
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+################################################################################
+
+import os
+import subprocess
+import threading
+import time
+import uuid
+from pathlib import Path
+from typing import Optional, Sequence
+
+from prefect import logging
+
+from json_store import JsonStore
+
+logger = logging.get_logger()
+
+# Containers per omop_es version, the pool is disabled by default
+DEFAULT_POOL_SIZE = 0
+DEFAULT_POOL_MAX_RUNS = 10
+# Longest a container may take to check out omop_es and restore its dependencies
+DEFAULT_WARM_UP_SECONDS = 3600.0
+DEFAULT_HEARTBEAT_SECONDS = 30.0
+# Leases not renewed for this long are of runs that died
+DEFAULT_LEASE_SECONDS = 300.0
+# Idle containers of other versions are removed after this long
+DEFAULT_IDLE_SECONDS = 3600.0
+# Written by omop_es.sh in warm mode once the container is ready for runs
+WARM_MARKER = "/tmp/omop_es.warm"
+POOL_PROJECT = "omop_es-pool"
+
+
+class ContainerPool:
+    """
+    Long-lived omop_es containers, warmed up for an omop_es version, that runs
+    are dispatched into with `docker exec` rather than each run starting a new
+    container. Warm containers have checked out their version of omop_es and
+    restored its dependencies already; per-run settings are passed to each
+    `docker exec` and are not seen by other runs.
+
+    The pool is shared by the flow runs on this host through a JSON file. Each
+    container is leased to one run at a time, under an id of its own that the
+    run renews every `heartbeat_seconds` in a background thread. While no warm
+    container is free, runs are started cold and up to `size` containers are
+    started in the background for the version. Containers are removed after
+    `max_runs` runs, after a failed run, when the run holding them stops renewing
+    its lease for `lease_seconds`, when they die or don't warm up, and once they
+    have been idle for `idle_seconds` while a different omop_es version is
+    requested, so several versions in use at once each keep their containers.
+
+    Args:
+        path: Path of the JSON file backing the pool
+        size: Number of containers per omop_es version, 0 disables the pool
+        max_runs: Number of runs after which a container is recycled
+        working_dir: Directory to run docker compose in
+        compose_files: Compose files to start the containers with, if not the default
+        warm_up_seconds: Time after which a container that isn't warm yet is removed
+        heartbeat_seconds: Interval at which leases are renewed
+        lease_seconds: Time after which a lease that wasn't renewed has expired
+        idle_seconds: Time after which an idle container of another version is
+            removed
+    """
+
+    def __init__(
+        self,
+        path: Path,
+        size: int = DEFAULT_POOL_SIZE,
+        max_runs: int = DEFAULT_POOL_MAX_RUNS,
+        working_dir: Path = Path("."),
+        compose_files: Sequence[str] = (),
+        warm_up_seconds: float = DEFAULT_WARM_UP_SECONDS,
+        heartbeat_seconds: float = DEFAULT_HEARTBEAT_SECONDS,
+        lease_seconds: float = DEFAULT_LEASE_SECONDS,
+        idle_seconds: float = DEFAULT_IDLE_SECONDS,
+    ) -> None:
+        self.store = JsonStore(path)
+        self.size = size
+        self.max_runs = max_runs
+        self.working_dir = working_dir
+        self.compose_files = compose_files
+        self.warm_up_seconds = warm_up_seconds
+        self.heartbeat_seconds = heartbeat_seconds
+        self.lease_seconds = lease_seconds
+        self.idle_seconds = idle_seconds
+        # Leases held by this process, by container
+        self._leases: dict[str, tuple[str, threading.Event]] = {}
+
+    @property
+    def enabled(self) -> bool:
+        return self.size > 0
+
+    def containers(self) -> dict[str, dict]:
+        """Containers in the pool, mapped to their version, runs and lease."""
+        return self.store.read()
+
+    def acquire(self, version: str) -> Optional[str]:
+        """
+        Lease a warm container for a version of omop_es, until it's released.
+
+        Returns:
+            The name of the container, or None if no warm container is free and
+            the run should start a container of its own
+        """
+        if not self.enabled:
+            return None
+        lease = uuid.uuid4().hex
+        leased = None
+        starting = None
+        checked: set[str] = set()
+        stale: list[str] = []
+        while leased is None:
+            with self.store.update() as containers:
+                now = time.time()
+                stale.extend(self._expire(containers, version, now))
+                candidate = next(
+                    (
+                        name
+                        for name, container in containers.items()
+                        if container["version"] == version
+                        and container["lease"] is None
+                        and name not in checked
+                    ),
+                    None,
+                )
+                if candidate is None:
+                    count = sum(c["version"] == version for c in containers.values())
+                    if count < self.size:
+                        starting = f"omop_es-pool-{version[:12]}-{uuid.uuid4().hex[:6]}"
+                        containers[starting] = {
+                            "version": version,
+                            "runs": 0,
+                            "started": now,
+                            "idle_since": now,
+                            "starting": True,
+                            "lease": None,
+                            "heartbeat": None,
+                        }
+                    break
+                # Reserve the container while its health is checked, which
+                # takes a docker exec and so is done without holding the pool
+                containers[candidate].update(lease=lease, heartbeat=now)
+            if is_warm(candidate):
+                leased = candidate
+                break
+            checked.add(candidate)
+            running = is_running(candidate)
+            with self.store.update() as containers:
+                container = containers.get(candidate)
+                if container is None or container["lease"] != lease:
+                    continue
+                # A container being started may not exist yet
+                if not running and not container.get("starting"):
+                    logger.warning("Warm container %s is not running", candidate)
+                    del containers[candidate]
+                    stale.append(candidate)
+                elif time.time() - container["started"] > self.warm_up_seconds:
+                    logger.warning("Warm container %s did not warm up", candidate)
+                    del containers[candidate]
+                    stale.append(candidate)
+                else:
+                    container.update(lease=None, heartbeat=None)
+
+        for name in stale:
+            remove_container(name)
+        if starting is not None:
+            if start_container(starting, version, self.working_dir, self.compose_files):
+                self._started(starting)
+            else:
+                self._forget(starting)
+
+        if leased is None:
+            logger.info("No warm container free for omop_es %s", version)
+        else:
+            logger.info("Dispatching run into warm container %s", leased)
+            self._hold(leased, lease)
+        return leased
+
+    def release(self, name: str, recycle: bool = False) -> None:
+        """
+        Return a leased container to the pool, or remove it if `recycle` is set
+        or it has reached `max_runs` runs. Recycle the container of a run that
+        failed or was cancelled: killing `docker exec` leaves the run going on
+        in the container.
+        """
+        lease, stop = self._leases.pop(name, (None, None))
+        if stop is not None:
+            stop.set()
+        with self.store.update() as containers:
+            container = containers.get(name)
+            if container is None or container["lease"] != lease:
+                # The lease expired, and the container was removed
+                return
+            container["runs"] += 1
+            container.update(lease=None, heartbeat=None, idle_since=time.time())
+            recycle = recycle or container["runs"] >= self.max_runs
+            if recycle:
+                del containers[name]
+        if recycle:
+            remove_container(name)
+
+    def _started(self, name: str) -> None:
+        with self.store.update() as containers:
+            if name in containers:
+                containers[name]["starting"] = False
+
+    def _expire(
+        self, containers: dict[str, dict], version: str, now: float
+    ) -> list[str]:
+        """
+        Drop expired leases, and containers of other versions that have been
+        idle for `idle_seconds`.
+        """
+        stale = []
+        for name, container in list(containers.items()):
+            if container["lease"] is not None:
+                if now - container["heartbeat"] > self.lease_seconds:
+                    logger.warning("Lease of warm container %s has expired", name)
+                    stale.append(name)
+            elif container["version"] != version:
+                idle_since = container.get("idle_since", container["started"])
+                if now - idle_since > self.idle_seconds:
+                    stale.append(name)
+        for name in stale:
+            del containers[name]
+        return stale
+
+    def _hold(self, name: str, lease: str) -> None:
+        """Renew a lease in a background thread until the container is released."""
+        stop = threading.Event()
+        self._leases[name] = (lease, stop)
+        threading.Thread(
+            target=self._renew, args=(name, lease, stop), daemon=True
+        ).start()
+
+    def _renew(self, name: str, lease: str, stop: threading.Event) -> None:
+        while not stop.wait(self.heartbeat_seconds):
+            with self.store.update() as containers:
+                container = containers.get(name)
+                if container is None or container["lease"] != lease:
+                    return
+                container["heartbeat"] = time.time()
+
+    def _forget(self, name: str) -> None:
+        with self.store.update() as containers:
+            containers.pop(name, None)
+
+
+def start_container(
+    name: str, version: str, working_dir: Path, compose_files: Sequence[str] = ()
+) -> bool:
+    """
+    Start a container warming up for a version of omop_es in the background.
+
+    Returns:
+        Whether the container was started
+    """
+    env = os.environ.copy()
+    # Used by docker compose to pick the image, and by omop_es.sh to check it out
+    env["OMOP_ES_VERSION"] = version
+    args = [
+        "docker",
+        "compose",
+        *(arg for path in compose_files for arg in ("-f", path)),
+        "--project-name",
+        POOL_PROJECT,
+        "run",
+        "--detach",
+        "--name",
+        name,
+        "omop_es",
+        "/app/omop_es.sh",
+        "warm",
+    ]
+    result = subprocess.run(
+        args, cwd=working_dir, env=env, capture_output=True, text=True
+    )
+    if result.returncode != 0:
+        logger.warning(
+            "Failed to start warm container %s: %s", name, result.stderr.strip()
+        )
+        return False
+    logger.info("Started warm container %s for omop_es %s", name, version)
+    return True
+
+
+def is_warm(name: str) -> bool:
+    """Health check of a warm container: running and ready for runs."""
+    result = subprocess.run(
+        ["docker", "exec", name, "test", "-f", WARM_MARKER], capture_output=True
+    )
+    return result.returncode == 0
+
+
+def is_running(name: str) -> bool:
+    """Whether a container exists and is running, e.g. hasn't died warming up."""
+    result = subprocess.run(
+        ["docker", "inspect", "--format", "{{.State.Running}}", name],
+        capture_output=True,
+        text=True,
+    )
+    return result.returncode == 0 and result.stdout.strip() == "true"
+
+
+def remove_container(name: str) -> None:
+    result = subprocess.run(
+        ["docker", "rm", "--force", name], capture_output=True, text=True
+    )
+    if result.returncode != 0:
+        logger.warning("Failed to remove container %s: %s", name, result.stderr.strip())
+    else:
+        logger.info("Removed warm container %s", name)
@@ -0,0 +1,139 @@
+#  Copyright (c) University College London Hospitals NHS Foundation Trust
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+################################################################################
+
+import hashlib
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Any
+
+from prefect import logging
+
+DEFAULT_DELIVERY_WORKERS = 4
+CHUNK_SIZE = 8 * 1024 * 1024
+
+logger = logging.get_logger()
+
+
+def partial_path(destination: Path) -> Path:
+    """Where a file is copied to before it's moved into place."""
+    return destination.with_name(f".{destination.name}.partial")
+
+
+def sha256_prefix(path: Path, size: int) -> "hashlib._Hash":
+    """Hash of the first `size` bytes of a file, which can be updated further."""
+    digest = hashlib.sha256()
+    remaining = size
+    with open(path, "rb") as f:
+        while remaining > 0 and (chunk := f.read(min(CHUNK_SIZE, remaining))):
+            digest.update(chunk)
+            remaining -= len(chunk)
+    return digest
+
+
+def deliver_file(source: Path, destination: Path) -> dict[str, Any]:
+    """
+    Copy a file to a slow or unreliable destination, such as a CIFS share.
+
+    The file is copied to a hidden partial file next to the destination. If a
+    partial file is left by an earlier attempt and matches the start of the
+    source, copying resumes from where it stopped. Once copied, the partial file
+    is read back to verify its checksum, then renamed to the destination, so
+    the destination never holds a partial file. Destinations that already match
+    the source are left as they are.
+
+    Returns:
+        What was delivered: the file, its size and checksum, how many bytes were
+        copied, whether the copy was resumed and how long it took
+
+    Raises:
+        OSError: If the copy doesn't match the source
+    """
+    start = time.monotonic()
+    size = source.stat().st_size
+    checksum = sha256_prefix(source, size).hexdigest()
+    entry: dict[str, Any] = {
+        "file": source.name,
+        "size": size,
+        "sha256": checksum,
+        "copied": 0,
+        "resumed": False,
+    }
+    destination.parent.mkdir(parents=True, exist_ok=True)
+    if destination.exists() and destination.stat().st_size == size:
+        if sha256_prefix(destination, size).hexdigest() == checksum:
+            entry["seconds"] = time.monotonic() - start
+            return entry
+
+    partial = partial_path(destination)
+    offset = partial.stat().st_size if partial.exists() else 0
+    if 0 < offset <= size and (
+        sha256_prefix(partial, offset).digest()
+        == sha256_prefix(source, offset).digest()
+    ):
+        entry["resumed"] = True
+    else:
+        offset = 0
+
+    with open(source, "rb") as src, open(partial, "r+b" if offset else "wb") as dst:
+        src.seek(offset)
+        dst.seek(offset)
+        dst.truncate()
+        while chunk := src.read(CHUNK_SIZE):
+            dst.write(chunk)
+            entry["copied"] += len(chunk)
+        dst.flush()
+        os.fsync(dst.fileno())
+
+    if sha256_prefix(partial, size).hexdigest() != checksum:
+        partial.unlink()
+        raise OSError(
+            f"Checksum of the copy of {source} to {destination} doesn't match"
+        )
+    os.replace(partial, destination)
+    entry["seconds"] = time.monotonic() - start
+    return entry
+
+
+def deliver_directory(
+    source: Path, destination: Path, max_workers: int = DEFAULT_DELIVERY_WORKERS
+) -> list[dict[str, Any]]:
+    """
+    Deliver every file in a directory, except hidden ones, `max_workers` files
+    at a time, largest first. See `deliver_file`.
+
+    Returns:
+        What was delivered for each file, with paths relative to `source`
+    """
+    files = sorted(
+        (
+            path
+            for path in source.rglob("*")
+            if path.is_file()
+            and not any(part.startswith(".") for part in path.relative_to(source).parts)
+        ),
+        key=lambda path: path.stat().st_size,
+        reverse=True,
+    )
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        futures = [
+            executor.submit(deliver_file, path, destination / path.relative_to(source))
+            for path in files
+        ]
+        entries = [future.result() for future in futures]
+    for path, entry in zip(files, entries):
+        entry["file"] = path.relative_to(source).as_posix()
+    return entries
@@ -0,0 +1,86 @@
+#  Copyright (c) University College London Hospitals NHS Foundation Trust
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+################################################################################
+
+import time
+from dataclasses import dataclass
+from typing import Any, Iterable, Optional
+
+from prefect import Task
+from prefect.futures import PrefectFuture, as_completed
+from prefect.states import State
+
+
+@dataclass
+class TaskOutcome:
+    """Final state of a submitted task run, and how long it took."""
+
+    parameters: dict[str, Any]
+    state: State
+    duration: float
+
+    @property
+    def error(self) -> Optional[str]:
+        if self.state.is_completed():
+            return None
+        return self.state.message or self.state.name
+
+
+def map_bounded(
+    task: Task, parameters: Iterable[dict[str, Any]], max_concurrency: int
+) -> list[TaskOutcome]:
+    """
+    Submit a task once for each set of parameters, with at most `max_concurrency`
+    task runs in progress at any time, and wait for all of them to finish.
+
+    Failed task runs (after their retries) don't stop the others from running.
+
+    Args:
+        task: The task to submit
+        parameters: Keyword arguments for each task run
+        max_concurrency: Maximum number of task runs in progress at once
+
+    Returns:
+        The outcome of each task run, in the order of `parameters`
+    """
+    if max_concurrency < 1:
+        raise ValueError(f"max_concurrency must be at least 1, got {max_concurrency}")
+
+    futures: list[tuple[dict[str, Any], PrefectFuture]] = []
+    pending: list[PrefectFuture] = []
+    submitted_at: dict[PrefectFuture, float] = {}
+    durations: dict[PrefectFuture, float] = {}
+
+    def wait_for_one() -> None:
+        done = next(as_completed(pending))
+        # Waiting on a finished future records its final state locally, rather
+        # than reading it back from the API where it may not have arrived yet
+        done.wait()
+        pending.remove(done)
+        durations[done] = time.monotonic() - submitted_at[done]
+
+    for kwargs in parameters:
+        while len(pending) >= max_concurrency:
+            wait_for_one()
+        future = task.submit(**kwargs)
+        submitted_at[future] = time.monotonic()
+        futures.append((kwargs, future))
+        pending.append(future)
+    while pending:
+        wait_for_one()
+
+    return [
+        TaskOutcome(kwargs, future.state, durations[future])
+        for kwargs, future in futures
+    ]
@@ -0,0 +1,143 @@
+#  Copyright (c) University College London Hospitals NHS Foundation Trust
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+################################################################################
+
+import os
+import subprocess
+from pathlib import Path
+from typing import Optional
+
+from prefect import logging
+
+from json_store import file_lock
+
+logger = logging.get_logger()
+
+# Only branches and tags are mirrored, not e.g. pull request refs
+MIRROR_REFSPECS = ["+refs/heads/*:refs/heads/*", "+refs/tags/*:refs/tags/*"]
+# Commits fetched on demand are kept under their own refs, outside the mirrored
+# namespaces so updates don't prune them
+PINNED_REFS = "refs/pinned"
+
+
+def update_mirror(mirror_path: Path, repo_url: str) -> Path:
+    """
+    Create or incrementally update a bare mirror of a repository.
+
+    The mirror is locked while fetching, so concurrent flow runs wait for each
+    other rather than fetching at the same time. `repo_url` is only used on the
+    command line and never stored in the mirror, so it may contain credentials.
+
+    Args:
+        mirror_path: Path of the bare repository, created if it doesn't exist
+        repo_url: URL of the repository to mirror
+
+    Returns:
+        The path of the mirror
+
+    Raises:
+        RuntimeError: If the mirror cannot be created or fetching fails
+    """
+    with _mirror_lock(mirror_path):
+        try:
+            if not (mirror_path / "HEAD").exists():
+                logger.info("Creating mirror of omop_es in %s", mirror_path)
+                subprocess.run(
+                    ["git", "init", "--quiet", "--bare", str(mirror_path)],
+                    capture_output=True,
+                    check=True,
+                )
+            subprocess.run(
+                [
+                    "git",
+                    "-C",
+                    str(mirror_path),
+                    "fetch",
+                    "--prune",
+                    "--quiet",
+                    repo_url,
+                    *MIRROR_REFSPECS,
+                ],
+                capture_output=True,
+                text=True,
+                check=True,
+            )
+        except subprocess.CalledProcessError as e:
+            logger.error(e.stderr)
+            if mirror_path.exists() and not os.access(mirror_path, os.W_OK):
+                # e.g. created empty by Docker, mounting a mirror that didn't exist
+                logger.error(
+                    "%s is not writable, remove it to create the mirror", mirror_path
+                )
+            raise RuntimeError(f"Failed to update mirror in {mirror_path}") from e
+    return mirror_path
+
+
+def fetch_commit(mirror_path: Path, repo_url: str, sha: str) -> bool:
+    """
+    Fetch a commit that is on no mirrored branch or tag, e.g. the head of a pull
+    request, into the mirror, under `refs/pinned/<sha>`.
+
+    Args:
+        mirror_path: Path of an existing bare mirror
+        repo_url: URL of the repository to fetch from
+        sha: Full commit SHA, servers don't accept abbreviated ones
+
+    Returns:
+        Whether the commit is now in the mirror
+    """
+    with _mirror_lock(mirror_path):
+        if has_commit(mirror_path, sha):
+            return True
+        result = subprocess.run(
+            [
+                "git",
+                "-C",
+                str(mirror_path),
+                "fetch",
+                "--quiet",
+                repo_url,
+                f"+{sha}:{PINNED_REFS}/{sha}",
+            ],
+            capture_output=True,
+            text=True,
+        )
+    if result.returncode != 0:
+        logger.warning("Failed to fetch %s into the mirror: %s", sha, result.stderr)
+        return False
+    logger.info("Fetched %s into the mirror", sha)
+    return True
+
+
+def read_file(mirror_path: Path, ref: str, path: str) -> Optional[str]:
+    """Contents of a file at a ref in the mirror, or None if it doesn't exist there."""
+    result = subprocess.run(
+        ["git", "-C", str(mirror_path), "show", f"{ref}:{path}"],
+        capture_output=True,
+        text=True,
+    )
+    return result.stdout if result.returncode == 0 else None
+
+
+def _mirror_lock(mirror_path: Path):
+    return file_lock(mirror_path.with_name(mirror_path.name + ".lock"))
+
+
+def has_commit(mirror_path: Path, ref: str) -> bool:
+    """Check whether a ref or (short) commit SHA resolves to a commit in the mirror."""
+    result = subprocess.run(
+        ["git", "-C", str(mirror_path), "rev-parse", "--verify", f"{ref}^{{commit}}"],
+        capture_output=True,
+    )
+    return result.returncode == 0
@@ -0,0 +1,92 @@
+#  Copyright (c) University College London Hospitals NHS Foundation Trust
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+################################################################################
+
+import subprocess
+import time
+from pathlib import Path
+
+from prefect import logging
+
+from json_store import JsonStore
+
+logger = logging.get_logger()
+
+DEFAULT_MAX_IMAGES = 5
+
+
+class ImageIndex:
+    """
+    Local index of the Docker images built by the flows, with the time each
+    was last used, so the least recently used images can be removed.
+
+    Args:
+        path: Path of the JSON file backing the index
+        max_images: Number of images to keep when pruning
+    """
+
+    def __init__(self, path: Path, max_images: int = DEFAULT_MAX_IMAGES) -> None:
+        self.store = JsonStore(path)
+        self.max_images = max_images
+
+    def images(self) -> dict[str, float]:
+        """Images in the index, mapped to when they were last used."""
+        return self.store.read()
+
+    def record_use(self, image: str) -> None:
+        with self.store.update() as images:
+            images[image] = time.time()
+
+    def prune(self) -> list[str]:
+        """
+        Remove the least recently used images beyond `max_images`. Images that
+        cannot be removed, e.g. because a container is still using them, are
+        kept in the index so removing them is retried next time.
+
+        Returns:
+            The images that were removed
+        """
+        removed = []
+        with self.store.update() as images:
+            by_last_use = sorted(images, key=images.__getitem__, reverse=True)
+            for image in by_last_use[self.max_images :]:
+                if remove_image(image):
+                    del images[image]
+                    removed.append(image)
+        return removed
+
+
+def image_exists(image: str) -> bool:
+    """Check whether a Docker image exists locally."""
+    result = subprocess.run(["docker", "image", "inspect", image], capture_output=True)
+    return result.returncode == 0
+
+
+def remove_image(image: str) -> bool:
+    """
+    Remove a Docker image, treating images that no longer exist as removed.
+
+    Returns:
+        Whether the image is gone
+    """
+    if not image_exists(image):
+        return True
+    result = subprocess.run(
+        ["docker", "image", "rm", image], capture_output=True, text=True
+    )
+    if result.returncode != 0:
+        logger.warning("Failed to remove image %s: %s", image, result.stderr.strip())
+        return False
+    logger.info("Removed image %s", image)
+    return True
@@ -0,0 +1,88 @@
+#  Copyright (c) University College London Hospitals NHS Foundation Trust
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+################################################################################
+
+import fcntl
+import json
+import os
+import tempfile
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Any, Iterator
+
+
+@contextmanager
+def file_lock(path: Path, operation: int = fcntl.LOCK_EX) -> Iterator[None]:
+    """
+    Hold an advisory lock on `path` for the duration of the block, creating the
+    file and its parent directories if needed. Blocks until the lock is free.
+    """
+    path.parent.mkdir(parents=True, exist_ok=True)
+    with open(path, "a") as lock_file:
+        fcntl.flock(lock_file, operation)
+        try:
+            yield
+        finally:
+            fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+
+class JsonStore:
+    """
+    A JSON document on disk that can be shared between concurrent workers.
+
+    Reads take a shared lock and updates an exclusive one, on a separate lock
+    file next to the document. Updates are written to a temporary file first
+    and then moved into place, so readers never see a partial document.
+
+    Args:
+        path: Path of the JSON file, its parent directories are created if needed
+    """
+
+    def __init__(self, path: Path) -> None:
+        self.path = path
+        self.lock_path = path.with_name(path.name + ".lock")
+
+    def read(self) -> dict[str, Any]:
+        with file_lock(self.lock_path, fcntl.LOCK_SH):
+            return self._load()
+
+    @contextmanager
+    def update(self) -> Iterator[dict[str, Any]]:
+        """
+        Lock the document for the duration of the block and yield its contents,
+        which are written back when the block exits without an exception.
+        """
+        with file_lock(self.lock_path):
+            data = self._load()
+            yield data
+            self._dump(data)
+
+    def _load(self) -> dict[str, Any]:
+        try:
+            with open(self.path) as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return {}
+
+    def _dump(self, data: dict[str, Any]) -> None:
+        fd, tmp_path = tempfile.mkstemp(
+            dir=self.path.parent, prefix=f".{self.path.name}.", suffix=".tmp"
+        )
+        try:
+            with os.fdopen(fd, "w") as f:
+                json.dump(data, f, indent=2, sort_keys=True)
+            os.replace(tmp_path, self.path)
+        except BaseException:
+            os.unlink(tmp_path)
+            raise
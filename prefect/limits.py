@@ -0,0 +1,31 @@
+#  Copyright (c) University College London Hospitals NHS Foundation Trust
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+################################################################################
+
+import re
+
+from prefect.types import BANNED_CHARACTERS
+
+# Characters Prefect doesn't allow in names, and whitespace
+UNSAFE_PATTERN = re.compile("[" + re.escape("".join(BANNED_CHARACTERS)) + r"\s]+")
+
+
+def concurrency_limit_name(*parts: str) -> str:
+    """
+    Name of a Prefect global concurrency limit, from its parts joined with
+    dashes. Names are lowercased, with whitespace and the characters Prefect
+    doesn't allow in names replaced by dashes. Operators create the limits by
+    these names, so they must only change along with the docs and the Makefile.
+    """
+    return UNSAFE_PATTERN.sub("-", "-".join(parts).lower()).strip("-")
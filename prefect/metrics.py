@@ -0,0 +1,40 @@
+#  Copyright (c) University College London Hospitals NHS Foundation Trust
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+################################################################################
+
+import re
+
+METRIC_PATTERN = re.compile(r"\[METRIC\]\s+([A-Za-z_][\w.]*)=(-?\d+(?:\.\d+)?)")
+
+
+class MetricsCollector:
+    """
+    Collect the metrics printed by the omop_es container, as lines of the form
+    `[METRIC] name=value`. Later values of a metric replace earlier ones.
+    """
+
+    def __init__(self) -> None:
+        self.metrics: dict[str, float] = {}
+
+    def __call__(self, line: str) -> None:
+        if not line.startswith("[METRIC]"):
+            return
+        match = METRIC_PATTERN.match(line)
+        if match:
+            self.metrics[match.group(1)] = float(match.group(2))
+
+    def table(self) -> list[dict[str, str | float]]:
+        return [
+            {"metric": name, "value": value} for name, value in self.metrics.items()
+        ]
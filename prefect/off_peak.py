@@ -0,0 +1,136 @@
+#  Copyright (c) University College London Hospitals NHS Foundation Trust
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+################################################################################
+
+import datetime
+from dataclasses import dataclass
+from typing import Iterable, Optional
+from zoneinfo import ZoneInfo
+
+# Local time of the GAE and the source systems
+TIMEZONE = ZoneInfo("Europe/London")
+DEFAULT_WINDOWS = ("19:00-07:00",)
+# Assumed run time of projects without successful runs in their history
+DEFAULT_EXPECTED_SECONDS = 3600.0
+
+Window = tuple[datetime.datetime, datetime.datetime]
+
+
+@dataclass
+class PlannedRun:
+    """When to start a run, and when it is expected to finish."""
+
+    settings_id: str
+    start: datetime.datetime
+    expected_seconds: float
+    in_window: bool
+
+    @property
+    def expected_end(self) -> datetime.datetime:
+        return self.start + datetime.timedelta(seconds=self.expected_seconds)
+
+
+def parse_window(spec: str) -> tuple[datetime.time, datetime.time]:
+    """
+    Parse an off-peak window, 'HH:MM-HH:MM' in local time. A window ending at
+    or before its start time ends on the next day.
+
+    Raises:
+        ValueError: If the window isn't in that format
+    """
+    try:
+        start, end = spec.split("-")
+        return datetime.time.fromisoformat(start), datetime.time.fromisoformat(end)
+    except ValueError as e:
+        raise ValueError(
+            f"Invalid off-peak window {spec!r}, expected HH:MM-HH:MM"
+        ) from e
+
+
+def upcoming_windows(
+    specs: Iterable[str], now: datetime.datetime, days: int = 1
+) -> list[Window]:
+    """
+    The occurrences of the off-peak windows over the next `days` days, in
+    order. A window that has already started begins now.
+    """
+    now = now.astimezone(TIMEZONE)
+    windows = []
+    for start_time, end_time in map(parse_window, specs):
+        for offset in range(-1, days + 1):
+            date = now.date() + datetime.timedelta(days=offset)
+            start = datetime.datetime.combine(date, start_time, TIMEZONE)
+            end = datetime.datetime.combine(date, end_time, TIMEZONE)
+            if end <= start:
+                end += datetime.timedelta(days=1)
+            if end > now and start < now + datetime.timedelta(days=days):
+                windows.append((max(start, now), end))
+    return sorted(windows)
+
+
+def plan_runs(
+    expected_seconds: dict[str, float], windows: list[Window], max_concurrency: int
+) -> list[PlannedRun]:
+    """
+    Spread runs over the off-peak windows, with at most `max_concurrency` at a
+    time. Runs are placed longest first, each at the earliest time a run slot is
+    free for long enough inside a window, which keeps the time until all of them
+    are done short. A run that doesn't fit in any window regardless is placed
+    after the runs of the slot that is free first.
+
+    Returns:
+        The planned runs, in order of their start
+    """
+    if max_concurrency < 1:
+        raise ValueError(f"max_concurrency must be at least 1, got {max_concurrency}")
+    if not windows:
+        raise ValueError("No off-peak windows to plan runs in")
+
+    # The times each run slot is taken
+    slots: list[list[Window]] = [[] for _ in range(max_concurrency)]
+    planned = []
+    for settings_id, seconds in sorted(
+        expected_seconds.items(), key=lambda item: (-item[1], item[0])
+    ):
+        duration = datetime.timedelta(seconds=seconds)
+        fits = [
+            (_earliest_fit(busy, duration, windows), i) for i, busy in enumerate(slots)
+        ]
+        fitting = [(start, i) for start, i in fits if start is not None]
+        if fitting:
+            start, slot = min(fitting)
+        else:
+            # Overrun the window, from the end of the slot that is free first
+            start, slot = min(
+                (max(busy)[1] if busy else windows[0][0], i)
+                for i, busy in enumerate(slots)
+            )
+        slots[slot].append((start, start + duration))
+        planned.append(PlannedRun(settings_id, start, seconds, bool(fitting)))
+    return sorted(planned, key=lambda run: (run.start, run.settings_id))
+
+
+def _earliest_fit(
+    busy: list[Window], duration: datetime.timedelta, windows: list[Window]
+) -> Optional[datetime.datetime]:
+    """Earliest start of a run inside a window that doesn't overlap `busy`."""
+    candidates = sorted({start for start, _ in windows} | {end for _, end in busy})
+    for start in candidates:
+        end = start + duration
+        in_window = any(w_start <= start and end <= w_end for w_start, w_end in windows)
+        if in_window and all(
+            end <= b_start or b_end <= start for b_start, b_end in busy
+        ):
+            return start
+    return None
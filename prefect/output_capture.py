@@ -0,0 +1,178 @@
+#  Copyright (c) University College London Hospitals NHS Foundation Trust
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+################################################################################
+
+import gzip
+import shutil
+import subprocess
+import time
+from collections import deque
+from pathlib import Path
+from typing import IO, Optional
+
+DEFAULT_TAIL_BYTES = 64 * 1024
+DEFAULT_SEGMENT_BYTES = 64 * 1024 * 1024
+DEFAULT_RETENTION_DAYS = 30.0
+
+
+class OutputCapture:
+    """Collect every line of a stream in memory."""
+
+    def __init__(self) -> None:
+        self._lines: list[str] = []
+
+    def append(self, line: str) -> None:
+        self._lines.append(line)
+
+    def close(self) -> None:
+        pass
+
+    def getvalue(self) -> str:
+        return "\n".join(self._lines)
+
+    def tail(self) -> str:
+        return self.getvalue()
+
+
+class SpooledOutputCapture(OutputCapture):
+    """
+    Keep only the last few KB of a stream in memory and spill the full stream
+    to disk, as a series of gzip-compressed segment files.
+
+    Args:
+        directory: Directory to write the segment files to, created if needed
+        name: Prefix for the segment file names, e.g. 'stdout'
+        tail_bytes: Approximate number of bytes to keep in memory
+        segment_bytes: Uncompressed size after which to start a new segment
+    """
+
+    def __init__(
+        self,
+        directory: Path,
+        name: str,
+        tail_bytes: int = DEFAULT_TAIL_BYTES,
+        segment_bytes: int = DEFAULT_SEGMENT_BYTES,
+    ) -> None:
+        self.directory = directory
+        self.name = name
+        self.tail_bytes = tail_bytes
+        self.segment_bytes = segment_bytes
+        self.paths: list[Path] = []
+
+        self._tail: deque[str] = deque()
+        self._tail_size = 0
+        self._segment: Optional[IO[str]] = None
+        self._segment_size = 0
+
+        self.directory.mkdir(parents=True, exist_ok=True)
+
+    def append(self, line: str) -> None:
+        if self._segment is None or self._segment_size >= self.segment_bytes:
+            self._rotate()
+        assert self._segment is not None
+        self._segment.write(line + "\n")
+        self._segment_size += len(line) + 1
+
+        self._tail.append(line)
+        self._tail_size += len(line) + 1
+        while self._tail_size > self.tail_bytes and len(self._tail) > 1:
+            self._tail_size -= len(self._tail.popleft()) + 1
+
+    def close(self) -> None:
+        if self._segment is not None:
+            self._segment.close()
+            self._segment = None
+
+    def getvalue(self) -> str:
+        """Read the full stream back from disk."""
+        self.close()
+        chunks = []
+        for path in self.paths:
+            with gzip.open(path, "rt", encoding="utf-8") as f:
+                chunks.append(f.read())
+        return "".join(chunks).removesuffix("\n")
+
+    def tail(self) -> str:
+        return "\n".join(self._tail)
+
+    def _rotate(self) -> None:
+        self.close()
+        path = self.directory / f"{self.name}.{len(self.paths):04d}.log.gz"
+        self._segment = gzip.open(path, "wt", encoding="utf-8")
+        self._segment_size = 0
+        self.paths.append(path)
+
+
+class CapturedProcess(subprocess.CompletedProcess):
+    """
+    A CompletedProcess whose stdout and stderr are only materialised from
+    their captures when accessed.
+    """
+
+    def __init__(
+        self,
+        args: list[str],
+        returncode: int,
+        stdout_capture: OutputCapture,
+        stderr_capture: OutputCapture,
+    ) -> None:
+        self.stdout_capture = stdout_capture
+        self.stderr_capture = stderr_capture
+        self._stdout: Optional[str] = None
+        self._stderr: Optional[str] = None
+        super().__init__(args, returncode)
+
+    # Assigning a value replaces the capture, as on a plain CompletedProcess
+    @property
+    def stdout(self) -> str:  # type: ignore[override]
+        if self._stdout is not None:
+            return self._stdout
+        return self.stdout_capture.getvalue()
+
+    @stdout.setter
+    def stdout(self, value: Optional[str]) -> None:
+        self._stdout = value
+
+    @property
+    def stderr(self) -> str:  # type: ignore[override]
+        if self._stderr is not None:
+            return self._stderr
+        return self.stderr_capture.getvalue()
+
+    @stderr.setter
+    def stderr(self, value: Optional[str]) -> None:
+        self._stderr = value
+
+
+def remove_old_runs(
+    directory: Path, max_age_days: float = DEFAULT_RETENTION_DAYS
+) -> list[Path]:
+    """
+    Remove the spooled output of runs, in `<directory>/<name>/<run>/`, that
+    nothing has been written to for `max_age_days`.
+
+    Returns:
+        The run directories removed
+    """
+    cutoff = time.time() - max_age_days * 24 * 3600
+    removed = []
+    for run in sorted(directory.glob("*/*")):
+        if not run.is_dir():
+            continue
+        files = [path for path in run.rglob("*") if path.is_file()]
+        newest = max((path.stat().st_mtime for path in files), default=0.0)
+        if max(newest, run.stat().st_mtime) < cutoff:
+            shutil.rmtree(run, ignore_errors=True)
+            removed.append(run)
+    return removed
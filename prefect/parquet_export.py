@@ -0,0 +1,199 @@
+#  Copyright (c) University College London Hospitals NHS Foundation Trust
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+################################################################################
+
+"""
+Convert CSV outputs of omop_es to Parquet. Requires the optional pyarrow
+dependency, installed by hand with `uv pip install "pyarrow>=19.0.0"`.
+"""
+
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+from typing import Any
+
+# Including the files compressed by compression.py, which pyarrow reads as they are
+CSV_SUFFIXES = (".csv", ".csv.gz", ".csv.zst")
+DEFAULT_PARQUET_WORKERS = 4
+# Bytes of CSV read at a time
+DEFAULT_BLOCK_SIZE = 16 * 1024 * 1024
+# Aim for row groups of about this many bytes in memory, within the row limits
+TARGET_ROW_GROUP_BYTES = 128 * 1024 * 1024
+MIN_ROW_GROUP_ROWS = 10_000
+MAX_ROW_GROUP_ROWS = 1_000_000
+# Dictionary encode text columns with at most this fraction of distinct values
+MAX_DICTIONARY_RATIO = 0.5
+
+
+def require_pyarrow() -> None:
+    """
+    Raises:
+        ImportError: If pyarrow is not installed
+    """
+    try:
+        import pyarrow  # noqa: F401
+    except ImportError as e:
+        raise ImportError(
+            "Converting to Parquet requires pyarrow, install it with "
+            '`uv pip install "pyarrow>=19.0.0"`'
+        ) from e
+
+
+def parquet_path(csv_path: Path) -> Path:
+    name = csv_path.name.removesuffix(".gz").removesuffix(".zst").removesuffix(".csv")
+    return csv_path.with_name(name + ".parquet")
+
+
+def find_csv_files(directory: Path) -> list[Path]:
+    return sorted(
+        path
+        for path in directory.rglob("*")
+        if path.name.endswith(CSV_SUFFIXES) and path.is_file()
+    )
+
+
+def row_group_rows(batch) -> int:
+    """Rows per row group, from the size of the rows in a record batch."""
+    row_bytes = batch.nbytes / max(batch.num_rows, 1)
+    rows = int(TARGET_ROW_GROUP_BYTES / max(row_bytes, 1))
+    return max(MIN_ROW_GROUP_ROWS, min(MAX_ROW_GROUP_ROWS, rows))
+
+
+def dictionary_columns(batch) -> list[str]:
+    """Text columns with few enough distinct values in a record batch to dictionary encode."""
+    import pyarrow as pa
+    import pyarrow.compute as pc
+
+    columns = []
+    for name, column in zip(batch.schema.names, batch.columns):
+        if not pa.types.is_string(column.type) or len(column) == 0:
+            continue
+        if len(pc.unique(column)) / len(column) <= MAX_DICTIONARY_RATIO:
+            columns.append(name)
+    return columns
+
+
+def convert_csv(csv_path: Path, block_size: int = DEFAULT_BLOCK_SIZE) -> dict[str, Any]:
+    """
+    Convert a CSV file to a Parquet file next to it, reading it a block at a
+    time, so memory use is bounded by the row group size rather than the size of
+    the table. Column types are inferred from the first block; if a later block
+    doesn't fit them, the file is converted again with every column as text.
+
+    The row group size and the columns to dictionary encode are chosen from the
+    first block.
+
+    Returns:
+        A summary of the conversion: the file names, number of rows and row
+        groups, and the schema
+    """
+    import pyarrow as pa
+
+    try:
+        summary = _convert_csv(csv_path, block_size, as_text=False)
+    except pa.ArrowInvalid:
+        summary = _convert_csv(csv_path, block_size, as_text=True)
+    return summary
+
+
+def _convert_csv(csv_path: Path, block_size: int, as_text: bool) -> dict[str, Any]:
+    import pyarrow as pa
+    import pyarrow.csv as pv
+    import pyarrow.parquet as pq
+
+    convert_options = None
+    if as_text:
+        with pv.open_csv(csv_path) as reader:
+            names = reader.schema.names
+        convert_options = pv.ConvertOptions(
+            column_types={n: pa.string() for n in names}
+        )
+
+    destination = parquet_path(csv_path)
+    rows = 0
+    row_groups = 0
+    with pv.open_csv(
+        csv_path,
+        read_options=pv.ReadOptions(block_size=block_size),
+        convert_options=convert_options,
+    ) as reader:
+        schema = reader.schema
+        writer = None
+        buffered: list = []
+        buffered_rows = 0
+        group_rows = MIN_ROW_GROUP_ROWS
+        try:
+            for batch in reader:
+                if writer is None:
+                    group_rows = row_group_rows(batch)
+                    writer = pq.ParquetWriter(
+                        destination,
+                        schema,
+                        compression="zstd",
+                        use_dictionary=dictionary_columns(batch),
+                    )
+                buffered.append(batch)
+                buffered_rows += batch.num_rows
+                if buffered_rows >= group_rows:
+                    table = pa.Table.from_batches(buffered, schema)
+                    writer.write_table(table, row_group_size=group_rows)
+                    rows += table.num_rows
+                    row_groups += -(-table.num_rows // group_rows)
+                    buffered, buffered_rows = [], 0
+            if writer is None:
+                writer = pq.ParquetWriter(destination, schema, compression="zstd")
+            if buffered:
+                table = pa.Table.from_batches(buffered, schema)
+                writer.write_table(table, row_group_size=group_rows)
+                rows += table.num_rows
+                row_groups += -(-table.num_rows // group_rows)
+        finally:
+            if writer is not None:
+                writer.close()
+
+    return {
+        "file": csv_path.name,
+        "parquet_file": destination.name,
+        "rows": rows,
+        "row_groups": row_groups,
+        "row_group_rows": group_rows,
+        "inferred_types": not as_text,
+        "schema": {field.name: str(field.type) for field in schema},
+    }
+
+
+def convert_directory(
+    directory: Path, max_workers: int = DEFAULT_PARQUET_WORKERS
+) -> list[dict[str, Any]]:
+    """
+    Convert every CSV file in a directory to Parquet, in parallel across a pool
+    of `max_workers` processes.
+
+    Returns:
+        The summary of the conversion of each file, see `convert_csv`
+    """
+    require_pyarrow()
+    csv_files = find_csv_files(directory)
+    if not csv_files:
+        return []
+    # Spawn rather than fork, as the worker runs other threads
+    context = multiprocessing.get_context("spawn")
+    with ProcessPoolExecutor(
+        max_workers=min(max_workers, len(csv_files)), mp_context=context
+    ) as executor:
+        summaries = list(executor.map(convert_csv, csv_files))
+    for path, summary in zip(csv_files, summaries):
+        summary["file"] = path.relative_to(directory).as_posix()
+        summary["parquet_file"] = parquet_path(path).relative_to(directory).as_posix()
+    return summaries
@@ -0,0 +1,158 @@
+#  Copyright (c) University College London Hospitals NHS Foundation Trust
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+################################################################################
+
+import datetime
+import os
+import shutil
+from dataclasses import dataclass
+from pathlib import Path
+
+PARTITION_KINDS = ("date", "person_id")
+
+
+@dataclass(frozen=True)
+class Partition:
+    """
+    A slice of a batched extraction, covering the half-open range [start, end)
+    of either dates (ISO format) or person ids.
+    """
+
+    kind: str
+    start: str
+    end: str
+
+    @property
+    def name(self) -> str:
+        return f"{self.kind}-{self.start}-{self.end}"
+
+    def env(self) -> dict[str, str]:
+        """Environment variables passing the partition to the omop_es container."""
+        return {
+            "PARTITION_BY": self.kind,
+            "PARTITION_START": self.start,
+            "PARTITION_END": self.end,
+        }
+
+
+def make_partitions(kind: str, start: str, end: str, count: int) -> list[Partition]:
+    """
+    Split the range [start, end) into `count` partitions of (nearly) equal size.
+
+    Args:
+        kind: What to partition on, 'date' or 'person_id'
+        start: First date (YYYY-MM-DD) or person id of the range
+        end: Date or person id just after the end of the range
+        count: Number of partitions, fewer are returned if the range is smaller
+
+    Raises:
+        ValueError: If the kind is unknown, or the range or count are invalid
+    """
+    if kind not in PARTITION_KINDS:
+        raise ValueError(
+            f"Unknown partition kind {kind!r}, use one of {PARTITION_KINDS}"
+        )
+    if count < 1:
+        raise ValueError(f"Partition count must be at least 1, got {count}")
+
+    if kind == "date":
+        first = datetime.date.fromisoformat(start).toordinal()
+        last = datetime.date.fromisoformat(end).toordinal()
+        bounds = _split(first, last, count)
+        return [
+            Partition(
+                kind,
+                datetime.date.fromordinal(lower).isoformat(),
+                datetime.date.fromordinal(upper).isoformat(),
+            )
+            for lower, upper in bounds
+        ]
+    return [
+        Partition(kind, str(lower), str(upper))
+        for lower, upper in _split(int(start), int(end), count)
+    ]
+
+
+def _split(start: int, end: int, count: int) -> list[tuple[int, int]]:
+    if end <= start:
+        raise ValueError(f"Empty partition range: {start} to {end}")
+    count = min(count, end - start)
+    size, remainder = divmod(end - start, count)
+    bounds = []
+    lower = start
+    for i in range(count):
+        upper = lower + size + (1 if i < remainder else 0)
+        bounds.append((lower, upper))
+        lower = upper
+    return bounds
+
+
+def merge_partitions(partition_dirs: list[Path], output_dir: Path) -> list[Path]:
+    """
+    Combine the outputs of several partitions into a single directory.
+
+    CSV files with the same relative path are concatenated, keeping the header of
+    the first partition only. Any other file is copied with the name of its
+    partition directory added before its suffix, as it can't be merged.
+
+    Args:
+        partition_dirs: Output directories of the partitions, in order
+        output_dir: Directory to write the merged outputs to
+
+    Returns:
+        The merged output files
+
+    Raises:
+        ValueError: If CSV files with the same name have different headers
+    """
+    merged: dict[Path, bytes] = {}
+    for partition_dir in partition_dirs:
+        for path in sorted(p for p in partition_dir.rglob("*") if p.is_file()):
+            relative = path.relative_to(partition_dir)
+            if path.suffix.lower() == ".csv":
+                target = output_dir / relative
+                _append_csv(path, target, merged)
+            else:
+                target = output_dir / relative.with_name(
+                    f"{path.stem}.{partition_dir.name}{path.suffix}"
+                )
+                target.parent.mkdir(parents=True, exist_ok=True)
+                shutil.copyfile(path, target)
+                merged[target] = b""
+    return sorted(merged)
+
+
+def _append_csv(source: Path, target: Path, headers: dict[Path, bytes]) -> None:
+    with open(source, "rb") as src:
+        header = src.readline()
+        # Empty files of earlier partitions, e.g. of a table without rows in
+        # them, have no header to match, so start afresh
+        if not headers.get(target):
+            target.parent.mkdir(parents=True, exist_ok=True)
+            with open(target, "wb") as dst:
+                dst.write(header)
+                shutil.copyfileobj(src, dst)
+            headers[target] = header
+            return
+        if not header:
+            return
+        if header != headers[target]:
+            raise ValueError(f"Header of {source} doesn't match the header of {target}")
+        with open(target, "ab+") as dst:
+            # Don't run the last row of the previous partition into the first of this one
+            if dst.seek(0, os.SEEK_END) > 0:
+                dst.seek(-1, os.SEEK_END)
+                if dst.read(1) != b"\n":
+                    dst.write(b"\n")
+            shutil.copyfileobj(src, dst)
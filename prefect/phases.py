@@ -0,0 +1,112 @@
+#  Copyright (c) University College London Hospitals NHS Foundation Trust
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+################################################################################
+
+import re
+import statistics
+import time
+from collections import defaultdict
+from pathlib import Path
+from typing import Any, Optional
+
+from json_store import JsonStore
+
+PHASE_PATTERN = re.compile(r"\[PHASE\]\s+(\S+)\s+(\d+(?:\.\d+)?)")
+# Marks the end of the last phase, rather than the start of a new one
+END_PHASE = "done"
+DEFAULT_MAX_RUNS = 50
+
+
+class PhaseTimer:
+    """
+    Time the phases of an omop_es container run, from the lines printed at the
+    start of each phase: `[PHASE] <name> <unix timestamp>`. A phase lasts until
+    the next one starts, or until the `done` phase.
+    """
+
+    def __init__(self) -> None:
+        self.marks: list[tuple[str, float]] = []
+
+    def __call__(self, line: str) -> None:
+        if not line.startswith("[PHASE]"):
+            return
+        match = PHASE_PATTERN.match(line)
+        if match:
+            self.marks.append((match.group(1), float(match.group(2))))
+
+    def durations(self, end: Optional[float] = None) -> dict[str, float]:
+        """
+        Seconds spent in each phase, in the order they started. A phase that
+        never ended, e.g. because the container failed, lasts until `end`,
+        which defaults to now.
+        """
+        end = time.time() if end is None else end
+        durations: dict[str, float] = defaultdict(float)
+        ends = [timestamp for _, timestamp in self.marks[1:]] + [end]
+        for (name, start), stop in zip(self.marks, ends):
+            if name != END_PHASE:
+                durations[name] += round(stop - start, 3)
+        return dict(durations)
+
+
+class PhaseHistory:
+    """
+    Durations of the phases of the most recent runs of each project, shared
+    between workers.
+
+    Args:
+        path: Path of the JSON file backing the history
+        max_runs: Number of runs to keep per project
+    """
+
+    def __init__(self, path: Path, max_runs: int = DEFAULT_MAX_RUNS) -> None:
+        self.store = JsonStore(path)
+        self.max_runs = max_runs
+
+    def record(self, settings_id: str, run: dict[str, Any]) -> None:
+        with self.store.update() as data:
+            runs = data.setdefault(settings_id, [])
+            runs.append(run)
+            del runs[: -self.max_runs]
+
+    def runs(self, settings_id: str) -> list[dict[str, Any]]:
+        return self.store.read().get(settings_id, [])
+
+    def expected_seconds(
+        self, settings_id: str, partition: str = ""
+    ) -> Optional[float]:
+        """
+        Median run time of the successful runs of a project in the history, or
+        None if there are none. Only runs of the same `partition` are compared,
+        by default runs of the whole project, as a partition only extracts part
+        of the data.
+        """
+        totals = [
+            sum(run["phases"].values())
+            for run in self.runs(settings_id)
+            if run.get("succeeded") and run.get("partition", "") == partition
+        ]
+        return statistics.median(totals) if totals else None
+
+    def table(self, settings_id: str) -> list[dict[str, Any]]:
+        """One row per run, most recent first, with a column per phase."""
+        runs = list(reversed(self.runs(settings_id)))
+        phases = list(dict.fromkeys(name for run in runs for name in run["phases"]))
+        rows = []
+        for run in runs:
+            row = {key: value for key, value in run.items() if key != "phases"}
+            rows.append(
+                {**row, **{name: run["phases"].get(name, "") for name in phases}}
+            )
+        return rows
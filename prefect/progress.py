@@ -0,0 +1,287 @@
+#  Copyright (c) University College London Hospitals NHS Foundation Trust
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+################################################################################
+
+import re
+import threading
+import time
+from dataclasses import dataclass, replace
+from pathlib import Path
+from typing import Callable, Optional, Sequence
+
+from json_store import JsonStore
+
+DEFAULT_REPORT_SECONDS = 60.0
+
+
+@dataclass(frozen=True)
+class ProgressPattern:
+    """
+    A kind of progress line. Lines containing `needle` are matched against
+    `regex`, which has a `table` group, the number of rows written as either a
+    `total` so far, `rows` in this step or a `first` to `last` row range, and
+    optionally the `expected` total and the `elapsed` seconds for the table.
+    """
+
+    needle: str
+    regex: re.Pattern
+
+
+PROGRESS_PATTERNS: tuple[ProgressPattern, ...] = (
+    # e.g. "[INFO] person: processed rows 0 to 999"
+    ProgressPattern(
+        ": processed rows ",
+        re.compile(
+            r"(?:\[\w*\]\s*)?(?P<table>[\w.]+): processed rows (?P<first>\d+) to (?P<last>\d+)"
+        ),
+    ),
+    # e.g. "[PROGRESS] person rows=1000 expected=5000 elapsed=12.5"
+    ProgressPattern(
+        "[PROGRESS]",
+        re.compile(
+            r"\[PROGRESS\]\s+(?P<table>[\w.]+)\s+rows=(?P<total>\d+)"
+            r"(?:\s+expected=(?P<expected>\d+))?(?:\s+elapsed=(?P<elapsed>\d+(?:\.\d+)?))?"
+        ),
+    ),
+)
+
+
+@dataclass
+class TableProgress:
+    table: str
+    rows: int
+    first_seen: float
+    last_seen: float
+    elapsed: Optional[float] = None
+    expected: Optional[int] = None
+
+    @property
+    def seconds(self) -> float:
+        """Time spent on the table, as reported or as seen from the log."""
+        return (
+            self.elapsed
+            if self.elapsed is not None
+            else self.last_seen - self.first_seen
+        )
+
+    @property
+    def rows_per_second(self) -> Optional[float]:
+        return self.rows / self.seconds if self.seconds > 0 else None
+
+
+class ProgressTracker:
+    """
+    Follow the progress of an omop_es extraction from its log lines, keeping
+    the rows written to each table and the rate they're written at. Pass the
+    tracker to `run_subprocess` as a line handler; lines that don't contain the
+    needle of any of the `patterns` are skipped without running a regex.
+
+    Every `report_seconds` at most, `report` is called with the tracker from the
+    thread handling the line, e.g. to log the progress.
+
+    Args:
+        patterns: The kinds of progress lines to recognise
+        expected_rows: Expected total rows of each table, e.g. from a previous
+            run, unless a progress line says otherwise
+        report: Called with the tracker as progress is made
+        report_seconds: Minimum time between calls of `report`
+        clock: Monotonic clock, in seconds
+    """
+
+    def __init__(
+        self,
+        patterns: Sequence[ProgressPattern] = PROGRESS_PATTERNS,
+        expected_rows: Optional[dict[str, int]] = None,
+        report: Optional[Callable[["ProgressTracker"], None]] = None,
+        report_seconds: float = DEFAULT_REPORT_SECONDS,
+        clock: Callable[[], float] = time.monotonic,
+    ) -> None:
+        self.patterns = tuple(patterns)
+        self.expected_rows = dict(expected_rows or {})
+        self.report = report
+        self.report_seconds = report_seconds
+        self.clock = clock
+        self.tables: dict[str, TableProgress] = {}
+        self.started: Optional[float] = None
+        self._last_report: Optional[float] = None
+        self._lock = threading.Lock()
+
+    def __call__(self, line: str) -> None:
+        for pattern in self.patterns:
+            if pattern.needle in line:
+                match = pattern.regex.match(line)
+                if match:
+                    self._update(match)
+                return
+
+    def _update(self, match: re.Match) -> None:
+        now = self.clock()
+        groups = match.groupdict()
+        table = groups["table"]
+        with self._lock:
+            if self.started is None:
+                self.started = self._last_report = now
+            progress = self.tables.get(table)
+            if progress is None:
+                progress = self.tables[table] = TableProgress(
+                    table, 0, now, now, expected=self.expected_rows.get(table)
+                )
+            if groups.get("total") is not None:
+                progress.rows = int(groups["total"])
+            elif groups.get("rows") is not None:
+                progress.rows += int(groups["rows"])
+            else:
+                progress.rows += int(groups["last"]) - int(groups["first"]) + 1
+            if groups.get("expected") is not None:
+                progress.expected = int(groups["expected"])
+            if groups.get("elapsed") is not None:
+                progress.elapsed = float(groups["elapsed"])
+            progress.last_seen = now
+            due = self._last_report is not None and (
+                now - self._last_report >= self.report_seconds
+            )
+            if due:
+                self._last_report = now
+        if due and self.report is not None:
+            self.report(self)
+
+    def snapshot(self) -> dict[str, TableProgress]:
+        """
+        Copy of the progress of each table, to read from other threads than
+        the ones handling the lines.
+        """
+        with self._lock:
+            return {table: replace(progress) for table, progress in self.tables.items()}
+
+    @property
+    def rows(self) -> int:
+        return _rows(self.snapshot())
+
+    def rows_per_second(self) -> Optional[float]:
+        """Rate over the whole run so far."""
+        return _rows_per_second(self.snapshot(), self.started)
+
+    def eta_seconds(self) -> Optional[float]:
+        """
+        Estimated time until the tables with an expected row count are all
+        written, at the rate of the run so far; None if there is no estimate.
+        """
+        return _eta_seconds(self.snapshot(), self.started, self.expected_rows)
+
+    def percent_done(self) -> Optional[float]:
+        """
+        Share of the expected rows of the tables written so far, as a percentage;
+        None if no table has an expected row count.
+        """
+        tables = self.snapshot()
+        expected = _expected(tables, self.expected_rows)
+        total = sum(expected.values())
+        if not total:
+            return None
+        return 100 * (total - _remaining_rows(tables, expected)) / total
+
+    def table(self) -> list[dict[str, str | float]]:
+        """Summary of the rows written to each table, in the order they started."""
+        return [
+            {
+                "table": progress.table,
+                "rows": progress.rows,
+                "expected_rows": progress.expected if progress.expected else "",
+                "seconds": round(progress.seconds, 1),
+                "rows_per_second": round(progress.rows_per_second or 0, 1),
+            }
+            for progress in self.snapshot().values()
+        ]
+
+
+def _rows(tables: dict[str, TableProgress]) -> int:
+    return sum(progress.rows for progress in tables.values())
+
+
+def _rows_per_second(
+    tables: dict[str, TableProgress], started: Optional[float]
+) -> Optional[float]:
+    if started is None or not tables:
+        return None
+    seconds = max(p.last_seen for p in tables.values()) - started
+    return _rows(tables) / seconds if seconds > 0 else None
+
+
+def _expected(
+    tables: dict[str, TableProgress], expected_rows: dict[str, int]
+) -> dict[str, int]:
+    expected = dict(expected_rows)
+    expected.update(
+        {t: p.expected for t, p in tables.items() if p.expected is not None}
+    )
+    return expected
+
+
+def _remaining_rows(tables: dict[str, TableProgress], expected: dict[str, int]) -> int:
+    return sum(
+        max(rows - (tables[t].rows if t in tables else 0), 0)
+        for t, rows in expected.items()
+    )
+
+
+def _eta_seconds(
+    tables: dict[str, TableProgress],
+    started: Optional[float],
+    expected_rows: dict[str, int],
+) -> Optional[float]:
+    rate = _rows_per_second(tables, started)
+    expected = _expected(tables, expected_rows)
+    if not expected or not rate:
+        return None
+    return _remaining_rows(tables, expected) / rate
+
+
+class RowCountHistory:
+    """
+    Rows written to each table by the last full extraction of each project, as
+    the expected row counts of the next one.
+
+    Args:
+        path: Path of the JSON file backing the history
+    """
+
+    def __init__(self, path: Path) -> None:
+        self.store = JsonStore(path)
+
+    def get(self, settings_id: str) -> dict[str, int]:
+        return self.store.read().get(settings_id, {})
+
+    def record(self, settings_id: str, tracker: ProgressTracker) -> None:
+        tables = tracker.snapshot()
+        if not tables:
+            return
+        with self.store.update() as data:
+            data[settings_id] = {t: p.rows for t, p in tables.items()}
+
+
+def format_progress(tracker: ProgressTracker) -> str:
+    """One line summary of a run's progress, for the logs."""
+    # Reported from the thread handling a line while others may be handled
+    tables = tracker.snapshot()
+    rate = _rows_per_second(tables, tracker.started)
+    eta = _eta_seconds(tables, tracker.started, tracker.expected_rows)
+    summary = f"Progress: {_rows(tables)} rows in {len(tables)} table(s)"
+    if rate:
+        summary += f" at {rate:.0f} rows/s"
+    if tables:
+        current = max(tables.values(), key=lambda p: p.last_seen)
+        summary += f", {current.table} at {current.rows_per_second or 0:.0f} rows/s"
+    if eta is not None:
+        summary += f", about {eta / 60:.0f} min to go"
+    return summary
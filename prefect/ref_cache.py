@@ -0,0 +1,90 @@
+#  Copyright (c) University College London Hospitals NHS Foundation Trust
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+################################################################################
+
+import time
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Iterator, Optional
+from urllib.parse import urlsplit, urlunsplit
+
+from json_store import JsonStore
+
+DEFAULT_TTL_SECONDS = 120
+
+
+class RefCache:
+    """
+    On-disk cache of git refs resolved to commit SHAs, keyed by repository and ref.
+
+    Branches move, so they are only cached for `ttl_seconds`. Tags and full
+    commit SHAs are treated as immutable and cached forever.
+
+    Args:
+        path: Path of the JSON file backing the cache
+        ttl_seconds: How long resolved branches stay valid
+    """
+
+    def __init__(self, path: Path, ttl_seconds: float = DEFAULT_TTL_SECONDS) -> None:
+        self.store = JsonStore(path)
+        self.ttl_seconds = ttl_seconds
+
+    @contextmanager
+    def transaction(self) -> Iterator["RefCacheTransaction"]:
+        """
+        Lock the cache for a lookup followed by updates, so that concurrent
+        workers missing the same refs wait for the first one to resolve them.
+        """
+        with self.store.update() as data:
+            yield RefCacheTransaction(data, self.ttl_seconds)
+
+    def get(self, repo_url: str, ref: str) -> Optional[str]:
+        return RefCacheTransaction(self.store.read(), self.ttl_seconds).get(
+            repo_url, ref
+        )
+
+
+class RefCacheTransaction:
+    """Lookups and updates of a locked `RefCache`."""
+
+    def __init__(self, data: dict, ttl_seconds: float) -> None:
+        self.data = data
+        self.ttl_seconds = ttl_seconds
+
+    def get(self, repo_url: str, ref: str) -> Optional[str]:
+        entry = self.data.get(repo_key(repo_url), {}).get(ref)
+        if entry is None:
+            return None
+        expired = time.time() - entry["resolved_at"] > self.ttl_seconds
+        if expired and not entry["immutable"]:
+            return None
+        return entry["sha"]
+
+    def put(self, repo_url: str, ref: str, sha: str, immutable: bool) -> None:
+        self.data.setdefault(repo_key(repo_url), {})[ref] = {
+            "sha": sha,
+            "immutable": immutable,
+            "resolved_at": time.time(),
+        }
+
+
+def repo_key(repo_url: str) -> str:
+    """Cache key for a repository URL, without any credentials in it."""
+    parts = urlsplit(repo_url)
+    if not parts.netloc:
+        return repo_url
+    netloc = parts.hostname or ""
+    if parts.port:
+        netloc += f":{parts.port}"
+    return urlunsplit(parts._replace(netloc=netloc))
@@ -0,0 +1,101 @@
+#  Copyright (c) University College London Hospitals NHS Foundation Trust
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+################################################################################
+
+import contextvars
+import re
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Optional
+from uuid import UUID
+
+from prefect import logging, runtime
+from prefect.artifacts import (
+    create_progress_artifact,
+    create_table_artifact,
+    update_progress_artifact,
+)
+
+logger = logging.get_logger()
+
+
+def artifact_key(*parts: str) -> str:
+    """
+    Build a Prefect artifact key from its parts. Keys may only contain lowercase
+    letters, numbers and dashes.
+    """
+    return re.sub(r"[^a-z0-9-]+", "-", "-".join(parts).lower()).strip("-")
+
+
+def in_run_context() -> bool:
+    """Whether we're in a flow or task run, so artifacts can be linked to it."""
+    return runtime.flow_run.id is not None or runtime.task_run.id is not None
+
+
+def publish_table(key: str, table: list[dict[str, Any]], description: str) -> None:
+    """
+    Publish a table artifact for the current flow run. Outside of a flow or task
+    run, e.g. when calling a task's function directly in tests, nothing is
+    published.
+    """
+    if not table:
+        return
+    if not in_run_context():
+        logger.debug("Not in a flow or task run, not publishing artifact %s", key)
+        return
+    create_table_artifact(key=artifact_key(key), table=table, description=description)
+
+
+class ProgressArtifact:
+    """
+    A progress artifact of the current flow run, created on the first `update`
+    and updated in place after that. Updates are sent to the API from a thread
+    of their own, so that they can be made from a line handler without holding
+    up the output, or blocking the event loop of an async task. Outside of a
+    flow or task run nothing is published.
+
+    Args:
+        key: Key of the artifact
+    """
+
+    def __init__(self, key: str) -> None:
+        self.key = artifact_key(key)
+        self._artifact_id: Optional[UUID] = None
+        self._executor = ThreadPoolExecutor(max_workers=1) if in_run_context() else None
+
+    def update(self, percent: float, description: str) -> None:
+        """Set the progress, as a percentage, and its description."""
+        if self._executor is None:
+            return
+        # The artifact is linked to the run through the context
+        context = contextvars.copy_context()
+        self._executor.submit(context.run, self._publish, percent, description)
+
+    def close(self) -> None:
+        """Wait for the updates that are still being sent."""
+        if self._executor is not None:
+            self._executor.shutdown()
+
+    def _publish(self, percent: float, description: str) -> None:
+        percent = min(max(percent, 0.0), 100.0)
+        try:
+            if self._artifact_id is None:
+                self._artifact_id = create_progress_artifact(
+                    percent, key=self.key, description=description
+                )
+            else:
+                update_progress_artifact(
+                    self._artifact_id, percent, description=description
+                )
+        except Exception as e:
+            logger.warning("Failed to publish progress artifact %s: %s", self.key, e)
@@ -0,0 +1,108 @@
+#  Copyright (c) University College London Hospitals NHS Foundation Trust
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+################################################################################
+
+import re
+from collections import Counter
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Iterable
+
+INTERVAL_PATTERN = re.compile(r"sample\.interval=(\d+)")
+# Memory fields at the start of each sample when memory profiling is on:
+# small vector heap, large vector heap (both in 8 byte units), nodes, duplications
+MEMORY_PATTERN = re.compile(r":(\d+):(\d+):(\d+):(\d+):")
+FUNCTION_PATTERN = re.compile(r'"([^"]*)"')
+# Size of a cons cell on 64-bit R
+NODE_BYTES = 56
+DEFAULT_TOP_N = 25
+
+
+@dataclass
+class RprofSummary:
+    """
+    Time and memory by function over one or more `Rprof` output files, like
+    R's `summaryRprof(memory = "both")`. Self time is counted for the function
+    at the top of the call stack of a sample, total time for every function on
+    it; memory allocated between two samples is counted for every function on
+    the stack of the later one.
+    """
+
+    interval: float = 0.0
+    samples: int = 0
+    self_samples: Counter[str] = field(default_factory=Counter)
+    total_samples: Counter[str] = field(default_factory=Counter)
+    allocated_bytes: Counter[str] = field(default_factory=Counter)
+
+    @property
+    def seconds(self) -> float:
+        return self.samples * self.interval
+
+    def add_file(self, path: Path) -> None:
+        with open(path, errors="replace") as f:
+            self.add_lines(f)
+
+    def add_lines(self, lines: Iterable[str]) -> None:
+        memory = None
+        for line in lines:
+            if match := INTERVAL_PATTERN.search(line):
+                # In microseconds; files from a run share the same interval
+                self.interval = int(match.group(1)) / 1e6
+                continue
+            if line.startswith("#"):
+                # File names of line profiling
+                continue
+            allocated = 0
+            if match := MEMORY_PATTERN.match(line):
+                small, large, nodes, _ = map(int, match.groups())
+                current = (small + large) * 8 + nodes * NODE_BYTES
+                if memory is not None:
+                    allocated = max(current - memory, 0)
+                memory = current
+                line = line[match.end() :]
+            stack = FUNCTION_PATTERN.findall(line)
+            if not stack:
+                continue
+            self.samples += 1
+            self.self_samples[stack[0]] += 1
+            # Recursive functions only count once per sample
+            for function in set(stack):
+                self.total_samples[function] += 1
+                self.allocated_bytes[function] += allocated
+
+    def table(self, top_n: int = DEFAULT_TOP_N) -> list[dict[str, str | float]]:
+        """The `top_n` functions with the most self time."""
+        if not self.samples:
+            return []
+        return [
+            {
+                "function": function,
+                "self_seconds": round(count * self.interval, 2),
+                "self_pct": round(100 * count / self.samples, 1),
+                "total_seconds": round(self.total_samples[function] * self.interval, 2),
+                "total_pct": round(
+                    100 * self.total_samples[function] / self.samples, 1
+                ),
+                "allocated_mb": round(self.allocated_bytes[function] / 2**20, 1),
+            }
+            for function, count in self.self_samples.most_common(top_n)
+        ]
+
+
+def summarise_profiles(directory: Path) -> RprofSummary:
+    """Summarise the profiles of all R processes of a run in `directory`."""
+    summary = RprofSummary()
+    for path in sorted(directory.glob("*.Rprof")):
+        summary.add_file(path)
+    return summary
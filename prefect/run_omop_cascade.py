@@ -0,0 +1,158 @@
+#  Copyright (c) University College London Hospitals NHS Foundation Trust
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+################################################################################
+
+import os
+import subprocess
+import uuid
+from pathlib import Path
+
+from prefect import flow, logging, task
+from prefect.concurrency.sync import concurrency
+
+from fan_out import map_bounded
+from limits import concurrency_limit_name
+from reporting import artifact_key, publish_table
+from run_omop_es import IS_PROD, ROOT_PATH, name_with_timestamp, use_prod_if
+from run_subprocess import run_subprocess
+from timeouts import (
+    DEFAULT_INACTIVITY_SECONDS,
+    DEFAULT_TIMEOUT_SECONDS,
+    Watchdog,
+    retry_unless_timed_out,
+)
+
+# Database the CRDMs are imported into, unless the flow is told otherwise
+DEFAULT_DATABASE = "crdm"
+# Seconds an import may run for, and may go without printing anything, before its
+# container is stopped; 0 to disable
+IMPORT_TIMEOUT = float(
+    os.environ.get("OMOP_CASCADE_TIMEOUT_SECONDS", DEFAULT_TIMEOUT_SECONDS)
+)
+IMPORT_INACTIVITY = float(
+    os.environ.get("OMOP_CASCADE_INACTIVITY_SECONDS", DEFAULT_INACTIVITY_SECONDS)
+)
+
+logger = logging.get_logger()
+
+
+@flow(flow_run_name=name_with_timestamp, log_prints=True)
+def run_omop_cascade(
+    crdm_ids: list[str],
+    input_directory: str = "",
+    database: str = DEFAULT_DATABASE,
+    max_concurrency: int = 4,
+) -> dict[str, str]:
+    """Import the output of an omop_es extraction into several CRDMs at once.
+
+    Imports into the same database share its global concurrency limit, see
+    `database_limit`, across all flow runs, so no more imports load a database
+    at once than it can take, however many flows are running.
+
+    Args:
+        crdm_ids: Identifiers of the CRDMs to import into
+        input_directory: Directory with the omop_es output, as seen by the
+            containers; set by the trigger when chained after run_omop_es
+        database: Database the CRDMs are imported into
+        max_concurrency: Maximum number of imports started by this flow run at
+            the same time
+
+    Returns:
+        The final state of the import of each CRDM, by CRDM identifier
+
+    Raises:
+        RuntimeError: If the import failed for any of the CRDMs
+    """
+    if input_directory:
+        logger.info("Importing omop_es output from %s", input_directory)
+    outcomes = map_bounded(
+        run_omop_cascade_docker,
+        [
+            dict(
+                working_dir=ROOT_PATH,
+                crdm_id=crdm_id,
+                input_directory=input_directory,
+                database=database,
+            )
+            for crdm_id in crdm_ids
+        ],
+        max_concurrency=max_concurrency,
+    )
+
+    publish_table(
+        artifact_key("omop-cascade", database),
+        [
+            {
+                "crdm_id": outcome.parameters["crdm_id"],
+                "state": outcome.state.name,
+                "duration (s)": round(outcome.duration),
+                "error": outcome.error or "",
+            }
+            for outcome in outcomes
+        ],
+        description=f"omop-cascade imports of `{input_directory or 'default input'}` "
+        f"into {database}",
+    )
+
+    failed = [o.parameters["crdm_id"] for o in outcomes if o.error is not None]
+    if failed:
+        raise RuntimeError(f"omop-cascade import failed for: {', '.join(failed)}")
+    return {o.parameters["crdm_id"]: o.state.name for o in outcomes}
+
+
+@task(retries=2, retry_delay_seconds=600, retry_condition_fn=retry_unless_timed_out)
+def run_omop_cascade_docker(
+    working_dir: Path,
+    crdm_id: str,
+    input_directory: str = "",
+    database: str = DEFAULT_DATABASE,
+) -> subprocess.CompletedProcess:
+    env = os.environ.copy()
+    env["CRDM_ID"] = crdm_id
+    env["INPUT_DIRECTORY"] = input_directory
+    container = f"omop-cascade-{crdm_id}-{uuid.uuid4().hex[:8]}"
+    args = [
+        "docker",
+        "compose",
+        *use_prod_if(IS_PROD),
+        "--project-name",
+        "omop-cascade",
+        "run",
+        "--env",
+        f"CRDM_ID={crdm_id}",
+        "--env",
+        f"INPUT_DIRECTORY={input_directory}",
+        "--name",
+        container,
+        "--rm",
+        "omop-cascade",
+    ]
+    # Waits for a slot if the limit is taken; without a limit, imports run freely
+    watchdog = Watchdog(container, timeout=IMPORT_TIMEOUT, inactivity=IMPORT_INACTIVITY)
+    with concurrency(database_limit(database), occupy=1), watchdog:
+        return run_subprocess(
+            working_dir,
+            args,
+            env,
+            line_handlers=[watchdog],
+            on_start=watchdog.attach,
+        )
+
+
+def database_limit(database: str) -> str:
+    """
+    Name of the Prefect global concurrency limit for imports into a database,
+    create it with `prefect gcl create <name> --limit <n>`.
+    """
+    return concurrency_limit_name("omop-cascade", database)
@@ -13,75 +13,393 @@
 #  limitations under the License.
 ################################################################################
 
+import asyncio
 import re
 import subprocess
-from logging import Logger
+import threading
+import time
+from collections import Counter
+from logging import CRITICAL, DEBUG, ERROR, INFO, WARNING, Logger, getLevelName
 from pathlib import Path
-from typing import Optional
+from typing import IO, Callable, Mapping, Optional, Sequence
 
 from prefect import logging
 from prefect.logging.loggers import LoggingAdapter
 
+from output_capture import (
+    DEFAULT_TAIL_BYTES,
+    CapturedProcess,
+    OutputCapture,
+    SpooledOutputCapture,
+)
+
+# Anchored: a level tag only counts at the very start of a line
+LOG_LEVEL_PATTERN = re.compile(r"\[([^\]]*)\]")
+LOG_LEVELS = {
+    "DEBUG": DEBUG,
+    "INFO": INFO,
+    "WARNING": WARNING,
+    "WARN": WARNING,
+    "ERROR": ERROR,
+    "CRITICAL": CRITICAL,
+}
+
+LineHandler = Callable[[str], None]
+
+# Maximum number of lines per second forwarded for each level, levels that are
+# not listed are never rate limited
+DEFAULT_RATE_LIMITS = {DEBUG: 100.0, INFO: 500.0}
+
+# Longest line run_subprocess_async can read, asyncio's default is only 64 KiB
+STREAM_LIMIT = 16 * 1024 * 1024
+
 
 def run_subprocess(
-    working_dir: Path, args: list[str], env: Optional[dict] = None
+    working_dir: Path,
+    args: list[str],
+    env: Optional[dict] = None,
+    spool_dir: Optional[Path] = None,
+    tail_bytes: int = DEFAULT_TAIL_BYTES,
+    line_handlers: Sequence[LineHandler] = (),
+    on_start: Optional[Callable[[int], None]] = None,
 ) -> subprocess.CompletedProcess:
-    """Helper to run subprocesses, logging stderr."""
+    """
+    Helper to run subprocesses, logging stdout and stderr as they arrive.
+
+    Every line of output, without its line ending, is also passed to each of the
+    `line_handlers` as it arrives; handlers are called from two threads at once.
+    `on_start` is called with the pid of the subprocess once it has started.
+
+    By default both streams are kept in memory. If `spool_dir` is given, only
+    the last `tail_bytes` of each stream are kept in memory and the full streams
+    are written to compressed files in `spool_dir` instead; the returned
+    `stdout` and `stderr` are then read back from disk when accessed, and a
+    `CalledProcessError` only carries the tail of each stream.
+    """
     logger = logging.get_run_logger()
     logger.info(f"Running subprocess: {' '.join(args)}")
 
-    with subprocess.Popen(
-        args, stdout=subprocess.PIPE, stderr=subprocess.PIPE, cwd=working_dir, env=env
-    ) as proc:
-        stdout_lines = []
-        stderr_lines = []
+    forwarder = LogForwarder(logger)
+    stdout_capture, stderr_capture = _captures(logger, spool_dir, tail_bytes)
 
-        # Stream stdout and stderr in real-time
-        if proc.stdout:
-            for line in iter(proc.stdout.readline, b""):
-                log(line, logger)
-                stdout_lines.append(line.decode())
-
-        if proc.stderr:
-            stderr = proc.stderr.read()
-            stderr_lines = [x.decode() for x in stderr.splitlines()]
+    with (
+        forwarder,
+        subprocess.Popen(
+            args,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.PIPE,
+            cwd=working_dir,
+            env=env,
+        ) as proc,
+    ):
+        if on_start is not None:
+            on_start(proc.pid)
+        # Drain both pipes concurrently: if we only read stdout to EOF, a process
+        # writing more than a pipe buffer's worth to stderr blocks forever.
+        stderr_reader = threading.Thread(
+            target=_drain,
+            args=(proc.stderr, forwarder, stderr_capture, line_handlers),
+            name="run_subprocess-stderr",
+            daemon=True,
+        )
+        stderr_reader.start()
+        try:
+            _drain(proc.stdout, forwarder, stdout_capture, line_handlers)
+        except BaseException:
+            # Stop the process, or the stderr reader would wait for it forever
+            proc.kill()
+            raise
+        finally:
+            stderr_reader.join()
+            stdout_capture.close()
+            stderr_capture.close()
 
         proc.wait()
 
-    stdout = "\n".join(stdout_lines)
-    stderr = "\n".join(stderr_lines)
-    if stderr:
-        log_level = logger.error if proc.returncode != 0 else logger.debug
-        log_level(stderr)
+    return _completed(args, proc.returncode, stdout_capture, stderr_capture)
 
-    if proc.returncode != 0:
+
+async def run_subprocess_async(
+    working_dir: Path,
+    args: list[str],
+    env: Optional[dict] = None,
+    spool_dir: Optional[Path] = None,
+    tail_bytes: int = DEFAULT_TAIL_BYTES,
+    line_handlers: Sequence[LineHandler] = (),
+    on_start: Optional[Callable[[int], None]] = None,
+) -> subprocess.CompletedProcess:
+    """
+    Async counterpart of `run_subprocess`, so that a single event loop can
+    supervise many subprocesses at once without a thread for each of them.
+
+    Takes the same arguments and returns or raises the same as `run_subprocess`;
+    the `line_handlers` are called from the event loop. If the coroutine is
+    cancelled, the subprocess is terminated.
+    """
+    logger = logging.get_run_logger()
+    logger.info(f"Running subprocess: {' '.join(args)}")
+
+    forwarder = LogForwarder(logger)
+    stdout_capture, stderr_capture = _captures(logger, spool_dir, tail_bytes)
+
+    proc = await asyncio.create_subprocess_exec(
+        *args,
+        stdout=asyncio.subprocess.PIPE,
+        stderr=asyncio.subprocess.PIPE,
+        cwd=working_dir,
+        env=env,
+        limit=STREAM_LIMIT,
+    )
+    if on_start is not None:
+        on_start(proc.pid)
+    flusher = asyncio.create_task(_flush_periodically(forwarder))
+    try:
+        await asyncio.gather(
+            _drain_async(proc.stdout, forwarder, stdout_capture, line_handlers),
+            _drain_async(proc.stderr, forwarder, stderr_capture, line_handlers),
+        )
+        returncode = await proc.wait()
+    except BaseException:
+        if proc.returncode is None:
+            proc.terminate()
+            await asyncio.shield(proc.wait())
+        raise
+    finally:
+        flusher.cancel()
+        forwarder.close()
+        stdout_capture.close()
+        stderr_capture.close()
+
+    return _completed(args, returncode, stdout_capture, stderr_capture)
+
+
+def _captures(
+    logger: Logger | LoggingAdapter, spool_dir: Optional[Path], tail_bytes: int
+) -> tuple[OutputCapture, OutputCapture]:
+    """Captures for the stdout and stderr of a subprocess."""
+    if spool_dir is None:
+        return OutputCapture(), OutputCapture()
+    logger.info(f"Writing subprocess output to {spool_dir}")
+    return (
+        SpooledOutputCapture(spool_dir, "stdout", tail_bytes),
+        SpooledOutputCapture(spool_dir, "stderr", tail_bytes),
+    )
+
+
+def _completed(
+    args: list[str],
+    returncode: int,
+    stdout_capture: OutputCapture,
+    stderr_capture: OutputCapture,
+) -> subprocess.CompletedProcess:
+    """The result of a finished subprocess, raising if it failed."""
+    if returncode != 0:
         raise subprocess.CalledProcessError(
-            proc.returncode, args, output=stdout, stderr=stderr
+            returncode,
+            args,
+            output=stdout_capture.tail(),
+            stderr=stderr_capture.tail(),
         )
-    return subprocess.CompletedProcess(args, proc.returncode, stdout, stderr)
+    return CapturedProcess(args, returncode, stdout_capture, stderr_capture)
+
+
+def _drain(
+    stream: Optional[IO[bytes]],
+    forwarder: "LogForwarder",
+    capture: OutputCapture,
+    line_handlers: Sequence[LineHandler],
+) -> None:
+    """Read a pipe line by line until EOF, forwarding and capturing each line."""
+    if stream is None:
+        return
+    for line in iter(stream.readline, b""):
+        _handle_line(line, forwarder, capture, line_handlers)
+
+
+async def _drain_async(
+    stream: Optional[asyncio.StreamReader],
+    forwarder: "LogForwarder",
+    capture: OutputCapture,
+    line_handlers: Sequence[LineHandler],
+) -> None:
+    """Async counterpart of `_drain`."""
+    if stream is None:
+        return
+    while line := await stream.readline():
+        _handle_line(line, forwarder, capture, line_handlers)
+
+
+def _handle_line(
+    line: bytes,
+    forwarder: "LogForwarder",
+    capture: OutputCapture,
+    line_handlers: Sequence[LineHandler],
+) -> None:
+    """
+    Forward, capture and pass on a line of output. Never raises, so a bad line
+    or a failing handler can't stop the pipe being drained, which would block
+    the process once the pipe is full.
+    """
+    decoded = line.decode(errors="replace")
+    stripped = decoded.rstrip("\r\n")
+    try:
+        forwarder.forward(decoded)
+        capture.append(stripped)
+    except Exception:
+        forwarder.logger.exception("Failed to log subprocess output: %s", stripped)
+    for handler in line_handlers:
+        try:
+            handler(stripped)
+        except Exception:
+            forwarder.logger.exception(
+                "Line handler %r failed on: %s", handler, stripped
+            )
+
+
+async def _flush_periodically(forwarder: "LogForwarder") -> None:
+    """Flush a forwarder's batches from the event loop, rather than a thread."""
+    while True:
+        await asyncio.sleep(forwarder.flush_interval)
+        forwarder.flush()
+
+
+class LogForwarder:
+    """
+    Forward subprocess output to a logger in batches, rather than one record
+    per line.
+
+    Consecutive lines at the same level are merged into a single record, which
+    is emitted once it holds `max_batch_lines` lines, when a line at a
+    different level arrives, or at the latest after `flush_interval` seconds.
+    Lines over the per-level `rate_limits` (lines per second, with bursts of up
+    to `burst_seconds` worth of lines) are dropped; the number of dropped lines
+    is logged as a warning at every flush and in total when closing.
+
+    Use as a context manager to flush batches in the background.
+    """
+
+    def __init__(
+        self,
+        logger: Logger | LoggingAdapter,
+        max_batch_lines: int = 200,
+        flush_interval: float = 1.0,
+        rate_limits: Mapping[int, float] = DEFAULT_RATE_LIMITS,
+        burst_seconds: float = 5.0,
+    ) -> None:
+        self.logger = logger
+        self.max_batch_lines = max_batch_lines
+        self.flush_interval = flush_interval
+        self.rate_limits = {
+            level: _TokenBucket(rate, rate * burst_seconds)
+            for level, rate in rate_limits.items()
+        }
+        self.dropped: Counter[int] = Counter()
+        self._dropped_since_flush: Counter[int] = Counter()
+        self._batch: list[str] = []
+        self._batch_level = INFO
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._flusher: Optional[threading.Thread] = None
+
+    def __enter__(self) -> "LogForwarder":
+        self._stop.clear()
+        self._flusher = threading.Thread(
+            target=self._flush_periodically, name="LogForwarder-flush", daemon=True
+        )
+        self._flusher.start()
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.close()
+
+    def forward(self, line: str) -> None:
+        stripped_line = line.strip()
+        # Inlined log_level(), this runs for every line of output
+        match = LOG_LEVEL_PATTERN.match(stripped_line)
+        level = LOG_LEVELS.get(match.group(1), INFO) if match else INFO
+        with self._lock:
+            limit = self.rate_limits.get(level)
+            if limit is not None and not limit.take(time.monotonic()):
+                self._dropped_since_flush[level] += 1
+                return
+            if self._batch and (
+                level != self._batch_level or len(self._batch) >= self.max_batch_lines
+            ):
+                self._emit_batch()
+            self._batch_level = level
+            self._batch.append(stripped_line)
+
+    def flush(self) -> None:
+        with self._lock:
+            self._emit_batch()
+            self._report_dropped()
+
+    def close(self) -> None:
+        self._stop.set()
+        if self._flusher is not None:
+            self._flusher.join()
+            self._flusher = None
+        self.flush()
+        if self.dropped:
+            self.logger.warning(
+                f"Dropped {self.dropped.total()} line(s) in total over the log rate "
+                f"limits: {_format_counts(self.dropped)}"
+            )
+
+    def _flush_periodically(self) -> None:
+        while not self._stop.wait(self.flush_interval):
+            self.flush()
+
+    def _emit_batch(self) -> None:
+        if self._batch:
+            self.logger.log(self._batch_level, "\n".join(self._batch))
+            self._batch = []
+
+    def _report_dropped(self) -> None:
+        if self._dropped_since_flush:
+            self.logger.warning(
+                "Dropped line(s) over the log rate limits: "
+                f"{_format_counts(self._dropped_since_flush)}"
+            )
+            self.dropped.update(self._dropped_since_flush)
+            self._dropped_since_flush.clear()
+
+
+class _TokenBucket:
+    """Allow `rate` events per second on average, with bursts up to `capacity`."""
+
+    def __init__(self, rate: float, capacity: float) -> None:
+        self.rate = rate
+        self.capacity = max(capacity, 1.0)
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+
+    def take(self, now: float) -> bool:
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        if self.tokens < 1.0:
+            return False
+        self.tokens -= 1.0
+        return True
+
+
+def _format_counts(counts: Counter[int]) -> str:
+    return ", ".join(
+        f"{getLevelName(level)}={count}" for level, count in sorted(counts.items())
+    )
 
 
 def log(line: bytes, logger: Logger | LoggingAdapter) -> None:
     # Detect log level from the line and call appropriate logger function
     stripped_line = line.decode().strip()
-    log_level = extract_log_level(stripped_line)
-
-    match log_level:
-        case "DEBUG":
-            logger.debug(stripped_line)
-        case "INFO":
-            logger.info(stripped_line)
-        case "WARNING" | "WARN":
-            logger.warning(stripped_line)
-        case "ERROR":
-            logger.error(stripped_line)
-        case "CRITICAL":
-            logger.critical(stripped_line)
-        case _:
-            logger.info(stripped_line)
+    logger.log(log_level(stripped_line), stripped_line)
+
+
+def log_level(log_message: str) -> int:
+    """Numeric logging level for a line, defaulting to INFO for unknown levels."""
+    return LOG_LEVELS.get(extract_log_level(log_message) or "", INFO)
 
 
 def extract_log_level(log_message: str) -> Optional[str]:
-    pattern = r"\[(.*?)\]"
-    match = re.search(pattern, log_message)
+    match = LOG_LEVEL_PATTERN.match(log_message)
     return match.group(1) if match else None
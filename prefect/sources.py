@@ -0,0 +1,65 @@
+#  Copyright (c) University College London Hospitals NHS Foundation Trust
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+################################################################################
+
+from pathlib import Path
+from typing import Iterable, Optional
+
+import dotenv
+
+from limits import concurrency_limit_name
+
+
+def connection_groups(env_file: Path) -> list[str]:
+    """
+    Source systems omop_es can connect to: the groups of `<GROUP>_SERVER`,
+    `<GROUP>_DATABASE`, etc. variables in its env file whose server is set,
+    e.g. `caboodle` and `clarity`.
+    """
+    values = dotenv.dotenv_values(env_file)
+    return sorted(
+        name.removesuffix("_SERVER").lower()
+        for name, value in values.items()
+        if name.endswith("_SERVER") and value
+    )
+
+
+def resolve_sources(
+    declared: Optional[Iterable[str]], available: list[str]
+) -> list[str]:
+    """
+    The source systems a run hits: the `declared` ones, or all `available`
+    ones if the flow didn't declare any.
+
+    Raises:
+        ValueError: If a declared source isn't one of the available ones
+    """
+    if declared is None:
+        return available
+    sources = sorted({source.lower() for source in declared})
+    unknown = [source for source in sources if source not in available]
+    if unknown:
+        raise ValueError(
+            f"Unknown source system(s) {', '.join(unknown)}, "
+            f"expected some of: {', '.join(available) or 'none configured'}"
+        )
+    return sources
+
+
+def source_limits(sources: Iterable[str]) -> list[str]:
+    """
+    Names of the Prefect global concurrency limits for source systems, create
+    them with `prefect gcl create <name> --limit <n>`.
+    """
+    return [concurrency_limit_name("omop-es-source", source) for source in sources]
@@ -0,0 +1,205 @@
+#  Copyright (c) University College London Hospitals NHS Foundation Trust
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+################################################################################
+
+import asyncio
+import json
+import re
+import subprocess
+import threading
+import time
+from dataclasses import asdict, dataclass
+from typing import Callable, Optional
+
+from prefect import logging
+
+DEFAULT_INTERVAL_SECONDS = 10.0
+SIZE_PATTERN = re.compile(r"([\d.]+)\s*([a-zA-Z]*)")
+SIZE_UNITS = {
+    "": 1,
+    "b": 1,
+    "kb": 1000,
+    "mb": 1000**2,
+    "gb": 1000**3,
+    "tb": 1000**4,
+    "kib": 1024,
+    "mib": 1024**2,
+    "gib": 1024**3,
+    "tib": 1024**4,
+}
+# Counters that only go up over the life of a container
+CUMULATIVE = ("block_read_bytes", "block_write_bytes", "net_rx_bytes", "net_tx_bytes")
+
+logger = logging.get_logger()
+
+
+@dataclass(frozen=True)
+class ResourceSample:
+    """Resources used by a container at a point in time."""
+
+    timestamp: float
+    cpu_percent: float
+    memory_bytes: int
+    block_read_bytes: int
+    block_write_bytes: int
+    net_rx_bytes: int
+    net_tx_bytes: int
+
+
+def parse_size(size: str) -> int:
+    """Parse a size as printed by `docker stats`, e.g. '1.5GiB' or '20kB'."""
+    match = SIZE_PATTERN.fullmatch(size.strip())
+    if match is None or match.group(2).lower() not in SIZE_UNITS:
+        raise ValueError(f"Invalid size: {size!r}")
+    return round(float(match.group(1)) * SIZE_UNITS[match.group(2).lower()])
+
+
+def parse_docker_stats(line: str, timestamp: float) -> ResourceSample:
+    """Parse a line of `docker stats --format '{{json .}}'`."""
+    stats = json.loads(line)
+    block_read, block_write = stats["BlockIO"].split("/")
+    net_rx, net_tx = stats["NetIO"].split("/")
+    return ResourceSample(
+        timestamp=timestamp,
+        cpu_percent=float(stats["CPUPerc"].rstrip("%")),
+        memory_bytes=parse_size(stats["MemUsage"].split("/")[0]),
+        block_read_bytes=parse_size(block_read),
+        block_write_bytes=parse_size(block_write),
+        net_rx_bytes=parse_size(net_rx),
+        net_tx_bytes=parse_size(net_tx),
+    )
+
+
+def read_docker_stats(container: str) -> Optional[ResourceSample]:
+    """Sample the resources used by a running container, or None if it isn't running."""
+    try:
+        result = subprocess.run(
+            ["docker", "stats", "--no-stream", "--format", "{{json .}}", container],
+            capture_output=True,
+            text=True,
+        )
+    except OSError:
+        return None
+    if result.returncode != 0 or not result.stdout.strip():
+        return None
+    return parse_docker_stats(result.stdout.splitlines()[0], time.time())
+
+
+class ResourceSampler:
+    """
+    Sample the resources used by a container in a background thread, for the
+    duration of the block. Samples are taken every `interval` seconds, from when
+    the container starts running until the block exits. Use `async with` in
+    coroutines, so waiting for the last sample doesn't block the event loop.
+
+    Args:
+        container: Name of the container
+        interval: Seconds between samples, sampling is disabled if not positive
+        read: Function taking a sample of a container, `docker stats` by default
+    """
+
+    def __init__(
+        self,
+        container: str,
+        interval: float = DEFAULT_INTERVAL_SECONDS,
+        read: Callable[[str], Optional[ResourceSample]] = read_docker_stats,
+    ) -> None:
+        self.container = container
+        self.interval = interval
+        self.read = read
+        self.samples: list[ResourceSample] = []
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._sample, daemon=True)
+
+    def __enter__(self) -> "ResourceSampler":
+        if self.interval > 0:
+            self._thread.start()
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self._stop.set()
+        if self._thread.is_alive():
+            self._thread.join()
+
+    async def __aenter__(self) -> "ResourceSampler":
+        return self.__enter__()
+
+    async def __aexit__(self, *exc_info) -> None:
+        await asyncio.to_thread(self.__exit__, *exc_info)
+
+    def _sample(self) -> None:
+        while not self._stop.is_set():
+            try:
+                sample = self.read(self.container)
+            except Exception:
+                logger.debug("Failed to sample %s", self.container, exc_info=True)
+                sample = None
+            if sample is not None:
+                self.samples.append(sample)
+            self._stop.wait(self.interval)
+
+    def table(self) -> list[dict[str, float]]:
+        """All samples, with times relative to the first sample."""
+        if not self.samples:
+            return []
+        start = self.samples[0].timestamp
+        return [
+            {**asdict(sample), "timestamp": round(sample.timestamp - start, 1)}
+            for sample in self.samples
+        ]
+
+    def summary(self) -> list[dict[str, str | float]]:
+        """
+        Peak, mean and total of each resource. For CPU the total is in CPU
+        seconds; for I/O counters, the peak and mean are rates per second.
+        """
+        samples = self.samples
+        if not samples:
+            return []
+        elapsed = [b.timestamp - a.timestamp for a, b in zip(samples, samples[1:])]
+
+        cpu = [sample.cpu_percent for sample in samples]
+        memory = [sample.memory_bytes for sample in samples]
+        rows: list[dict[str, str | float]] = [
+            {
+                "resource": "cpu_percent",
+                "peak": max(cpu),
+                "mean": round(sum(cpu) / len(cpu), 2),
+                # Each sample's usage lasts until the next sample
+                "total": round(sum(c / 100 * dt for c, dt in zip(cpu, elapsed)), 1),
+            },
+            {
+                "resource": "memory_bytes",
+                "peak": max(memory),
+                "mean": round(sum(memory) / len(memory)),
+                "total": "",
+            },
+        ]
+        duration = samples[-1].timestamp - samples[0].timestamp
+        for name in CUMULATIVE:
+            values = [getattr(sample, name) for sample in samples]
+            rates = [
+                (b - a) / dt for a, b, dt in zip(values, values[1:], elapsed) if dt > 0
+            ]
+            rows.append(
+                {
+                    "resource": name,
+                    "peak": round(max(rates, default=0)),
+                    "mean": round((values[-1] - values[0]) / duration)
+                    if duration
+                    else 0,
+                    "total": values[-1],
+                }
+            )
+        return rows
@@ -0,0 +1,83 @@
+#  Copyright (c) University College London Hospitals NHS Foundation Trust
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+################################################################################
+
+import os
+
+from checkpoints import CheckpointManifest, find_resumable
+
+DETAILS = {"settings_id": "my_project", "omop_es_version": "abc123"}
+
+
+def test_manifest_records_checkpoint_lines(tmp_path):
+    manifest = CheckpointManifest(tmp_path / "run.json")
+    manifest.start(DETAILS)
+    for line in [
+        "[CHECKPOINT] person",
+        "[INFO] visit_occurrence",
+        "[CHECKPOINT] measurement",
+        "[CHECKPOINT] person",
+    ]:
+        manifest(line)
+
+    assert manifest.units() == ["person", "measurement"]
+    assert manifest.write_units().read_text() == "person\nmeasurement\n"
+    assert manifest.read()["complete"] is False
+    manifest.remove()
+    assert list(tmp_path.iterdir()) == []
+
+
+def test_manifest_start_keeps_units_of_earlier_attempts(tmp_path):
+    manifest = CheckpointManifest(tmp_path / "run.json")
+    manifest.start(DETAILS, units=["person"])
+    manifest.record("measurement")
+
+    # A retry of the same run
+    manifest.start(DETAILS, units=["person", "drug_exposure"])
+
+    assert manifest.units() == ["person", "measurement", "drug_exposure"]
+
+
+def test_completed_window_covers_the_current_attempt(tmp_path):
+    manifest = CheckpointManifest(tmp_path / "run.json")
+    assert manifest.completed_window() is None
+    manifest.start(DETAILS)
+    assert manifest.completed_window() is None
+
+    manifest.record("person")
+    started_at, completed_at = manifest.completed_window()
+    assert started_at <= completed_at
+
+    # A retry hasn't completed anything yet
+    manifest.start(DETAILS)
+    assert manifest.completed_window() is None
+
+
+def test_find_resumable_picks_latest_incomplete_match(tmp_path):
+    def make(name, mtime, **details):
+        manifest = CheckpointManifest(tmp_path / f"{name}.json")
+        manifest.start({**DETAILS, **details}, units=[name])
+        os.utime(manifest.path, (mtime, mtime))
+        return manifest
+
+    make("old", 1)
+    make("newer", 2)
+    make("complete", 3).remove()
+    make("other_version", 4, omop_es_version="def456")
+
+    resumable = find_resumable(tmp_path, DETAILS)
+
+    assert resumable is not None
+    assert resumable.units() == ["newer"]
+    assert find_resumable(tmp_path, {**DETAILS, "settings_id": "other"}) is None
@@ -0,0 +1,190 @@
+#  Copyright (c) University College London Hospitals NHS Foundation Trust
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+################################################################################
+
+import gzip
+import hashlib
+import json
+import os
+import shutil
+import time
+import zipfile
+
+import pytest
+from prefect import flow
+
+import run_omop_es
+from checkpoints import CheckpointManifest
+from compression import MANIFEST_NAME, OutputCompressor
+
+
+@pytest.fixture
+def output(tmp_path):
+    output = tmp_path / "output"
+    (output / "nested").mkdir(parents=True)
+    (output / "person.csv").write_text("id\n1\n2\n")
+    (output / "nested" / "measurement.csv").write_text("id,value\n1,2\n")
+    (output / ".checkpoint").write_text("hidden")
+    return output
+
+
+def sha256(data: bytes) -> str:
+    return hashlib.sha256(data).hexdigest()
+
+
+def test_gzip_replaces_files_and_writes_manifest(output):
+    compressor = OutputCompressor(output, "gzip")
+    assert compressor.poll(0, time.time() + 1) == 2
+    entries = compressor.finish()
+
+    assert sorted(p.name for p in output.rglob("*")) == [
+        ".checkpoint",
+        MANIFEST_NAME,
+        "measurement.csv.gz",
+        "nested",
+        "person.csv.gz",
+    ]
+    with gzip.open(output / "person.csv.gz") as f:
+        assert f.read() == b"id\n1\n2\n"
+    manifest = json.loads((output / MANIFEST_NAME).read_text())
+    assert manifest["files"] == entries
+    assert entries[1]["file"] == "person.csv"
+    assert entries[1]["size"] == 7
+    assert entries[1]["sha256"] == sha256(b"id\n1\n2\n")
+    assert entries[1]["compressed_file"] == "person.csv.gz"
+    assert entries[1]["compressed_sha256"] == sha256(
+        (output / "person.csv.gz").read_bytes()
+    )
+
+
+def test_recompresses_files_changed_after_compression(output):
+    compressor = OutputCompressor(output, "gzip")
+    compressor.poll(0, time.time() + 1)
+    with open(output / "person.csv", "a") as f:
+        f.write("3\n")
+    stat = (output / "person.csv").stat()
+    os.utime(output / "person.csv", ns=(stat.st_atime_ns, stat.st_mtime_ns + 10**9))
+
+    compressor.finish()
+
+    with gzip.open(output / "person.csv.gz") as f:
+        assert f.read() == b"id\n1\n2\n3\n"
+
+
+def test_only_files_of_completed_units_are_compressed_early(output):
+    mtime = (output / "person.csv").stat().st_mtime
+    compressor = OutputCompressor(output, "gzip")
+    # Written after the last checkpoint, so still in progress
+    assert compressor.poll(0, mtime) == 0
+    # Written before the current attempt started, so may be written again
+    assert compressor.poll(mtime + 1, mtime + 2) == 0
+    compressor.finish()
+    assert (output / "person.csv.gz").exists()
+
+
+def test_zip_keeps_files(output):
+    entries = OutputCompressor(output, "zip").finish()
+
+    with zipfile.ZipFile(output.with_name("output.zip")) as zf:
+        assert sorted(zf.namelist()) == ["nested/measurement.csv", "person.csv"]
+        assert zf.read("person.csv") == b"id\n1\n2\n"
+    assert (output / "person.csv").exists()
+    assert {entry["compressed_file"] for entry in entries} == {"output.zip"}
+
+
+@pytest.mark.skipif(shutil.which("zstd") is None, reason="zstd is not installed")
+def test_zstd(output):
+    OutputCompressor(output, "zstd").finish()
+    assert (output / "person.csv.zst").exists()
+    assert not (output / "person.csv").exists()
+
+
+def test_abort_keeps_originals(output):
+    compressor = OutputCompressor(output, "gzip")
+    compressor.poll(0, time.time() + 1)
+    compressor.abort()
+
+    assert (output / "person.csv").exists()
+    assert not (output / "person.csv.gz").exists()
+    assert not (output / MANIFEST_NAME).exists()
+
+
+def test_unknown_compression(output):
+    with pytest.raises(ValueError, match="Unknown compression"):
+        OutputCompressor(output, "rar")
+
+
+@pytest.mark.parametrize("succeeded", [True, False])
+def test_compressing_output_alongside_extraction(
+    prefect_test_server, mocker, tmp_path, succeeded
+):
+    mocker.patch("run_omop_es.EXTRACT_PATH", tmp_path)
+    mocker.patch("run_omop_es.COMPRESSION_POLL_SECONDS", 0.01)
+    output = tmp_path / "my_project"
+
+    @flow
+    def extract():
+        with run_omop_es.compressing_output("/app/extract/my_project", "gzip"):
+            output.mkdir()
+            (output / "person.csv").write_text("id\n1\n")
+            if not succeeded:
+                raise RuntimeError("Extraction failed")
+
+    if succeeded:
+        extract()
+        assert (output / "person.csv.gz").exists()
+        assert (output / MANIFEST_NAME).exists()
+    else:
+        with pytest.raises(RuntimeError, match="Extraction failed"):
+            extract()
+        assert (output / "person.csv").exists()
+    assert not (output / run_omop_es.FINISHED_MARKER).exists()
+
+
+def test_compressing_output_follows_checkpoints(prefect_test_server, mocker, tmp_path):
+    mocker.patch("run_omop_es.EXTRACT_PATH", tmp_path)
+    mocker.patch("run_omop_es.CHECKPOINTS_PATH", tmp_path / ".checkpoints")
+    mocker.patch("run_omop_es.COMPRESSION_POLL_SECONDS", 0.01)
+    output = tmp_path / "my_project"
+
+    @flow
+    def extract():
+        manifest = CheckpointManifest(
+            run_omop_es.checkpoint_path(
+                "my_project", "abc123", str(run_omop_es.runtime.flow_run.id)
+            )
+        )
+        with run_omop_es.compressing_output(
+            "/app/extract/my_project", "gzip", "my_project", "abc123"
+        ):
+            manifest.start({})
+            output.mkdir()
+            time.sleep(0.05)
+            (output / "person.csv").write_text("id\n1\n")
+            time.sleep(0.05)
+            manifest("[CHECKPOINT] person")
+            time.sleep(0.05)
+            (output / "visit_occurrence.csv").write_text("id\n1\n")
+            deadline = time.monotonic() + 10
+            while not (output / "person.csv.gz").exists():
+                assert time.monotonic() < deadline
+                time.sleep(0.01)
+            time.sleep(0.1)
+            # Still being written, so left until the extraction has finished
+            assert not (output / "visit_occurrence.csv.gz").exists()
+            manifest.remove()
+
+    extract()
+    assert (output / "visit_occurrence.csv.gz").exists()
+    assert not (output / "person.csv").exists()
@@ -0,0 +1,170 @@
+#  Copyright (c) University College London Hospitals NHS Foundation Trust
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+################################################################################
+
+import fcntl
+import time
+
+import pytest
+
+from container_pool import ContainerPool
+
+SHA = "f439272f850c4a86fb28ca142c2280494d85e364"
+NEW_SHA = "0b1a2c3d4e5f60718293a4b5c6d7e8f901234567"
+
+
+@pytest.fixture
+def docker(mocker):
+    """Stand-in for the docker commands, with the started containers warm."""
+    started = []
+    mocker.patch(
+        "container_pool.start_container",
+        side_effect=lambda name, *args: started.append(name) or True,
+    )
+    mocker.patch("container_pool.is_warm", side_effect=lambda name: name in started)
+    mocker.patch("container_pool.is_running", return_value=True)
+    mocker.patch("container_pool.remove_container")
+    return started
+
+
+def test_container_pool_is_disabled_by_default(tmp_path, docker):
+    pool = ContainerPool(tmp_path / "pool.json")
+
+    assert pool.acquire(SHA) is None
+    assert docker == []
+
+
+def test_container_pool_starts_containers_up_to_size(tmp_path, docker):
+    pool = ContainerPool(tmp_path / "pool.json", size=2)
+
+    # No container is warm yet, so the first runs go cold while the pool fills
+    assert pool.acquire(SHA) is None
+    leased = pool.acquire(SHA)
+    assert leased == docker[0]
+    assert pool.acquire(SHA) is None
+    assert len(docker) == 2
+    assert pool.acquire(SHA) == docker[1]
+    assert pool.acquire(SHA) is None
+    assert len(docker) == 2
+
+    pool.release(leased)
+    assert pool.acquire(SHA) == leased
+    assert pool.containers()[leased]["runs"] == 1
+
+
+def test_container_pool_recycles_containers(tmp_path, docker):
+    pool = ContainerPool(tmp_path / "pool.json", size=1, max_runs=2)
+    pool.acquire(SHA)
+    leased = pool.acquire(SHA)
+
+    pool.release(leased)
+    pool.release(pool.acquire(SHA))
+    assert leased not in pool.containers()
+
+    pool.acquire(SHA)
+    failed = pool.acquire(SHA)
+    pool.release(failed, recycle=True)
+    assert failed not in pool.containers()
+
+
+def test_container_pool_replaces_idle_containers_of_other_versions(
+    tmp_path, docker, mocker
+):
+    pool = ContainerPool(tmp_path / "pool.json", size=1, idle_seconds=600)
+    pool.acquire(SHA)
+    idle = pool.acquire(SHA)
+    pool.release(idle)
+
+    # Both versions in use keep their containers
+    assert pool.acquire(NEW_SHA) is None
+    assert pool.acquire(NEW_SHA) is not None
+    assert idle in pool.containers()
+    assert pool.acquire(SHA) == idle
+    pool.release(idle)
+
+    mocker.patch("container_pool.time.time", return_value=time.time() + 700)
+    pool.acquire(NEW_SHA)
+    assert idle not in pool.containers()
+
+
+def test_container_pool_drops_containers_that_died_warming_up(tmp_path, mocker):
+    pool = ContainerPool(tmp_path / "pool.json", size=1)
+    start = mocker.patch("container_pool.start_container", return_value=True)
+    mocker.patch("container_pool.is_warm", return_value=False)
+    is_running = mocker.patch("container_pool.is_running", return_value=True)
+    remove = mocker.patch("container_pool.remove_container")
+
+    assert pool.acquire(SHA) is None
+    warming = start.call_args.args[0]
+    # Still warming up, so no other container is started
+    assert pool.acquire(SHA) is None
+    assert start.call_count == 1
+
+    is_running.return_value = False
+    assert pool.acquire(SHA) is None
+    remove.assert_called_once_with(warming)
+    assert start.call_count == 2
+    assert warming not in pool.containers()
+
+
+def test_container_pool_reclaims_containers_of_dead_runs(tmp_path, docker, mocker):
+    pool = ContainerPool(tmp_path / "pool.json", size=1, lease_seconds=60)
+    pool.acquire(SHA)
+    leased = pool.acquire(SHA)
+    lease = pool.containers()[leased]["lease"]
+    assert lease is not None
+
+    # The run stopped renewing its lease
+    mocker.patch("container_pool.time.time", return_value=time.time() + 120)
+    assert pool.acquire(SHA) is None
+    assert leased not in pool.containers()
+    assert len(pool.containers()) == 1
+
+    # Releasing the expired lease doesn't touch the pool any more
+    pool.release(leased)
+    assert len(pool.containers()) == 1
+
+
+def test_container_pool_renews_leases_until_released(tmp_path, docker):
+    pool = ContainerPool(tmp_path / "pool.json", size=1, heartbeat_seconds=0.01)
+    pool.acquire(SHA)
+    leased = pool.acquire(SHA)
+    heartbeat = pool.containers()[leased]["heartbeat"]
+
+    deadline = time.monotonic() + 5
+    while pool.containers()[leased]["heartbeat"] == heartbeat:
+        assert time.monotonic() < deadline
+        time.sleep(0.01)
+
+    pool.release(leased)
+    time.sleep(0.05)
+    assert pool.containers()[leased]["lease"] is None
+    assert pool.containers()[leased]["heartbeat"] is None
+
+
+def test_container_pool_checks_health_without_holding_the_pool(tmp_path, mocker):
+    pool = ContainerPool(tmp_path / "pool.json", size=1)
+    mocker.patch("container_pool.start_container", return_value=True)
+    mocker.patch("container_pool.remove_container")
+
+    def is_warm(name):
+        # Another flow run can use the pool meanwhile
+        with open(pool.store.lock_path) as f:
+            fcntl.flock(f, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        assert pool.containers()[name]["lease"] is not None
+        return True
+
+    mocker.patch("container_pool.is_warm", side_effect=is_warm)
+    pool.acquire(SHA)
+    assert pool.acquire(SHA) is not None
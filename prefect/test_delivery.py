@@ -0,0 +1,90 @@
+#  Copyright (c) University College London Hospitals NHS Foundation Trust
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+################################################################################
+
+import os
+
+import pytest
+
+import delivery
+from delivery import deliver_directory, deliver_file, partial_path
+
+
+@pytest.fixture
+def small_chunks(monkeypatch):
+    monkeypatch.setattr(delivery, "CHUNK_SIZE", 1000)
+
+
+@pytest.fixture
+def source(tmp_path):
+    source = tmp_path / "staging" / "person.csv"
+    source.parent.mkdir()
+    source.write_bytes(os.urandom(10_000))
+    return source
+
+
+def test_deliver_file(tmp_path, source, small_chunks):
+    destination = tmp_path / "share" / "person.csv"
+
+    entry = deliver_file(source, destination)
+
+    assert destination.read_bytes() == source.read_bytes()
+    assert not partial_path(destination).exists()
+    assert entry["copied"] == 10_000
+    assert not entry["resumed"]
+
+
+def test_deliver_file_skips_delivered_files(tmp_path, source):
+    destination = tmp_path / "share" / "person.csv"
+    deliver_file(source, destination)
+
+    assert deliver_file(source, destination)["copied"] == 0
+
+
+def test_deliver_file_resumes_partial_copy(tmp_path, source, small_chunks):
+    destination = tmp_path / "share" / "person.csv"
+    destination.parent.mkdir()
+    partial_path(destination).write_bytes(source.read_bytes()[:4_000])
+
+    entry = deliver_file(source, destination)
+
+    assert entry["resumed"]
+    assert entry["copied"] == 6_000
+    assert destination.read_bytes() == source.read_bytes()
+
+
+def test_deliver_file_restarts_mismatched_partial_copy(tmp_path, source):
+    destination = tmp_path / "share" / "person.csv"
+    destination.parent.mkdir()
+    partial_path(destination).write_bytes(b"x" * 4_000)
+    # A stale destination from an older run is replaced
+    destination.write_bytes(b"old")
+
+    entry = deliver_file(source, destination)
+
+    assert not entry["resumed"]
+    assert entry["copied"] == 10_000
+    assert destination.read_bytes() == source.read_bytes()
+
+
+def test_deliver_directory(tmp_path, source):
+    (source.parent / "nested").mkdir()
+    (source.parent / "nested" / "visit.csv").write_text("visit_id\n1\n")
+    (source.parent / ".finished").write_text("hidden")
+
+    entries = deliver_directory(source.parent, tmp_path / "share", max_workers=2)
+
+    assert [entry["file"] for entry in entries] == ["person.csv", "nested/visit.csv"]
+    assert (tmp_path / "share" / "nested" / "visit.csv").read_text() == "visit_id\n1\n"
+    assert not (tmp_path / "share" / ".finished").exists()
@@ -0,0 +1,108 @@
+#  Copyright (c) University College London Hospitals NHS Foundation Trust
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+################################################################################
+
+import threading
+import time
+
+import pytest
+from prefect import flow, task
+
+import run_omop_es
+from fan_out import map_bounded
+
+_lock = threading.Lock()
+_running = 0
+_max_running = 0
+
+
+@task
+def track_concurrency(name: str, fail: bool = False) -> str:
+    global _running, _max_running
+    with _lock:
+        _running += 1
+        _max_running = max(_max_running, _running)
+    time.sleep(0.2)
+    with _lock:
+        _running -= 1
+    if fail:
+        raise ValueError(f"{name} failed")
+    return name
+
+
+@flow
+def fan_out_flow(names: list[str], max_concurrency: int, failing: str = ""):
+    return map_bounded(
+        track_concurrency,
+        [dict(name=name, fail=name == failing) for name in names],
+        max_concurrency,
+    )
+
+
+def test_map_bounded_limits_concurrency(prefect_test_server):
+    global _max_running
+    _max_running = 0
+    names = [f"project-{i}" for i in range(5)]
+
+    outcomes = fan_out_flow(names, max_concurrency=2, failing="project-1")
+
+    assert _max_running == 2
+    assert [o.parameters["name"] for o in outcomes] == names
+    assert [o.error is None for o in outcomes] == [True, False, True, True, True]
+    assert "project-1 failed" in outcomes[1].error
+    assert all(o.duration >= 0.2 for o in outcomes)
+
+
+def test_map_bounded_rejects_invalid_concurrency():
+    with pytest.raises(ValueError, match="max_concurrency"):
+        map_bounded(track_concurrency, [], max_concurrency=0)
+
+
+@task
+def fake_run_omop_es_docker(settings_id: str, **kwargs) -> None:
+    if settings_id == "broken":
+        raise RuntimeError("container exited with code 1")
+
+
+def test_run_omop_es_projects_pins_and_builds_once(prefect_test_server, mocker):
+    mocker.patch("run_omop_es.update_omop_es_mirror")
+    pin = mocker.patch("run_omop_es.pin_omop_es_version", return_value="abc1234")
+    build = mocker.patch("run_omop_es.build_docker")
+    mocker.patch("run_omop_es.run_omop_es_docker", fake_run_omop_es_docker)
+
+    mapped = mocker.patch("run_omop_es.map_bounded", wraps=map_bounded)
+
+    result = run_omop_es.run_omop_es_projects(
+        ["one", "two", "three"], output_directory="/app/extract/out"
+    )
+
+    assert result == {"one": "Completed", "two": "Completed", "three": "Completed"}
+    assert [p["output_directory"] for p in mapped.call_args.args[1]] == [
+        "/app/extract/out/one",
+        "/app/extract/out/two",
+        "/app/extract/out/three",
+    ]
+    pin.assert_called_once()
+    build.assert_called_once()
+    assert build.call_args.kwargs["omop_es_version"] == "abc1234"
+
+
+def test_run_omop_es_projects_reports_failures(prefect_test_server, mocker):
+    mocker.patch("run_omop_es.update_omop_es_mirror")
+    mocker.patch("run_omop_es.pin_omop_es_version", return_value="abc1234")
+    mocker.patch("run_omop_es.build_docker")
+    mocker.patch("run_omop_es.run_omop_es_docker", fake_run_omop_es_docker)
+
+    with pytest.raises(RuntimeError, match="failed for: broken"):
+        run_omop_es.run_omop_es_projects(["one", "broken"], max_concurrency=1)
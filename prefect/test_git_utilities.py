@@ -19,7 +19,9 @@ from pathlib import Path
 
 import pytest
 
+import git_mirror
 import run_omop_es
+from ref_cache import RefCache
 
 
 def run_subprocess_with_defaults(
@@ -154,3 +156,139 @@ def test_get_latest_commit_sha_with_invalid_sha(mock_git_repo):
     assert run_omop_es.is_valid_sha(non_existent_sha)
     with pytest.raises(RuntimeError, match="Failed to fetch reference"):
         run_omop_es.get_latest_commit_sha(mock_git_repo["url"], non_existent_sha)
+
+
+def test_resolve_refs_with_single_ls_remote(mock_git_repo, mocker, tmp_path):
+    """Test that resolve_refs resolves several names with one git ls-remote."""
+    run_spy = mocker.spy(run_omop_es.subprocess, "run")
+    cache = RefCache(tmp_path / "refs.json")
+
+    resolved = run_omop_es.resolve_refs(
+        mock_git_repo["url"],
+        ["main", "feature", "v1.0.0", mock_git_repo["commit_sha"]],
+        cache,
+    )
+
+    assert run_spy.call_count == 1
+    assert resolved["v1.0.0"] == mock_git_repo["commit_sha"]
+    assert resolved[mock_git_repo["commit_sha"]] == mock_git_repo["commit_sha"]
+    assert resolved["feature"] != resolved["main"]
+    assert all(run_omop_es.is_valid_sha(sha) for sha in resolved.values())
+
+
+def test_resolve_refs_uses_cache(mock_git_repo, mocker, tmp_path):
+    """Test that cached refs do not contact the remote again."""
+    cache = RefCache(tmp_path / "refs.json")
+    first = run_omop_es.resolve_refs(mock_git_repo["url"], ["main", "v1.0.0"], cache)
+
+    run_spy = mocker.spy(run_omop_es.subprocess, "run")
+    check_call_spy = mocker.spy(run_omop_es.subprocess, "check_call")
+    second = run_omop_es.resolve_refs(mock_git_repo["url"], ["main", "v1.0.0"], cache)
+
+    assert first == second
+    assert run_spy.call_count == 0
+    assert check_call_spy.call_count == 0
+
+
+def test_resolve_refs_expires_branches_but_not_tags(mock_git_repo, mocker, tmp_path):
+    """Test that branches are resolved again after the TTL, but tags are not."""
+    cache = RefCache(tmp_path / "refs.json", ttl_seconds=0)
+    run_omop_es.resolve_refs(mock_git_repo["url"], ["main", "v1.0.0"], cache)
+
+    run_spy = mocker.spy(run_omop_es.subprocess, "run")
+    run_omop_es.resolve_refs(mock_git_repo["url"], ["main", "v1.0.0"], cache)
+
+    assert run_spy.call_count == 1
+    assert run_spy.call_args.args[0][-1:] == ["main"]
+
+
+def test_resolve_refs_with_invalid_ref(mock_git_repo, tmp_path):
+    """Test that resolve_refs raises RuntimeError if any of the refs is invalid."""
+    cache = RefCache(tmp_path / "refs.json")
+    with pytest.raises(RuntimeError, match="Failed to fetch reference"):
+        run_omop_es.resolve_refs(
+            mock_git_repo["url"], ["main", "nonexistent_branch_xyz"], cache
+        )
+
+
+@pytest.fixture
+def mirror(mock_git_repo, tmp_path):
+    """A bare mirror of the mock repository."""
+    return git_mirror.update_mirror(tmp_path / "mirror.git", mock_git_repo["url"])
+
+
+def test_update_mirror_creates_bare_mirror(mock_git_repo, mirror):
+    """Test that update_mirror mirrors the branches and tags of the repository."""
+    result = run_subprocess_with_defaults(
+        ["git", "-C", str(mirror), "for-each-ref", "--format=%(refname)"], text=True
+    )
+    assert result.stdout.split() == [
+        "refs/heads/feature",
+        "refs/heads/main",
+        "refs/tags/v1.0.0",
+    ]
+    assert git_mirror.has_commit(mirror, mock_git_repo["commit_sha"])
+
+
+def test_update_mirror_fetches_incrementally(mock_git_repo, mirror):
+    """Test that updating an existing mirror picks up new branches."""
+    run_subprocess_with_defaults(["git", "branch", "new-branch", "main"])
+    try:
+        git_mirror.update_mirror(mirror, mock_git_repo["url"])
+        assert git_mirror.has_commit(mirror, "new-branch")
+    finally:
+        run_subprocess_with_defaults(["git", "branch", "-D", "new-branch"])
+
+    # Deleted branches are pruned on the next update
+    git_mirror.update_mirror(mirror, mock_git_repo["url"])
+    assert not git_mirror.has_commit(mirror, "new-branch")
+
+
+def test_update_mirror_with_invalid_url(tmp_path):
+    """Test that update_mirror raises RuntimeError if fetching fails."""
+    with pytest.raises(RuntimeError, match="Failed to update mirror"):
+        git_mirror.update_mirror(tmp_path / "mirror.git", str(tmp_path / "missing"))
+
+
+def test_validate_ref_with_mirror(mock_git_repo, mirror, mocker):
+    """Test that validate_ref looks refs up in the mirror without fetching."""
+    check_call_spy = mocker.spy(run_omop_es.subprocess, "check_call")
+
+    run_omop_es.validate_ref(mock_git_repo["url"], mock_git_repo["short_sha"], mirror)
+    run_omop_es.validate_ref(mock_git_repo["url"], mock_git_repo["commit_sha"], mirror)
+    with pytest.raises(RuntimeError, match="not found in mirror"):
+        run_omop_es.validate_ref(
+            mock_git_repo["url"], "1234567890abcdef1234567890abcdef12345678", mirror
+        )
+
+    assert check_call_spy.call_count == 0
+
+
+def test_validate_ref_fetches_unmirrored_commit(mock_git_repo, mirror):
+    """Test that a full SHA on no branch or tag, e.g. of a PR, is fetched into the mirror."""
+    tree = run_subprocess_with_defaults(
+        ["git", "rev-parse", "main^{tree}"], text=True
+    ).stdout.strip()
+    sha = run_subprocess_with_defaults(
+        ["git", "commit-tree", tree, "-p", "main", "-m", "Pull request"], text=True
+    ).stdout.strip()
+    run_subprocess_with_defaults(["git", "update-ref", "refs/pull/1/head", sha])
+    try:
+        assert not git_mirror.has_commit(mirror, sha)
+        run_omop_es.validate_ref(mock_git_repo["url"], sha, mirror)
+        assert git_mirror.has_commit(mirror, sha)
+    finally:
+        run_subprocess_with_defaults(["git", "update-ref", "-d", "refs/pull/1/head"])
+
+    # Updating the mirror keeps the fetched commit
+    git_mirror.update_mirror(mirror, mock_git_repo["url"])
+    assert git_mirror.has_commit(mirror, sha)
+
+
+def test_resolve_refs_with_mirror(mock_git_repo, mirror, tmp_path):
+    """Test that resolving refs in the mirror matches resolving them in the remote."""
+    refs = ["main", "feature", "v1.0.0"]
+    from_mirror = run_omop_es.resolve_refs(
+        "https://example.invalid/omop_es.git", refs, mirror=mirror
+    )
+    assert from_mirror == run_omop_es.resolve_refs(mock_git_repo["url"], refs)
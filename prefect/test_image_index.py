@@ -0,0 +1,58 @@
+#  Copyright (c) University College London Hospitals NHS Foundation Trust
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+################################################################################
+
+import image_index
+from image_index import ImageIndex
+
+
+def test_image_index_records_use(tmp_path, freezer):
+    index = ImageIndex(tmp_path / "images.json")
+    index.record_use("omop_es:aaa")
+    freezer.tick(10)
+    index.record_use("omop_es:bbb")
+
+    images = index.images()
+    assert images["omop_es:bbb"] - images["omop_es:aaa"] == 10
+
+
+def test_image_index_prunes_least_recently_used(tmp_path, freezer, mocker):
+    remove_image = mocker.patch("image_index.remove_image", return_value=True)
+    index = ImageIndex(tmp_path / "images.json", max_images=2)
+    for image in ["omop_es:aaa", "omop_es:bbb", "omop_es:ccc"]:
+        index.record_use(image)
+        freezer.tick(1)
+    # Using an image again makes it the most recently used
+    index.record_use("omop_es:aaa")
+
+    assert index.prune() == ["omop_es:bbb"]
+    remove_image.assert_called_once_with("omop_es:bbb")
+    assert set(index.images()) == {"omop_es:aaa", "omop_es:ccc"}
+
+
+def test_image_index_keeps_images_that_cannot_be_removed(tmp_path, mocker):
+    mocker.patch("image_index.remove_image", return_value=False)
+    index = ImageIndex(tmp_path / "images.json", max_images=0)
+    index.record_use("omop_es:aaa")
+
+    assert index.prune() == []
+    assert set(index.images()) == {"omop_es:aaa"}
+
+
+def test_remove_image_treats_missing_images_as_removed(mocker):
+    mocker.patch("image_index.image_exists", return_value=False)
+    run = mocker.patch("image_index.subprocess.run")
+
+    assert image_index.remove_image("omop_es:aaa")
+    run.assert_not_called()
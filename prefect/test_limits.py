@@ -0,0 +1,31 @@
+#  Copyright (c) University College London Hospitals NHS Foundation Trust
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+################################################################################
+
+import pytest
+
+from limits import concurrency_limit_name
+
+
+@pytest.mark.parametrize(
+    "parts, expected",
+    [
+        (("omop-es-source", "caboodle"), "omop-es-source-caboodle"),
+        (("omop-cascade", "CRDM Live"), "omop-cascade-crdm-live"),
+        (("omop-cascade", "crdm_test"), "omop-cascade-crdm_test"),
+        (("omop-cascade", "crdm/a&b"), "omop-cascade-crdm-a-b"),
+    ],
+)
+def test_concurrency_limit_name(parts, expected):
+    assert concurrency_limit_name(*parts) == expected
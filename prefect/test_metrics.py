@@ -0,0 +1,75 @@
+#  Copyright (c) University College London Hospitals NHS Foundation Trust
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+################################################################################
+
+import pytest
+
+from metrics import MetricsCollector
+from reporting import ProgressArtifact, artifact_key
+
+
+def test_metrics_collector_parses_metric_lines():
+    collector = MetricsCollector()
+    for line in [
+        "[METRIC] renv_restore_seconds=12",
+        "[INFO] renv_restore_seconds=99",
+        "[METRIC] rows.person=1.5",
+        "[METRIC] not a metric",
+        "[METRIC] renv_restore_seconds=0",
+    ]:
+        collector(line)
+
+    assert collector.metrics == {"renv_restore_seconds": 0.0, "rows.person": 1.5}
+    assert collector.table() == [
+        {"metric": "renv_restore_seconds", "value": 0.0},
+        {"metric": "rows.person", "value": 1.5},
+    ]
+
+
+@pytest.mark.parametrize(
+    "parts, expected",
+    [
+        (("my_settings", "metrics"), "my-settings-metrics"),
+        (("UCLH_Project", "date-1-2", "metrics"), "uclh-project-date-1-2-metrics"),
+        (("__x__",), "x"),
+    ],
+)
+def test_artifact_key(parts, expected):
+    assert artifact_key(*parts) == expected
+
+
+def test_progress_artifact_is_created_then_updated(mocker):
+    mocker.patch("reporting.in_run_context", return_value=True)
+    create = mocker.patch("reporting.create_progress_artifact", return_value="id")
+    update = mocker.patch("reporting.update_progress_artifact")
+
+    artifact = ProgressArtifact("My_Project-all-eta")
+    artifact.update(20, "about 5 min to go")
+    artifact.update(120, "about 0 min to go")
+    artifact.close()
+
+    create.assert_called_once_with(
+        20, key="my-project-all-eta", description="about 5 min to go"
+    )
+    update.assert_called_once_with("id", 100.0, description="about 0 min to go")
+
+
+def test_progress_artifact_outside_of_a_run(mocker):
+    create = mocker.patch("reporting.create_progress_artifact")
+
+    artifact = ProgressArtifact("my_project-all-eta")
+    artifact.update(20, "about 5 min to go")
+    artifact.close()
+
+    create.assert_not_called()
@@ -0,0 +1,74 @@
+#  Copyright (c) University College London Hospitals NHS Foundation Trust
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+################################################################################
+
+import datetime
+
+import pytest
+
+from off_peak import TIMEZONE, plan_runs, upcoming_windows
+
+
+def local(day: int, hour: int, minute: int = 0) -> datetime.datetime:
+    return datetime.datetime(2025, 3, day, hour, minute, tzinfo=TIMEZONE)
+
+
+def test_upcoming_windows():
+    assert upcoming_windows(["19:00-07:00", "12:00-13:00"], local(10, 9)) == [
+        (local(10, 12), local(10, 13)),
+        (local(10, 19), local(11, 7)),
+    ]
+    # A window that has already started begins now
+    assert upcoming_windows(["19:00-07:00"], local(10, 2)) == [
+        (local(10, 2), local(10, 7)),
+        (local(10, 19), local(11, 7)),
+    ]
+
+
+def test_upcoming_windows_rejects_invalid_windows():
+    with pytest.raises(ValueError, match="HH:MM-HH:MM"):
+        upcoming_windows(["evenings"], local(10, 9))
+
+
+def test_plan_runs_places_longest_runs_first():
+    windows = [(local(10, 19), local(11, 7))]
+    hours = {"a": 1 * 3600, "b": 6 * 3600, "c": 5 * 3600, "d": 2 * 3600}
+
+    plan = {run.settings_id: run for run in plan_runs(hours, windows, 2)}
+
+    assert plan["b"].start == local(10, 19)
+    assert plan["c"].start == local(10, 19)
+    assert plan["d"].start == local(11, 0)
+    assert plan["a"].start == local(11, 1)
+    assert all(run.in_window for run in plan.values())
+
+
+def test_plan_runs_moves_runs_to_later_windows():
+    windows = [(local(10, 12), local(10, 13)), (local(10, 19), local(11, 7))]
+
+    plan = plan_runs({"short": 1800, "long": 4 * 3600}, windows, 1)
+
+    assert [(run.settings_id, run.start) for run in plan] == [
+        ("short", local(10, 12)),
+        ("long", local(10, 19)),
+    ]
+
+
+def test_plan_runs_flags_runs_that_do_not_fit():
+    windows = [(local(10, 19), local(11, 7))]
+
+    (run,) = plan_runs({"huge": 20 * 3600}, windows, 1)
+
+    assert run.start == local(10, 19)
+    assert not run.in_window
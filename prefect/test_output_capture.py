@@ -0,0 +1,120 @@
+#  Copyright (c) University College London Hospitals NHS Foundation Trust
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+################################################################################
+
+import os
+import subprocess
+import sys
+import time
+from pathlib import Path
+
+import pytest
+from prefect.logging import disable_run_logger
+
+import run_subprocess
+from output_capture import (
+    CapturedProcess,
+    OutputCapture,
+    SpooledOutputCapture,
+    remove_old_runs,
+)
+
+
+def test_output_capture_joins_lines():
+    capture = OutputCapture()
+    capture.append("first")
+    capture.append("second")
+
+    assert capture.getvalue() == "first\nsecond"
+    assert capture.tail() == capture.getvalue()
+
+
+def test_spooled_capture_keeps_bounded_tail(tmp_path):
+    capture = SpooledOutputCapture(tmp_path, "stdout", tail_bytes=20)
+    for i in range(100):
+        capture.append(f"line {i:03d}")
+    capture.close()
+
+    # Each line is 9 characters plus a newline
+    assert capture.tail() == "line 098\nline 099"
+    assert capture.getvalue().splitlines() == [f"line {i:03d}" for i in range(100)]
+
+
+def test_spooled_capture_rotates_segments(tmp_path):
+    capture = SpooledOutputCapture(tmp_path, "stderr", segment_bytes=100)
+    lines = [f"{i}" * 10 for i in range(30)]
+    for line in lines:
+        capture.append(line)
+    capture.close()
+
+    assert len(capture.paths) > 1
+    assert all(path.name.startswith("stderr.") for path in capture.paths)
+    assert capture.getvalue() == "\n".join(lines)
+
+
+def test_run_subprocess_spools_output(tmp_path):
+    script = "for i in range(1000): print(f'[INFO] row {i}')"
+    with disable_run_logger():
+        result = run_subprocess.run_subprocess(
+            working_dir=Path(__file__).parent,
+            args=[sys.executable, "-c", script],
+            spool_dir=tmp_path,
+            tail_bytes=64,
+        )
+
+    assert list(tmp_path.glob("stdout.*.log.gz"))
+    assert result.stdout.splitlines()[0] == "[INFO] row 0"
+    assert len(result.stdout.splitlines()) == 1000
+    assert result.stderr == ""
+
+
+def test_run_subprocess_spooled_error_only_has_tail(tmp_path):
+    script = "import sys\nfor i in range(1000): print(f'row {i}')\nsys.exit(1)"
+    with disable_run_logger():
+        with pytest.raises(subprocess.CalledProcessError) as excinfo:
+            run_subprocess.run_subprocess(
+                working_dir=Path(__file__).parent,
+                args=[sys.executable, "-c", script],
+                spool_dir=tmp_path,
+                tail_bytes=64,
+            )
+
+    tail = excinfo.value.stdout.splitlines()
+    assert tail[-1] == "row 999"
+    assert len(tail) < 10
+
+
+def test_captured_process_is_a_completed_process(tmp_path):
+    capture = SpooledOutputCapture(tmp_path, "stdout")
+    capture.append("line")
+    process = CapturedProcess(["cmd"], 0, capture, OutputCapture())
+
+    assert process.stdout == "line"
+    assert process.stderr == ""
+    process.check_returncode()
+    assert "returncode=0" in repr(process)
+
+
+def test_remove_old_runs(tmp_path):
+    old = tmp_path / "project" / "old-run"
+    recent = tmp_path / "project" / "recent-run"
+    for run in (old, recent):
+        SpooledOutputCapture(run / "attempt-1", "stdout").append("line")
+    ancient = time.time() - 40 * 24 * 3600
+    for path in [old, *old.rglob("*")]:
+        os.utime(path, (ancient, ancient))
+
+    assert remove_old_runs(tmp_path, max_age_days=30) == [old]
+    assert not old.exists()
+    assert recent.exists()
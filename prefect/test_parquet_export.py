@@ -0,0 +1,97 @@
+#  Copyright (c) University College London Hospitals NHS Foundation Trust
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+################################################################################
+
+import gzip
+import shutil
+
+import pytest
+
+import parquet_export
+from compression import OutputCompressor
+
+pq = pytest.importorskip("pyarrow.parquet")
+
+
+@pytest.fixture
+def small_blocks(monkeypatch):
+    """Read a few hundred bytes at a time, with small row groups."""
+    monkeypatch.setattr(parquet_export, "MIN_ROW_GROUP_ROWS", 10)
+    monkeypatch.setattr(parquet_export, "TARGET_ROW_GROUP_BYTES", 100)
+    return 256
+
+
+def test_convert_csv_in_chunks(tmp_path, small_blocks):
+    csv = tmp_path / "person.csv"
+    csv.write_text(
+        "person_id,gender\n"
+        + "".join(f"{i},{'F' if i % 2 else 'M'}\n" for i in range(100))
+    )
+
+    summary = parquet_export.convert_csv(csv, block_size=small_blocks)
+
+    table = pq.read_table(tmp_path / "person.parquet")
+    assert table.num_rows == 100
+    assert table.column("person_id").to_pylist() == list(range(100))
+    assert summary["rows"] == 100
+    assert (
+        summary["row_groups"]
+        == pq.ParquetFile(tmp_path / "person.parquet").num_row_groups
+    )
+    assert summary["row_groups"] > 1
+    assert summary["schema"] == {"person_id": "int64", "gender": "string"}
+    assert summary["inferred_types"]
+    metadata = pq.ParquetFile(tmp_path / "person.parquet").metadata
+    encodings = metadata.row_group(0).column(1).encodings
+    assert any("DICTIONARY" in encoding for encoding in encodings)
+
+
+def test_convert_csv_falls_back_to_text(tmp_path, small_blocks):
+    csv = tmp_path / "measurement.csv"
+    # The values are numbers in the first block, but not in later ones
+    csv.write_text("value\n" + "1\n" * 200 + "high\n")
+
+    summary = parquet_export.convert_csv(csv, block_size=small_blocks)
+
+    assert not summary["inferred_types"]
+    assert summary["schema"] == {"value": "string"}
+    assert pq.read_table(tmp_path / "measurement.parquet").num_rows == 201
+
+
+def test_convert_directory(tmp_path):
+    (tmp_path / "nested").mkdir()
+    (tmp_path / "person.csv").write_text("person_id\n1\n2\n")
+    with gzip.open(tmp_path / "nested" / "visit.csv.gz", "wt") as f:
+        f.write("visit_id,person_id\n1,1\n")
+    (tmp_path / "notes.txt").write_text("not a table")
+
+    summaries = parquet_export.convert_directory(tmp_path, max_workers=2)
+
+    assert [(s["file"], s["parquet_file"], s["rows"]) for s in summaries] == [
+        ("nested/visit.csv.gz", "nested/visit.parquet", 1),
+        ("person.csv", "person.parquet", 2),
+    ]
+
+
+@pytest.mark.skipif(shutil.which("zstd") is None, reason="zstd is not installed")
+def test_convert_directory_compressed_with_zstd(tmp_path):
+    (tmp_path / "person.csv").write_text("person_id\n1\n2\n")
+    OutputCompressor(tmp_path, "zstd").finish()
+
+    summaries = parquet_export.convert_directory(tmp_path)
+
+    assert [(s["file"], s["parquet_file"], s["rows"]) for s in summaries] == [
+        ("person.csv.zst", "person.parquet", 2),
+    ]
+    assert pq.read_table(tmp_path / "person.parquet").num_rows == 2
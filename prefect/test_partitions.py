@@ -0,0 +1,162 @@
+#  Copyright (c) University College London Hospitals NHS Foundation Trust
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+################################################################################
+
+import pytest
+from prefect import flow, task
+
+import run_omop_es
+from partitions import Partition, make_partitions, merge_partitions
+
+
+def test_make_date_partitions():
+    partitions = make_partitions("date", "2024-01-01", "2024-01-11", 3)
+
+    assert [(p.start, p.end) for p in partitions] == [
+        ("2024-01-01", "2024-01-05"),
+        ("2024-01-05", "2024-01-08"),
+        ("2024-01-08", "2024-01-11"),
+    ]
+    assert partitions[0].name == "date-2024-01-01-2024-01-05"
+    assert partitions[0].env() == {
+        "PARTITION_BY": "date",
+        "PARTITION_START": "2024-01-01",
+        "PARTITION_END": "2024-01-05",
+    }
+
+
+def test_make_person_id_partitions_never_empty():
+    partitions = make_partitions("person_id", "0", "2", 5)
+
+    assert [(p.start, p.end) for p in partitions] == [("0", "1"), ("1", "2")]
+
+
+@pytest.mark.parametrize(
+    "kind, start, end, count, match",
+    [
+        ("visit", "0", "10", 2, "Unknown partition kind"),
+        ("person_id", "10", "10", 2, "Empty partition range"),
+        ("date", "2024-02-01", "2024-01-01", 2, "Empty partition range"),
+        ("person_id", "0", "10", 0, "at least 1"),
+    ],
+)
+def test_make_partitions_invalid(kind, start, end, count, match):
+    with pytest.raises(ValueError, match=match):
+        make_partitions(kind, start, end, count)
+
+
+def test_merge_partitions(tmp_path):
+    first = tmp_path / "partitions" / "person_id-0-5"
+    second = tmp_path / "partitions" / "person_id-5-10"
+    for directory, rows in [(first, "1,a\n2,b"), (second, "6,c\n")]:
+        (directory / "tables").mkdir(parents=True)
+        (directory / "tables" / "person.csv").write_text(f"id,name\n{rows}")
+        (directory / "report.html").write_text(directory.name)
+
+    merged = merge_partitions([first, second], tmp_path / "merged")
+
+    assert (tmp_path / "merged" / "tables" / "person.csv").read_text() == (
+        "id,name\n1,a\n2,b\n6,c\n"
+    )
+    assert (tmp_path / "merged" / "report.person_id-5-10.html").read_text() == (
+        "person_id-5-10"
+    )
+    assert len(merged) == 3
+
+
+def test_merge_partitions_with_empty_partitions(tmp_path):
+    for name, content in [
+        ("a", ""),
+        ("b", "id,name\n1,x\n"),
+        ("c", ""),
+        ("d", "id,name\n2,y"),
+    ]:
+        (tmp_path / name).mkdir()
+        (tmp_path / name / "person.csv").write_text(content)
+
+    merge_partitions([tmp_path / name for name in "abcd"], tmp_path / "merged")
+
+    assert (tmp_path / "merged" / "person.csv").read_text() == "id,name\n1,x\n2,y"
+
+
+def test_merge_partitions_mismatched_headers(tmp_path):
+    for name, header in [("a", "id,name"), ("b", "id,other")]:
+        (tmp_path / name).mkdir()
+        (tmp_path / name / "person.csv").write_text(f"{header}\n1,x\n")
+
+    with pytest.raises(ValueError, match="doesn't match"):
+        merge_partitions([tmp_path / "a", tmp_path / "b"], tmp_path / "merged")
+
+
+def test_host_output_path():
+    assert run_omop_es.host_output_path("/app/extract/foo/bar") == (
+        run_omop_es.EXTRACT_PATH / "foo" / "bar"
+    )
+    with pytest.raises(ValueError, match="is not in /app/extract"):
+        run_omop_es.host_output_path("/sharefs6/criudata/Live/foo")
+
+
+@task
+def fake_run_omop_es_docker(
+    output_directory: str, partition: Partition, **kwargs
+) -> None:
+    if partition.start == "broken":
+        raise RuntimeError("container exited with code 1")
+    path = run_omop_es.host_output_path(output_directory)
+    path.mkdir(parents=True)
+    (path / "person.csv").write_text(f"person_id\n{partition.start}\n")
+
+
+@flow
+def partitioned_flow(**kwargs):
+    return run_omop_es.run_partitioned(**kwargs)
+
+
+def test_run_partitioned(prefect_test_server, mocker, tmp_path):
+    mocker.patch.object(run_omop_es, "EXTRACT_PATH", tmp_path)
+    mocker.patch("run_omop_es.run_omop_es_docker", fake_run_omop_es_docker)
+
+    partitioned_flow(
+        settings_id="project",
+        omop_es_version="abc1234",
+        output_directory="/app/extract/project",
+        zip_output=True,
+        partitions=make_partitions("person_id", "0", "3", 3),
+        max_parallel_partitions=2,
+    )
+
+    assert (tmp_path / "project" / "person.csv").read_text() == "person_id\n0\n1\n2\n"
+    assert not (tmp_path / "project" / "partitions").exists()
+    assert (tmp_path / "project.zip").exists()
+
+
+def test_run_partitioned_does_not_merge_failures(prefect_test_server, mocker, tmp_path):
+    mocker.patch.object(run_omop_es, "EXTRACT_PATH", tmp_path)
+    mocker.patch("run_omop_es.run_omop_es_docker", fake_run_omop_es_docker)
+    partitions = [
+        Partition("person_id", "0", "1"),
+        Partition("person_id", "broken", "2"),
+    ]
+
+    with pytest.raises(RuntimeError, match="failed for partitions"):
+        partitioned_flow(
+            settings_id="project",
+            omop_es_version="abc1234",
+            output_directory="/app/extract/project",
+            zip_output=False,
+            partitions=partitions,
+            max_parallel_partitions=2,
+        )
+
+    assert not (tmp_path / "project" / "person.csv").exists()
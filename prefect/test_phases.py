@@ -0,0 +1,83 @@
+#  Copyright (c) University College London Hospitals NHS Foundation Trust
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+################################################################################
+
+from phases import PhaseHistory, PhaseTimer
+
+
+def test_phase_timer_durations():
+    timer = PhaseTimer()
+    for line in [
+        "[PHASE] checkout 100.0",
+        "+ echo '[PHASE] renv_restore 101.5'",
+        "[PHASE] renv_restore 101.5",
+        "[PHASE] extract 103",
+        "[PHASE] zip 110.25",
+        "[PHASE] done 111",
+    ]:
+        timer(line)
+
+    assert timer.durations() == {
+        "checkout": 1.5,
+        "renv_restore": 1.5,
+        "extract": 7.25,
+        "zip": 0.75,
+    }
+
+
+def test_phase_timer_ends_unfinished_phase():
+    timer = PhaseTimer()
+    timer("[PHASE] checkout 100")
+    timer("[PHASE] extract 105")
+
+    assert timer.durations(end=125) == {"checkout": 5.0, "extract": 20.0}
+
+
+def test_phase_history_keeps_recent_runs(tmp_path):
+    history = PhaseHistory(tmp_path / "phases.json", max_runs=2)
+    history.record("my_project", {"run": 1, "phases": {"checkout": 1.0}})
+    history.record("my_project", {"run": 2, "phases": {"checkout": 2.0, "mockdb": 3.0}})
+    history.record("my_project", {"run": 3, "phases": {"checkout": 4.0}})
+    history.record("other", {"run": 1, "phases": {}})
+
+    assert [run["run"] for run in history.runs("my_project")] == [2, 3]
+    assert history.table("my_project") == [
+        {"run": 3, "checkout": 4.0, "mockdb": ""},
+        {"run": 2, "checkout": 2.0, "mockdb": 3.0},
+    ]
+
+
+def test_phase_history_expected_seconds(tmp_path):
+    history = PhaseHistory(tmp_path / "phases.json")
+    assert history.expected_seconds("my_project") is None
+
+    for total, succeeded, partition in [
+        (100, True, ""),
+        (5, False, ""),
+        (300, True, ""),
+        (20, True, "2024-01"),
+        (40, True, "2024-02"),
+        (200, True, ""),
+    ]:
+        history.record(
+            "my_project",
+            {
+                "succeeded": succeeded,
+                "partition": partition,
+                "phases": {"checkout": 10, "extract": total - 10},
+            },
+        )
+
+    assert history.expected_seconds("my_project") == 200
+    assert history.expected_seconds("my_project", "2024-02") == 40
@@ -0,0 +1,122 @@
+#  Copyright (c) University College London Hospitals NHS Foundation Trust
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+################################################################################
+
+import threading
+
+from progress import ProgressTracker, RowCountHistory, format_progress
+
+
+class FakeClock:
+    def __init__(self) -> None:
+        self.now = 0.0
+
+    def __call__(self) -> float:
+        return self.now
+
+
+def test_progress_tracker_counts_rows_per_table():
+    clock = FakeClock()
+    tracker = ProgressTracker(clock=clock)
+    for line in [
+        "[INFO] person: processed rows 0 to 999",
+        "Running omop_es for my_project...",
+        "[METRIC] renv_restore_seconds=3",
+    ]:
+        tracker(line)
+    clock.now = 10
+    tracker("[DEBUG] person: processed rows 1000 to 1999")
+    tracker("[PROGRESS] measurement rows=500 expected=2000 elapsed=5")
+
+    assert tracker.table() == [
+        {
+            "table": "person",
+            "rows": 2000,
+            "expected_rows": "",
+            "seconds": 10.0,
+            "rows_per_second": 200.0,
+        },
+        {
+            "table": "measurement",
+            "rows": 500,
+            "expected_rows": 2000,
+            "seconds": 5.0,
+            "rows_per_second": 100.0,
+        },
+    ]
+
+
+def test_progress_tracker_estimates_time_left():
+    clock = FakeClock()
+    tracker = ProgressTracker(
+        expected_rows={"person": 1000, "measurement": 4000}, clock=clock
+    )
+    assert tracker.eta_seconds() is None
+    assert tracker.percent_done() == 0
+    assert ProgressTracker().percent_done() is None
+
+    tracker("person: processed rows 0 to 499")
+    clock.now = 5
+    tracker("person: processed rows 500 to 999")
+
+    # 1000 rows in 5 seconds, with 4000 rows of measurement to go
+    assert tracker.eta_seconds() == 20
+    assert tracker.percent_done() == 20
+    assert format_progress(tracker) == (
+        "Progress: 1000 rows in 1 table(s) at 200 rows/s, person at 200 rows/s, "
+        "about 0 min to go"
+    )
+
+
+def test_progress_tracker_reports_regularly():
+    clock = FakeClock()
+    reports = []
+    tracker = ProgressTracker(report=reports.append, report_seconds=60, clock=clock)
+
+    for now in [0, 30, 61, 90, 125]:
+        clock.now = now
+        tracker("person: processed rows 0 to 9")
+
+    assert len(reports) == 2
+
+
+def test_row_count_history(tmp_path):
+    history = RowCountHistory(tmp_path / "rows.json")
+    tracker = ProgressTracker()
+    tracker("[PROGRESS] person rows=1000")
+
+    history.record("my_project", tracker)
+    history.record("my_project", ProgressTracker())
+
+    assert history.get("my_project") == {"person": 1000}
+    assert history.get("other_project") == {}
+
+
+def test_progress_can_be_read_while_lines_are_handled():
+    tracker = ProgressTracker(expected_rows={"table_0": 10})
+    done = threading.Event()
+
+    def handle_lines():
+        for i in range(20_000):
+            tracker(f"[PROGRESS] table_{i} rows=1")
+        done.set()
+
+    handler = threading.Thread(target=handle_lines)
+    handler.start()
+    while not done.is_set():
+        format_progress(tracker)
+        tracker.percent_done()
+        tracker.table()
+    handler.join()
+    assert len(tracker.snapshot()) == 20_000
@@ -0,0 +1,65 @@
+#  Copyright (c) University College London Hospitals NHS Foundation Trust
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+################################################################################
+
+from rprof import RprofSummary, summarise_profiles
+
+PROFILE = """memory profiling: sample.interval=20000
+:100:0:1000:0:"inner" "outer" 
+:100:0:3000:0:"inner" "outer" 
+:200:0:3000:0:"outer" 
+:200:0:1000:0:"outer" "outer" 
+"""
+
+
+def test_summary_counts_self_and_total_time():
+    summary = RprofSummary()
+    summary.add_lines(PROFILE.splitlines())
+
+    assert summary.interval == 0.02
+    assert summary.samples == 4
+    assert summary.seconds == 0.08
+    assert summary.self_samples == {"inner": 2, "outer": 2}
+    # Recursion is only counted once per sample
+    assert summary.total_samples == {"inner": 2, "outer": 4}
+
+
+def test_summary_counts_memory_allocated_since_previous_sample():
+    summary = RprofSummary()
+    summary.add_lines(PROFILE.splitlines())
+
+    assert summary.allocated_bytes["inner"] == 2000 * 56
+    assert summary.allocated_bytes["outer"] == 2000 * 56 + 100 * 8
+
+
+def test_table_lists_functions_by_self_time(tmp_path):
+    (tmp_path / "1.Rprof").write_text(PROFILE)
+    (tmp_path / "2.Rprof").write_text(PROFILE.replace('"inner" ', ""))
+
+    rows = summarise_profiles(tmp_path).table(top_n=1)
+
+    assert rows == [
+        {
+            "function": "outer",
+            "self_seconds": 0.12,
+            "self_pct": 75.0,
+            "total_seconds": 0.16,
+            "total_pct": 100.0,
+            "allocated_mb": 0.2,
+        }
+    ]
+
+
+def test_table_is_empty_without_samples():
+    assert RprofSummary().table() == []
@@ -0,0 +1,57 @@
+#  Copyright (c) University College London Hospitals NHS Foundation Trust
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+################################################################################
+
+import subprocess
+
+import pytest
+from prefect.logging import disable_run_logger
+
+import run_omop_cascade
+
+
+def test_run_omop_cascade_docker_waits_for_the_database_limit(mocker):
+    concurrency = mocker.patch("run_omop_cascade.concurrency")
+    run_subprocess_mock = mocker.patch("run_omop_cascade.run_subprocess")
+
+    with disable_run_logger():
+        run_omop_cascade.run_omop_cascade_docker.fn(
+            working_dir=run_omop_cascade.ROOT_PATH,
+            crdm_id="crdm_1",
+            input_directory="/app/extract/my_project",
+            database="CRDM Live",
+        )
+
+    concurrency.assert_called_once_with("omop-cascade-crdm-live", occupy=1)
+    args = run_subprocess_mock.call_args.args[1]
+    assert "CRDM_ID=crdm_1" in args
+    assert "INPUT_DIRECTORY=/app/extract/my_project" in args
+    assert args[-1] == "omop-cascade"
+
+
+def test_run_omop_cascade_imports_every_crdm(mocker, prefect_test_server):
+    def run_subprocess(working_dir, args, env, line_handlers=(), on_start=None):
+        if env["CRDM_ID"] == "broken":
+            raise subprocess.CalledProcessError(1, args)
+        return subprocess.CompletedProcess(args, 0)
+
+    mocker.patch("run_omop_cascade.run_subprocess", side_effect=run_subprocess)
+    mocker.patch.object(run_omop_cascade.run_omop_cascade_docker, "retries", 0)
+
+    assert run_omop_cascade.run_omop_cascade(["crdm_1", "crdm_2"]) == {
+        "crdm_1": "Completed",
+        "crdm_2": "Completed",
+    }
+    with pytest.raises(RuntimeError, match="broken"):
+        run_omop_cascade.run_omop_cascade(["crdm_1", "broken"])
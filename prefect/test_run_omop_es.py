@@ -13,7 +13,9 @@
 #  limitations under the License.
 ################################################################################
 
+import asyncio
 import os
+import subprocess
 from subprocess import CalledProcessError
 
 import pytest
@@ -22,6 +24,8 @@ from prefect.logging import disable_run_logger
 
 import run_omop_es
 import run_subprocess
+from image_index import ImageIndex
+from watermarks import WatermarkStore
 
 PROJECT_NAME = "test_project"
 OMOP_ES_VERSION = "master"
@@ -32,6 +36,7 @@ def rebuild_test_docker():
     """Rebuild the test docker image, to make sure it's up to date"""
     with disable_run_logger():
         try:
+            run_omop_es.update_omop_es_mirror.fn()
             run_omop_es.build_docker.fn(
                 working_dir=run_omop_es.ROOT_PATH,
                 project_name=PROJECT_NAME,
@@ -88,6 +93,178 @@ def test_build_docker():
         )
 
 
+def test_build_docker_skips_existing_image(mocker, tmp_path):
+    sha = "f439272f850c4a86fb28ca142c2280494d85e364"
+    mocker.patch("run_omop_es.image_exists", return_value=True)
+    mocker.patch.object(
+        run_omop_es, "IMAGE_INDEX", ImageIndex(tmp_path / "images.json")
+    )
+    run_subprocess_mock = mocker.patch("run_omop_es.run_subprocess")
+
+    with disable_run_logger():
+        run_omop_es.build_docker.fn(
+            working_dir=run_omop_es.ROOT_PATH,
+            project_name="my-project",
+            omop_es_version=sha,
+        )
+
+    run_subprocess_mock.assert_not_called()
+    assert set(run_omop_es.IMAGE_INDEX.images()) == {f"omop_es:{sha}"}
+
+
+def test_build_docker_always_builds_branches(mocker, tmp_path):
+    mocker.patch("run_omop_es.image_exists", return_value=True)
+    mocker.patch.object(
+        run_omop_es, "IMAGE_INDEX", ImageIndex(tmp_path / "images.json")
+    )
+    run_subprocess_mock = mocker.patch("run_omop_es.run_subprocess")
+
+    with disable_run_logger():
+        run_omop_es.build_docker.fn(
+            working_dir=run_omop_es.ROOT_PATH,
+            project_name="my-project",
+            omop_es_version="master",
+        )
+
+    run_subprocess_mock.assert_called_once()
+    env = run_subprocess_mock.call_args.args[2]
+    assert env["OMOP_ES_VERSION"] == "master"
+
+
+def test_build_docker_async_skips_existing_image(mocker, tmp_path):
+    sha = "f439272f850c4a86fb28ca142c2280494d85e364"
+    mocker.patch("run_omop_es.image_exists", return_value=True)
+    mocker.patch.object(
+        run_omop_es, "IMAGE_INDEX", ImageIndex(tmp_path / "images.json")
+    )
+    run_subprocess_mock = mocker.patch("run_omop_es.run_subprocess_async")
+
+    with disable_run_logger():
+        asyncio.run(
+            run_omop_es.build_docker_async.fn(
+                working_dir=run_omop_es.ROOT_PATH,
+                project_name="my-project",
+                omop_es_version=sha,
+            )
+        )
+
+    run_subprocess_mock.assert_not_called()
+    assert set(run_omop_es.IMAGE_INDEX.images()) == {f"omop_es:{sha}"}
+
+
+def test_checkpoint_manifest_resumes_incomplete_runs(mocker, tmp_path):
+    mocker.patch("run_omop_es.CHECKPOINTS_PATH", tmp_path)
+
+    def start(resume):
+        return run_omop_es.checkpoint_manifest(
+            "my_project", "abc123", "/app/extract/out", None, resume=resume
+        )
+
+    with disable_run_logger():
+        failed = start(resume=False)
+        failed.record("person")
+
+        resumed = start(resume=True)
+        assert resumed.path != failed.path
+        assert resumed.units() == ["person"]
+        # The resumed manifest takes over
+        assert not failed.path.exists()
+        resumed.record("measurement")
+        resumed.remove()
+
+        # Only incomplete runs are resumed
+        assert start(resume=True).units() == []
+        assert start(resume=False).units() == []
+
+
+def test_extraction_window(mocker, tmp_path):
+    store = WatermarkStore(tmp_path / "watermarks.json")
+    store.advance("my_project", {"person": "2025-05-01"}, full_refresh=True)
+    mocker.patch("run_omop_es.WATERMARKS", store)
+    mocker.patch("run_omop_es.WATERMARKS_PATH", tmp_path / "window")
+
+    with disable_run_logger():
+        incremental = run_omop_es.extraction_window("my_project", full_refresh=False)
+        assert incremental.read_text() == "person 2025-05-01\n"
+        full = run_omop_es.extraction_window("my_project", full_refresh=True)
+        assert full.read_text() == ""
+
+
+def test_omop_es_docker_command_dispatches_into_warm_container(mocker, tmp_path):
+    mocker.patch("run_omop_es.EXTRACT_PATH", tmp_path)
+    mocker.patch("run_omop_es.CHECKPOINTS_PATH", tmp_path / ".checkpoints")
+    mocker.patch("run_omop_es.WATERMARKS_PATH", tmp_path / ".watermarks")
+    mocker.patch("run_omop_es.mockdb_snapshot_path", return_value=tmp_path / "mockdb")
+
+    with disable_run_logger():
+        checkpoints = run_omop_es.checkpoint_manifest(
+            "my_project", "abc123", "/app/extract/out", None, resume=False
+        )
+        args, env, container = run_omop_es.omop_es_docker_command(
+            "my_project",
+            "abc123",
+            batched=False,
+            output_directory="/app/extract/out",
+            zip_output=False,
+            partition=None,
+            rebuild_mockdb=False,
+            checkpoints=checkpoints,
+            full_refresh=True,
+            warm_container="omop_es-pool-abc123",
+        )
+
+    assert container == "omop_es-pool-abc123"
+    assert args[:2] == ["docker", "exec"]
+    assert args[-2:] == ["omop_es-pool-abc123", "/app/omop_es.sh"]
+    assert "SETTINGS_ID=my_project" in args
+
+
+def test_emit_extraction_completed(mocker):
+    emit_event = mocker.patch("run_omop_es.emit_event")
+
+    run_omop_es.emit_extraction_completed("my_project", "abc123", "/app/extract/out")
+
+    event = emit_event.call_args.kwargs
+    assert event["resource"]["prefect.resource.id"] == "omop_es.project.my_project"
+    assert event["payload"]["output_directory"] == "/app/extract/out"
+
+
+def test_share_host_path(monkeypatch, tmp_path):
+    monkeypatch.setenv("SHAREFS7_CRDM_HOST", str(tmp_path / "crdm"))
+    monkeypatch.delenv("SHAREFS6_CRIUDATA_HOST", raising=False)
+
+    with disable_run_logger():
+        assert (
+            run_omop_es.share_host_path("/sharefs7/crdm/Shared/project/out")
+            == tmp_path / "crdm" / "project" / "out"
+        )
+        # Shares that aren't mounted on the host are written to directly
+        assert run_omop_es.share_host_path("/sharefs6/criudata/Live/out") is None
+        assert run_omop_es.share_host_path("/app/extract/out") is None
+        assert run_omop_es.share_host_path("") is None
+
+    assert (
+        run_omop_es.staging_directory("my_project", "/sharefs7/crdm/Shared/out")
+        == "/app/extract/staging/my_project/sharefs7/crdm/Shared/out"
+    )
+
+
+def test_deliver_output_removes_staged_output(tmp_path):
+    staging = tmp_path / "staging" / "out"
+    staging.mkdir(parents=True)
+    (staging / "person.csv").write_text("person_id\n1\n")
+    staging.with_name("out.zip").write_bytes(b"zip")
+
+    with disable_run_logger():
+        deliveries = run_omop_es.deliver_output.fn(staging, tmp_path / "share" / "out")
+
+    assert [d["file"] for d in deliveries] == ["person.csv", "out.zip"]
+    assert (tmp_path / "share" / "out" / "person.csv").exists()
+    assert (tmp_path / "share" / "out.zip").read_bytes() == b"zip"
+    assert not staging.exists()
+    assert not staging.with_name("out.zip").exists()
+
+
 def wrapped_run_subrocess(*args, **kwargs):
     """
     This is very coupled to the implementation of run_omop_es_docker!
@@ -127,6 +304,7 @@ def test_run_omop_es_docker_sets_env_correctly(mocker, rebuild_test_docker):
         "BATCHED": "False",
         "OUTPUT_DIRECTORY": "",
         "ZIP_OUTPUT": "False",
+        "REBUILD_MOCKDB": "False",
     }
 
     for var, expected_value in expected_env_values.items():
@@ -213,3 +391,44 @@ def test_version_pinning_fails_with_invalid_ref():
     with pytest.raises(RuntimeError, match="Failed to fetch reference"):
         with disable_run_logger():
             run_omop_es.pin_omop_es_version.fn(ref=test_sha)
+
+
+@pytest.mark.parametrize(
+    "kwargs, match",
+    [
+        (dict(partition_by="date"), "only supported in batched mode"),
+        (dict(partition_by="date", batched=True), "requires an output directory"),
+        (
+            dict(partition_by="date", batched=True, output_directory="/elsewhere"),
+            "is not in /app/extract",
+        ),
+        (dict(compression="gzip", output_directory="/elsewhere"), "is not in"),
+    ],
+)
+def test_run_omop_es_checks_arguments_before_building(mocker, kwargs, match):
+    mirror = mocker.patch("run_omop_es.update_omop_es_mirror")
+    build = mocker.patch("run_omop_es.build_docker")
+
+    with pytest.raises(ValueError, match=match):
+        run_omop_es.run_omop_es.fn(
+            settings_id=PROJECT_NAME, stage_output=False, **kwargs
+        )
+
+    mirror.assert_not_called()
+    build.assert_not_called()
+
+
+def test_supports_partitions(tmp_path):
+    repo = tmp_path / "omop_es"
+    (repo / "main").mkdir(parents=True)
+    (repo / "main" / "batched.R").write_text('make_option("--settings_id")\n')
+    git = ["git", "-c", "user.name=test", "-c", "user.email=test@localhost"]
+    subprocess.run([*git, "init", "--quiet"], cwd=repo, check=True)
+    subprocess.run([*git, "add", "main"], cwd=repo, check=True)
+    subprocess.run([*git, "commit", "--quiet", "-m", "old"], cwd=repo, check=True)
+    (repo / "main" / "batched.R").write_text('make_option("--partition_by")\n')
+    subprocess.run([*git, "commit", "--quiet", "-am", "new"], cwd=repo, check=True)
+
+    assert not run_omop_es.supports_partitions(repo, "HEAD~1")
+    assert run_omop_es.supports_partitions(repo, "HEAD")
+    assert not run_omop_es.supports_partitions(repo, "does-not-exist")
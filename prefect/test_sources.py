@@ -0,0 +1,44 @@
+#  Copyright (c) University College London Hospitals NHS Foundation Trust
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+################################################################################
+
+import pytest
+
+from sources import connection_groups, resolve_sources, source_limits
+
+
+def test_connection_groups(tmp_path):
+    env_file = tmp_path / ".env"
+    env_file.write_text(
+        "ODBC_DRIVER=x\n"
+        "CABOODLE_SERVER=caboodle.example\nCABOODLE_DATABASE=cab\n"
+        "CLARITY_SERVER=\nCLARITY_DATABASE=\n"
+    )
+
+    assert connection_groups(env_file) == ["caboodle"]
+    assert connection_groups(tmp_path / "missing.env") == []
+
+
+def test_resolve_sources():
+    available = ["caboodle", "clarity"]
+
+    assert resolve_sources(None, available) == available
+    assert resolve_sources(["Clarity"], available) == ["clarity"]
+    assert resolve_sources([], available) == []
+    with pytest.raises(ValueError, match="epic"):
+        resolve_sources(["epic"], available)
+
+
+def test_source_limits():
+    assert source_limits(["caboodle"]) == ["omop-es-source-caboodle"]
@@ -13,8 +13,12 @@
 #  limitations under the License.
 ################################################################################
 
+import asyncio
 import logging
 import subprocess
+import sys
+import threading
+import time
 from pathlib import Path
 
 import pytest
@@ -79,3 +83,240 @@ def test_run_subprocess_error():
                 working_dir=Path(__file__).parent,
                 args=["false"],
             )
+
+
+def test_run_subprocess_logs_stderr_lines(caplog, mocker):
+    caplog.clear()
+    caplog.set_level(logging.NOTSET)
+    mocker.patch(
+        "run_subprocess.logging.get_run_logger", return_value=logging.getLogger()
+    )
+
+    script = "import sys; sys.stderr.write('[WARNING] first\\n[ERROR] second\\n')"
+    result = run_subprocess.run_subprocess(
+        working_dir=Path(__file__).parent,
+        args=[sys.executable, "-c", script],
+    )
+
+    assert result.stderr == "[WARNING] first\n[ERROR] second"
+    levels = {record.getMessage(): record.levelname for record in caplog.records}
+    assert levels["[WARNING] first"] == "WARNING"
+    assert levels["[ERROR] second"] == "ERROR"
+
+
+def test_run_subprocess_error_keeps_output():
+    script = "import sys; print('out'); sys.stderr.write('err\\n'); sys.exit(3)"
+    with disable_run_logger():
+        with pytest.raises(subprocess.CalledProcessError) as excinfo:
+            run_subprocess.run_subprocess(
+                working_dir=Path(__file__).parent,
+                args=[sys.executable, "-c", script],
+            )
+
+    assert excinfo.value.returncode == 3
+    assert excinfo.value.stdout == "out"
+    assert excinfo.value.stderr == "err"
+
+
+def test_run_subprocess_passes_lines_to_handlers():
+    lines = []
+    script = "import sys; print('[METRIC] a=1'); sys.stderr.write('err\\r\\n')"
+    with disable_run_logger():
+        run_subprocess.run_subprocess(
+            working_dir=Path(__file__).parent,
+            args=[sys.executable, "-c", script],
+            line_handlers=[lines.append],
+        )
+
+    assert sorted(lines) == ["[METRIC] a=1", "err"]
+
+
+@pytest.mark.parametrize("runner", ["sync", "async"])
+def test_run_subprocess_keeps_draining_after_bad_lines(runner):
+    """
+    Neither undecodable output nor a failing handler stops the pipes being
+    drained, which would block the process once a pipe is full.
+    """
+    script = (
+        "import sys; sys.stdout.buffer.write(b'bad \\xff\\n');"
+        "[print('x' * 1023) for _ in range(1024)]"
+    )
+    lines = []
+
+    def failing_handler(line):
+        raise ValueError(line)
+
+    kwargs = dict(
+        working_dir=Path(__file__).parent,
+        args=[sys.executable, "-c", script],
+        line_handlers=[failing_handler, lines.append],
+    )
+    with disable_run_logger():
+        if runner == "sync":
+            result = run_subprocess.run_subprocess(**kwargs)
+        else:
+            result = asyncio.run(run_subprocess.run_subprocess_async(**kwargs))
+
+    assert lines[0] == "bad \ufffd"
+    assert len(lines) == 1025
+    assert result.stdout.startswith("bad \ufffd\n")
+
+
+def test_run_subprocess_async():
+    lines = []
+    script = "import sys; print('[METRIC] a=1'); sys.stderr.write('err\\n')"
+    with disable_run_logger():
+        result = asyncio.run(
+            run_subprocess.run_subprocess_async(
+                working_dir=Path(__file__).parent,
+                args=[sys.executable, "-c", script],
+                line_handlers=[lines.append],
+            )
+        )
+
+    assert result.stdout == "[METRIC] a=1"
+    assert result.stderr == "err"
+    assert sorted(lines) == ["[METRIC] a=1", "err"]
+
+
+def test_run_subprocess_async_error_keeps_output():
+    script = "import sys; print('out'); sys.stderr.write('err\\n'); sys.exit(3)"
+    with disable_run_logger():
+        with pytest.raises(subprocess.CalledProcessError) as excinfo:
+            asyncio.run(
+                run_subprocess.run_subprocess_async(
+                    working_dir=Path(__file__).parent,
+                    args=[sys.executable, "-c", script],
+                )
+            )
+
+    assert excinfo.value.returncode == 3
+    assert excinfo.value.stdout == "out"
+    assert excinfo.value.stderr == "err"
+
+
+def test_run_subprocess_async_runs_concurrently():
+    script = "import time; time.sleep(1); print('done')"
+
+    async def run_all():
+        return await asyncio.gather(
+            *(
+                run_subprocess.run_subprocess_async(
+                    working_dir=Path(__file__).parent,
+                    args=[sys.executable, "-c", script],
+                )
+                for _ in range(10)
+            )
+        )
+
+    started = time.monotonic()
+    with disable_run_logger():
+        results = asyncio.run(run_all())
+
+    assert [result.stdout for result in results] == ["done"] * 10
+    assert time.monotonic() - started < 5
+
+
+_STRESS_MEGABYTES = 256
+_STRESS_SCRIPT = """
+import sys
+
+line = b"x" * 1023 + b"\\n"
+for _ in range({lines}):
+    sys.stderr.buffer.write(line)
+for _ in range({lines}):
+    sys.stdout.buffer.write(line)
+"""
+
+
+@pytest.mark.slow
+def test_run_subprocess_drains_large_output_on_both_pipes():
+    """
+    Push a few hundred MB through stderr before writing anything to stdout:
+    reading the pipes one after the other would deadlock here.
+    """
+    lines = _STRESS_MEGABYTES * 1024
+    script = _STRESS_SCRIPT.format(lines=lines)
+    results = []
+
+    def target():
+        with disable_run_logger():
+            results.append(
+                run_subprocess.run_subprocess(
+                    working_dir=Path(__file__).parent,
+                    args=[sys.executable, "-c", script],
+                )
+            )
+
+    runner = threading.Thread(target=target, daemon=True)
+    runner.start()
+    runner.join(timeout=300)
+
+    assert not runner.is_alive(), "run_subprocess did not finish, pipes deadlocked?"
+    assert len(results) == 1
+    assert len(results[0].stdout) == lines * 1024 - 1
+    assert len(results[0].stderr) == lines * 1024 - 1
+
+
+@pytest.mark.parametrize(
+    "message, expected_level",
+    [
+        ("[INFO] message", "INFO"),
+        ("[WARN]", "WARN"),
+        ("message with [ERROR] later in the line", None),
+        ("message", None),
+    ],
+)
+def test_extract_log_level_is_anchored(message, expected_level):
+    assert run_subprocess.extract_log_level(message) == expected_level
+
+
+def test_log_forwarder_batches_lines_by_level(caplog):
+    caplog.clear()
+    caplog.set_level(logging.NOTSET)
+
+    forwarder = run_subprocess.LogForwarder(logging.getLogger(), max_batch_lines=3)
+    for i in range(4):
+        forwarder.forward(f"[INFO] row {i}\n")
+    forwarder.forward("[ERROR] failed\n")
+    forwarder.close()
+
+    assert [(r.levelname, r.getMessage()) for r in caplog.records] == [
+        ("INFO", "[INFO] row 0\n[INFO] row 1\n[INFO] row 2"),
+        ("INFO", "[INFO] row 3"),
+        ("ERROR", "[ERROR] failed"),
+    ]
+
+
+def test_log_forwarder_flushes_in_background(caplog):
+    caplog.clear()
+    caplog.set_level(logging.NOTSET)
+
+    with run_subprocess.LogForwarder(logging.getLogger(), flush_interval=0.01) as f:
+        f.forward("[INFO] waiting\n")
+        deadline = time.monotonic() + 5
+        while not caplog.records and time.monotonic() < deadline:
+            time.sleep(0.01)
+
+        assert [r.getMessage() for r in caplog.records] == ["[INFO] waiting"]
+
+
+def test_log_forwarder_rate_limits_and_summarises_drops(caplog):
+    caplog.clear()
+    caplog.set_level(logging.NOTSET)
+
+    forwarder = run_subprocess.LogForwarder(
+        logging.getLogger(),
+        rate_limits={logging.DEBUG: 1.0},
+        burst_seconds=5.0,
+    )
+    for i in range(20):
+        forwarder.forward(f"[DEBUG] row {i}\n")
+    forwarder.forward("[ERROR] never dropped\n")
+    forwarder.close()
+
+    assert forwarder.dropped == {logging.DEBUG: 15}
+    messages = [r.getMessage() for r in caplog.records]
+    assert messages[0].count("[DEBUG]") == 5
+    assert "[ERROR] never dropped" in messages
+    assert any("DEBUG=15" in m and "in total" in m for m in messages)
@@ -0,0 +1,112 @@
+#  Copyright (c) University College London Hospitals NHS Foundation Trust
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+################################################################################
+
+import json
+import threading
+
+import pytest
+
+from telemetry import ResourceSample, ResourceSampler, parse_docker_stats, parse_size
+
+
+@pytest.mark.parametrize(
+    "size, expected",
+    [("0B", 0), ("20kB", 20_000), ("1.5MiB", 1_572_864), ("2GB", 2 * 10**9)],
+)
+def test_parse_size(size, expected):
+    assert parse_size(size) == expected
+
+
+def test_parse_size_rejects_unknown_units():
+    with pytest.raises(ValueError):
+        parse_size("3 parsecs")
+
+
+def test_parse_docker_stats():
+    line = json.dumps(
+        {
+            "BlockIO": "1.2MB / 3kB",
+            "CPUPerc": "150.25%",
+            "MemUsage": "1.5GiB / 7.7GiB",
+            "Name": "omop_es-my_project-1234",
+            "NetIO": "10kB / 0B",
+        }
+    )
+
+    assert parse_docker_stats(line, timestamp=1.0) == ResourceSample(
+        timestamp=1.0,
+        cpu_percent=150.25,
+        memory_bytes=1_610_612_736,
+        block_read_bytes=1_200_000,
+        block_write_bytes=3_000,
+        net_rx_bytes=10_000,
+        net_tx_bytes=0,
+    )
+
+
+def sample(timestamp, cpu, memory, block_read):
+    return ResourceSample(timestamp, cpu, memory, block_read, 0, 0, 0)
+
+
+def test_sampler_summary():
+    sampler = ResourceSampler("container")
+    sampler.samples = [
+        sample(100.0, 50.0, 1_000, 0),
+        sample(110.0, 150.0, 3_000, 1_000),
+        sample(120.0, 100.0, 2_000, 4_000),
+    ]
+
+    summary = {row["resource"]: row for row in sampler.summary()}
+
+    assert summary["cpu_percent"] == {
+        "resource": "cpu_percent",
+        "peak": 150.0,
+        "mean": 100.0,
+        "total": 20.0,
+    }
+    assert summary["memory_bytes"]["peak"] == 3_000
+    assert summary["memory_bytes"]["mean"] == 2_000
+    assert summary["block_read_bytes"] == {
+        "resource": "block_read_bytes",
+        "peak": 300,
+        "mean": 200,
+        "total": 4_000,
+    }
+    assert [row["timestamp"] for row in sampler.table()] == [0.0, 10.0, 20.0]
+
+
+def test_sampler_samples_in_background_until_exit():
+    sampled = threading.Event()
+    samples = iter([None, sample(1.0, 10.0, 1, 0), sample(2.0, 20.0, 2, 0)])
+
+    def read(container):
+        assert container == "container"
+        value = next(samples, None)
+        if value is not None and value.timestamp == 2.0:
+            sampled.set()
+        return value
+
+    with ResourceSampler("container", interval=0.01, read=read) as sampler:
+        assert sampled.wait(timeout=5)
+
+    # Samples missing while the container starts are skipped
+    assert [s.cpu_percent for s in sampler.samples] == [10.0, 20.0]
+
+
+def test_sampler_disabled():
+    with ResourceSampler("container", interval=0, read=pytest.fail) as sampler:
+        pass
+    assert sampler.samples == []
+    assert sampler.summary() == []
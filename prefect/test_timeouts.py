@@ -0,0 +1,128 @@
+#  Copyright (c) University College London Hospitals NHS Foundation Trust
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+################################################################################
+
+import signal
+import subprocess
+import threading
+
+import pytest
+from prefect.states import Failed
+
+from timeouts import (
+    ContainerTimeout,
+    Watchdog,
+    retry_unless_timed_out,
+    stop_container,
+)
+
+
+class FakeClock:
+    def __init__(self) -> None:
+        self.now = 0.0
+
+    def __call__(self) -> float:
+        return self.now
+
+
+def test_watchdog_expires_after_wall_clock_timeout():
+    clock = FakeClock()
+    watchdog = Watchdog("c", timeout=100, inactivity=0, clock=clock)
+    with watchdog:
+        clock.now = 99
+        watchdog("still going")
+        assert watchdog.expired() is None
+        clock.now = 100
+        assert watchdog.expired() == "still running after 100s"
+
+
+def test_watchdog_expires_without_output():
+    clock = FakeClock()
+    watchdog = Watchdog("c", timeout=0, inactivity=10, clock=clock)
+    with watchdog:
+        clock.now = 9
+        watchdog("a line")
+        clock.now = 18
+        assert watchdog.expired() is None
+        clock.now = 20
+        assert watchdog.expired() == "no output for 11s"
+
+
+def test_watchdog_stops_container_and_raises_timeout():
+    stopped = threading.Event()
+    watchdog = Watchdog(
+        "omop_es-1",
+        timeout=0.01,
+        inactivity=0,
+        stop=lambda name: stopped.set(),
+        poll_interval=0.01,
+    )
+    with pytest.raises(ContainerTimeout, match="omop_es-1") as raised:
+        with watchdog:
+            # The subprocess fails once its container is stopped
+            assert stopped.wait(5)
+            raise subprocess.CalledProcessError(137, ["docker"])
+
+    assert isinstance(raised.value, TimeoutError)
+    assert isinstance(raised.value.__cause__, subprocess.CalledProcessError)
+
+
+def test_watchdog_terminates_docker_client_that_does_not_exit():
+    watchdog = Watchdog(
+        "omop_es-1",
+        timeout=0.01,
+        inactivity=0,
+        # The Docker daemon hangs, so stopping the container does nothing
+        stop=lambda name: None,
+        poll_interval=0.01,
+        client_grace=0.01,
+    )
+    with pytest.raises(ContainerTimeout):
+        with watchdog:
+            with subprocess.Popen(["sleep", "60"]) as client:
+                watchdog.attach(client.pid)
+                returncode = client.wait(timeout=5)
+            raise subprocess.CalledProcessError(returncode, ["docker"])
+
+    assert returncode == -signal.SIGTERM
+
+
+def test_timed_out_containers_are_not_retried():
+    timed_out = Failed(data=ContainerTimeout("omop_es-1", "no output for 7200s"))
+    assert not retry_unless_timed_out(None, None, timed_out)
+    assert retry_unless_timed_out(None, None, Failed(data=RuntimeError("boom")))
+
+
+def test_watchdog_leaves_other_errors_alone():
+    watchdog = Watchdog("c", timeout=0, inactivity=0, stop=pytest.fail)
+    with pytest.raises(subprocess.CalledProcessError):
+        with watchdog:
+            raise subprocess.CalledProcessError(1, ["docker"])
+
+
+def test_stop_container_kills_container_that_does_not_stop(mocker):
+    def run(args, **kwargs):
+        if args[1] == "stop":
+            raise subprocess.TimeoutExpired(args, kwargs["timeout"])
+        return subprocess.CompletedProcess(args, 0, "", "")
+
+    run_mock = mocker.patch("timeouts.subprocess.run", side_effect=run)
+
+    stop_container("c", grace_seconds=5)
+
+    assert [call.args[0] for call in run_mock.call_args_list] == [
+        ["docker", "stop", "--time", "5", "c"],
+        ["docker", "kill", "c"],
+        ["docker", "rm", "--force", "c"],
+    ]
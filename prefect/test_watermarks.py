@@ -0,0 +1,82 @@
+#  Copyright (c) University College London Hospitals NHS Foundation Trust
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+################################################################################
+
+import datetime
+
+from watermarks import WatermarkCollector, WatermarkStore, write_watermarks
+
+NOW = datetime.datetime(2025, 6, 1, 12, tzinfo=datetime.timezone.utc)
+
+
+def test_watermarks_only_move_forward(tmp_path):
+    store = WatermarkStore(tmp_path / "watermarks.json")
+    store.advance(
+        "my_project",
+        {"person": "2025-05-01T00:00:00", "visit": "2025-05-02T00:00:00"},
+        full_refresh=True,
+        now=NOW,
+    )
+    store.advance(
+        "my_project",
+        {"person": "2025-04-01T00:00:00", "visit": "2025-05-03T00:00:00"},
+        full_refresh=False,
+        now=NOW,
+    )
+
+    assert store.get("my_project") == {
+        "person": "2025-05-01T00:00:00",
+        "visit": "2025-05-03T00:00:00",
+    }
+    assert store.get("other_project") == {}
+
+
+def test_full_refresh_replaces_watermarks(tmp_path):
+    store = WatermarkStore(tmp_path / "watermarks.json")
+    store.advance("my_project", {"person": "2025-05-01"}, full_refresh=False, now=NOW)
+    store.advance("my_project", {"visit": "2025-04-01"}, full_refresh=True, now=NOW)
+
+    assert store.get("my_project") == {"visit": "2025-04-01"}
+
+
+def test_full_refresh_due(tmp_path):
+    store = WatermarkStore(tmp_path / "watermarks.json")
+    week = datetime.timedelta(days=7)
+    assert store.full_refresh_due("my_project", week, now=NOW)
+
+    store.advance("my_project", {}, full_refresh=True, now=NOW)
+    store.advance("my_project", {}, full_refresh=False, now=NOW + 2 * week)
+
+    assert not store.full_refresh_due("my_project", week, now=NOW + week / 2)
+    assert store.full_refresh_due("my_project", week, now=NOW + week)
+
+
+def test_collector_and_window_file(tmp_path):
+    collector = WatermarkCollector()
+    for line in [
+        "[WATERMARK] person 2025-05-01T10:00:00",
+        "[INFO] person 2025-05-02T10:00:00",
+        "[WATERMARK] measurement 2025-05-01T09:00:00",
+        "[WATERMARK] person 2025-05-01T11:00:00",
+    ]:
+        collector(line)
+
+    assert collector.tables == {
+        "person": "2025-05-01T11:00:00",
+        "measurement": "2025-05-01T09:00:00",
+    }
+    path = write_watermarks(tmp_path / "window" / "my_project.txt", collector.tables)
+    assert path.read_text() == (
+        "measurement 2025-05-01T09:00:00\nperson 2025-05-01T11:00:00\n"
+    )
@@ -0,0 +1,202 @@
+#  Copyright (c) University College London Hospitals NHS Foundation Trust
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+################################################################################
+
+import asyncio
+import os
+import signal
+import subprocess
+import threading
+import time
+from contextlib import suppress
+from typing import Any, Callable, Optional
+
+from prefect import logging
+from prefect.states import State
+
+DEFAULT_TIMEOUT_SECONDS = 24 * 3600.0
+DEFAULT_INACTIVITY_SECONDS = 2 * 3600.0
+# Seconds a container gets to exit after SIGTERM, before it is killed
+DEFAULT_GRACE_SECONDS = 60.0
+# Seconds to wait for the Docker daemon itself, which can also hang
+DOCKER_COMMAND_TIMEOUT = 60.0
+
+logger = logging.get_logger()
+
+
+class ContainerTimeout(TimeoutError):
+    """A container was stopped by a `Watchdog`."""
+
+    def __init__(self, container: str, reason: str) -> None:
+        super().__init__(f"Stopped container {container}: {reason}")
+        self.container = container
+        self.reason = reason
+
+
+def stop_container(name: str, grace_seconds: float = DEFAULT_GRACE_SECONDS) -> None:
+    """
+    Stop and remove a container by name: SIGTERM first, `docker kill` if it
+    hasn't exited after `grace_seconds`, or if `docker stop` itself hangs.
+    """
+    try:
+        result = subprocess.run(
+            ["docker", "stop", "--time", str(round(grace_seconds)), name],
+            capture_output=True,
+            text=True,
+            timeout=grace_seconds + DOCKER_COMMAND_TIMEOUT,
+        )
+        stopped = result.returncode == 0
+    except subprocess.TimeoutExpired:
+        stopped = False
+    if not stopped:
+        logger.warning("Failed to stop container %s, killing it", name)
+        _docker("kill", name)
+    _docker("rm", "--force", name)
+    logger.info("Stopped and removed container %s", name)
+
+
+def _docker(*args: str) -> None:
+    try:
+        result = subprocess.run(
+            ["docker", *args],
+            capture_output=True,
+            text=True,
+            timeout=DOCKER_COMMAND_TIMEOUT,
+        )
+    except subprocess.TimeoutExpired:
+        logger.warning("docker %s timed out", " ".join(args))
+        return
+    # The container may already be gone, e.g. removed by `docker compose run --rm`
+    if result.returncode != 0:
+        logger.debug("docker %s failed: %s", " ".join(args), result.stderr.strip())
+
+
+def retry_unless_timed_out(task: Any, task_run: Any, state: State) -> bool:
+    """
+    Retry condition of tasks running a container under a `Watchdog`. A container
+    that hung or ran for too long would most likely do so again, holding its
+    slots for as long again, so a `ContainerTimeout` isn't retried.
+    """
+    # The exception raised by the task is the data of its failed state
+    return not isinstance(state.data, ContainerTimeout)
+
+
+class Watchdog:
+    """
+    Stop a container that runs for longer than `timeout` seconds in total, or
+    that prints nothing for `inactivity` seconds, for the duration of the block.
+
+    Pass the watchdog as a line handler to `run_subprocess` for it to see the
+    output. Stopping the container ends the subprocess running it, after which
+    the block raises a `ContainerTimeout` in place of the subprocess's error,
+    so the task fails at once and frees the slots it holds. Use `async with` in
+    coroutines.
+
+    If the Docker daemon hangs, stopping the container may not end the docker
+    client running it. Pass `attach` to `run_subprocess` as its `on_start`, and
+    the client is terminated, then killed, if it is still running
+    `client_grace` seconds after each attempt.
+
+    Args:
+        container: Name of the container
+        timeout: Wall-clock limit in seconds, disabled if not positive
+        inactivity: Limit in seconds without any output, disabled if not positive
+        stop: Function stopping a container by name, `stop_container` by default
+        poll_interval: Seconds between checks of the limits
+        client_grace: Seconds the docker client gets to exit at each step
+        clock: Monotonic clock, for tests
+    """
+
+    def __init__(
+        self,
+        container: str,
+        timeout: float = DEFAULT_TIMEOUT_SECONDS,
+        inactivity: float = DEFAULT_INACTIVITY_SECONDS,
+        stop: Callable[[str], None] = stop_container,
+        poll_interval: float = 10.0,
+        client_grace: float = DOCKER_COMMAND_TIMEOUT,
+        clock: Callable[[], float] = time.monotonic,
+    ) -> None:
+        self.container = container
+        self.timeout = timeout
+        self.inactivity = inactivity
+        self.stop = stop
+        self.poll_interval = poll_interval
+        self.client_grace = client_grace
+        self.clock = clock
+        self.reason: Optional[str] = None
+        self._client_pid: Optional[int] = None
+        self._started = self._last_output = clock()
+        self._done = threading.Event()
+        self._thread = threading.Thread(target=self._watch, daemon=True)
+
+    def __call__(self, line: str) -> None:
+        self._last_output = self.clock()
+
+    def attach(self, pid: int) -> None:
+        """Set the process of the docker client running the container."""
+        self._client_pid = pid
+
+    def __enter__(self) -> "Watchdog":
+        self._started = self._last_output = self.clock()
+        if self.timeout > 0 or self.inactivity > 0:
+            self._thread.start()
+        return self
+
+    def __exit__(self, exc_type, exc, traceback) -> None:
+        self._done.set()
+        if self._thread.is_alive():
+            self._thread.join()
+        # Other errors, e.g. cancellation, are not caused by the watchdog
+        if self.reason is not None and isinstance(exc, subprocess.CalledProcessError):
+            raise ContainerTimeout(self.container, self.reason) from exc
+
+    async def __aenter__(self) -> "Watchdog":
+        return self.__enter__()
+
+    async def __aexit__(self, *exc_info) -> None:
+        await asyncio.to_thread(self.__exit__, *exc_info)
+
+    def expired(self) -> Optional[str]:
+        """Why the container should be stopped, or None if it can keep running."""
+        now = self.clock()
+        if self.timeout > 0 and now - self._started >= self.timeout:
+            return f"still running after {self.timeout:.0f}s"
+        if self.inactivity > 0 and now - self._last_output >= self.inactivity:
+            return f"no output for {now - self._last_output:.0f}s"
+        return None
+
+    def _watch(self) -> None:
+        while not self._done.wait(self.poll_interval):
+            reason = self.expired()
+            if reason is None:
+                continue
+            logger.error("Stopping container %s: %s", self.container, reason)
+            self.reason = reason
+            try:
+                self.stop(self.container)
+            except Exception:
+                logger.exception("Failed to stop container %s", self.container)
+            # The block ends once the docker client has exited
+            for sig in (signal.SIGTERM, signal.SIGKILL):
+                if self._done.wait(self.client_grace) or self._client_pid is None:
+                    return
+                logger.error(
+                    "Docker client of container %s is still running, sending %s",
+                    self.container,
+                    sig.name,
+                )
+                with suppress(ProcessLookupError):
+                    os.kill(self._client_pid, sig)
+            return
@@ -0,0 +1,103 @@
+#  Copyright (c) University College London Hospitals NHS Foundation Trust
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+################################################################################
+
+import datetime
+import re
+from pathlib import Path
+from typing import Optional
+
+from json_store import JsonStore
+
+WATERMARK_PATTERN = re.compile(r"\[WATERMARK\]\s+(\S+)\s+(\S+)")
+DEFAULT_FULL_REFRESH_DAYS = 7
+
+
+class WatermarkStore:
+    """
+    High-watermarks of the incremental extractions of each project: for every
+    table, the latest change extracted so far, as reported by omop_es. Values
+    are ISO 8601 timestamps, so the latest one is also the greatest string.
+
+    Args:
+        path: Path of the JSON file backing the store
+    """
+
+    def __init__(self, path: Path) -> None:
+        self.store = JsonStore(path)
+
+    def get(self, settings_id: str) -> dict[str, str]:
+        """Watermark of each table of a project."""
+        return self.store.read().get(settings_id, {}).get("tables", {})
+
+    def full_refresh_due(
+        self,
+        settings_id: str,
+        every: datetime.timedelta,
+        now: Optional[datetime.datetime] = None,
+    ) -> bool:
+        """Whether the last full extraction of a project is older than `every`."""
+        last = self.store.read().get(settings_id, {}).get("last_full_refresh")
+        if last is None:
+            return True
+        now = now or datetime.datetime.now(datetime.timezone.utc)
+        return now - datetime.datetime.fromisoformat(last) >= every
+
+    def advance(
+        self,
+        settings_id: str,
+        tables: dict[str, str],
+        full_refresh: bool,
+        now: Optional[datetime.datetime] = None,
+    ) -> None:
+        """
+        Record the watermarks reached by a successful extraction. Watermarks
+        only move forward, except after a full refresh, which replaces them.
+        """
+        now = now or datetime.datetime.now(datetime.timezone.utc)
+        with self.store.update() as data:
+            project = data.setdefault(settings_id, {})
+            recorded = {} if full_refresh else project.get("tables", {})
+            for table, value in tables.items():
+                recorded[table] = max(value, recorded.get(table, value))
+            project["tables"] = recorded
+            project["updated"] = now.isoformat()
+            if full_refresh:
+                project["last_full_refresh"] = now.isoformat()
+
+
+class WatermarkCollector:
+    """
+    Collect the watermarks reported by the omop_es container, as lines of the
+    form `[WATERMARK] <table> <timestamp>`.
+    """
+
+    def __init__(self) -> None:
+        self.tables: dict[str, str] = {}
+
+    def __call__(self, line: str) -> None:
+        if not line.startswith("[WATERMARK]"):
+            return
+        match = WATERMARK_PATTERN.match(line)
+        if match:
+            self.tables[match.group(1)] = match.group(2)
+
+
+def write_watermarks(path: Path, tables: dict[str, str]) -> Path:
+    """Write watermarks for the container, one `<table> <timestamp>` per line."""
+    path.parent.mkdir(parents=True, exist_ok=True)
+    path.write_text(
+        "".join(f"{table} {value}\n" for table, value in sorted(tables.items()))
+    )
+    return path